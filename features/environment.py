@@ -1,47 +1,33 @@
 """Behave test environment"""
 from pathlib import Path
 import sqlite3
-from textwrap import dedent
+
+import golden_db
 
 def before_all(context):
     """
     Create test database and global connection.
-    Each feature creates and drops the feature's schema.
+    The empty, prepared schema is built once and cached.
     """
+    context.config.golden = golden_db.build_golden(
+        Path("data/golden"), Path("activation_source.schema"), []
+    )
     connection = sqlite3.connect("data/temp.db")
     context.config.connection = connection
 
 def after_all(context):
     """Remove test database"""
+    context.config.connection.close()
     Path("data/temp.db").unlink()
-    
+
 def before_feature(context, feature):
-    print(f"Building schema for {feature}")
-    connection = context.config.connection
-    
-    cursor = connection.cursor()
-    cursor.execute(dedent("""
-        CREATE TABLE service(
-            service_name CHAR(16)
-        )
-    """))
-    cursor.execute(dedent("""
-        CREATE TABLE customer(
-            customer_name CHAR(16)
-        )
-    """))
-    cursor.execute(dedent("""
-            CREATE TABLE customer_device(
-            customer_id INTEGER REFERENCES customer(rowid),
-            device_name CHAR(64)
-        )
-    """))
-    connection.commit()
-    cursor.close()
+    """Each feature starts from a fresh clone of the golden schema."""
+    print(f"Cloning schema for {feature}")
+    golden_db.clone(context.config.golden, context.config.connection)
 
 def before_scenario(context, scenario):
     context.config.cleanup = []
-    
+
 def after_scenario(context, scenario):
     for path in context.config.cleanup:
         print(f"Removing {path}")
@@ -0,0 +1,278 @@
+"""
+Asyncio load of many activation source files at once.
+
+Each source is a file, a directory (its ``*.csv`` files), or a glob
+pattern. Each file is validated, looked up, and transformed by
+:py:mod:`python_load_process`'s stages, in an executor:
+a process pool by default, because parsing holds the GIL, or, with
+``--executor thread``, a thread pool, for a free-threaded build.
+Each file has its own connection, opened and closed by its worker.
+
+At most ``--max-files`` files are in flight: being loaded, or loaded
+and waiting for the writer. One writer, on the event loop, appends
+every file's rows to the one target file, in source order or,
+with ``--unordered``, as each file is finished.
+A file that can't be loaded is reported, and the others carry on.
+
+..  code-block:: bash
+
+    python src/async_load_process.py --max-files 16 'data/hourly/*.csv'
+
+Follow-up processing is the ``sqlite3 .import`` shown in
+:py:mod:`python_load_process`.
+"""
+
+import argparse
+import asyncio
+from collections import Counter
+from collections.abc import Callable, Iterable
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+import csv
+from dataclasses import dataclass
+from functools import partial
+import glob
+import os
+from pathlib import Path
+import sys
+from typing import Any
+
+import connection_factory
+import pipeline
+import python_load_process
+import timestamps
+
+
+@dataclass
+class FileResult:
+    """The rows loaded from one source file, with its counts."""
+
+    path: Path
+    rows: list[dict[str, Any]]
+    counts: Counter[str]
+    stats: list[pipeline.StageStats]
+
+
+def source_paths(sources: Iterable[str | Path]) -> list[Path]:
+    """
+    Files, the ``*.csv`` files in directories, and the matches of glob
+    patterns, each sorted, without duplicates.
+    """
+    paths: list[Path] = []
+    for source in sources:
+        if Path(source).is_dir():
+            matches = sorted(Path(source).glob("*.csv"))
+        elif any(char in str(source) for char in "*?["):
+            matches = sorted(map(Path, glob.glob(str(source))))
+        else:
+            matches = [Path(source)]
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def load_file(
+    database: str,
+    profile: str,
+    timestamps_mode: str,
+    geohash_precision: int | None,
+    path: Path,
+) -> FileResult:
+    """
+    Runs in an executor. All but the output, for one file.
+    The file has its own connection, closed when it's done,
+    so nothing is left open in the pool's workers.
+    """
+    connection = connection_factory.connect(database, profile)
+    counts = Counter()
+    references = python_load_process.References(connection)
+    loader = pipeline.Pipeline(
+        *python_load_process.loader_stages(
+            counts, references, timestamps_mode, geohash_precision
+        )
+    )
+    try:
+        with path.open() as source_file:
+            rows = list(loader.run(csv.DictReader(source_file)))
+    finally:
+        references.close()
+        connection.close()
+    return FileResult(path, rows, counts, loader.stats)
+
+
+async def ingest(
+    paths: list[Path],
+    load: Callable[[Path], FileResult],
+    writer: csv.DictWriter,
+    executor: Executor,
+    max_files: int = 8,
+    ordered: bool = True,
+) -> tuple[Counter[str], list[pipeline.StageStats]]:
+    """
+    Load the files in the executor, writing the rows of each one as it's
+    finished, in order of ``paths`` or of completion.
+    Returns the total counts and stats, with the failed files counted.
+    """
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(max_files)
+    started: asyncio.Queue = asyncio.Queue()
+    finished: asyncio.Queue = asyncio.Queue()
+
+    def done(path: Path, future: asyncio.Future) -> None:
+        finished.put_nowait((path, future))
+
+    async def start_all() -> None:
+        for path in paths:
+            await in_flight.acquire()
+            future = loop.run_in_executor(executor, load, path)
+            future.add_done_callback(partial(done, path))
+            started.put_nowait((path, future))
+
+    counts = Counter()
+    stats: list[pipeline.StageStats] = []
+    writing = pipeline.Pipeline(
+        pipeline.Stage(
+            "write", partial(python_load_process.written, writer)
+        )
+    )
+    starter = asyncio.create_task(start_all())
+    try:
+        results = started if ordered else finished
+        for _ in paths:
+            path, future = await results.get()
+            try:
+                result = await future
+            # Whatever a bad file raises, the other files carry on.
+            except Exception as error:  # noqa: BLE001
+                print(f"{path}: {error!r}")
+                counts["failed files"] += 1
+                in_flight.release()
+                continue
+            writing.drain(result.rows)
+            in_flight.release()
+            counts.update(result.counts)
+            counts["files"] += 1
+            if not stats:
+                stats = result.stats
+            else:
+                for total, file_stage in zip(stats, result.stats):
+                    total.add(file_stage)
+        await starter
+    finally:
+        starter.cancel()
+    return counts, stats + writing.stats
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data/activation_load.csv"),
+    )
+    parser.add_argument(
+        "source",
+        nargs="+",
+        help="files, directories of *.csv files, or glob patterns",
+    )
+    parser.add_argument(
+        "--max-files",
+        action="store",
+        type=int,
+        default=8,
+        help="files being loaded, or waiting to be written",
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--executor",
+        action="store",
+        choices=["process", "thread"],
+        default="process",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        default=False,
+        help="write each file's rows as soon as it's loaded",
+    )
+    timestamps.add_timestamps_option(parser)
+    parser.add_argument(
+        "--geohash",
+        action="store",
+        type=int,
+        default=None,
+        metavar="PRECISION",
+        help="add a geohash column; see geohash.py add",
+    )
+    connection_factory.add_profile_option(parser, "read-extract")
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect: str,
+    target: Path,
+    sources: list[str],
+    profile: str = "read-extract",
+    timestamps_mode: str = "raw",
+    geohash_precision: int | None = None,
+    max_files: int = 8,
+    workers: int | None = None,
+    executor_kind: str = "process",
+    ordered: bool = True,
+) -> None:
+    paths = source_paths(sources)
+    fieldnames = (
+        python_load_process.GEOHASH_FIELDNAMES
+        if geohash_precision
+        else python_load_process.OUTPUT_FIELDNAMES
+    )
+    load = partial(
+        load_file,
+        database_connect,
+        profile,
+        timestamps_mode,
+        geohash_precision,
+    )
+    if executor_kind == "process":
+        executor = ProcessPoolExecutor(workers)
+    else:
+        executor = ThreadPoolExecutor(workers)
+    with executor, target.open("w", newline="") as target_file:
+        writer = csv.DictWriter(target_file, fieldnames)
+        writer.writeheader()
+        counts, stats = asyncio.run(
+            ingest(paths, load, writer, executor, max_files, ordered)
+        )
+
+    print(f"Loaded {counts['files']} of {len(paths)} files")
+    print(f"Failed {counts['failed files']} files")
+    python_load_process.report_counts(counts)
+    print(pipeline.report(stats))
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(
+        options.db,
+        options.output,
+        options.source,
+        options.profile,
+        options.timestamps,
+        options.geohash,
+        options.max_files,
+        options.workers,
+        options.executor,
+        not options.unordered,
+    )
@@ -0,0 +1,407 @@
+"""
+Benchmarks for alternative designs.
+
+Each benchmark builds synthetic databases in a temporary directory,
+times the competing alternatives, and prints a small report.
+
+..  code-block:: bash
+
+    python src/benchmark.py schema --customers 100000 --activations 1000000
+    python src/benchmark.py aggregate
+    python src/benchmark.py spatial --activations 10000000
+    python src/benchmark.py join --services 100 --services 100000
+"""
+
+import argparse
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager, redirect_stdout
+import io
+from pathlib import Path
+import random
+import sqlite3 as db
+import sys
+import tempfile
+import time
+from typing import Any
+
+import connection_factory
+import efficiencies
+import extract_engine
+import service_counts
+import spatial_index
+import sql_db_preparation
+
+
+def timed(function: Callable[..., Any], *args: Any) -> float:
+    """Elapsed seconds for one call of ``function(*args)``."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def report(
+    benchmark: str, results: dict[tuple[str, str], float]
+) -> None:
+    """Print ``{(variant, measurement): seconds}`` as a table."""
+    print(f"{benchmark}")
+    for (variant, measurement), seconds in results.items():
+        print(f"  {variant:12s} {measurement:28s} {seconds:10.4f}s")
+
+
+@contextmanager
+def temporary_database(name: str) -> Iterator[db.Connection]:
+    """A scratch database file, removed afterwards."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        connection = db.connect(Path(temp_dir) / f"{name}.db")
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+
+def synthetic_names(prefix: str, count: int) -> list[str]:
+    return [f"{prefix}{n:08d}" for n in range(count)]
+
+
+def populate(
+    connection: db.Connection,
+    layout: str,
+    customers: int,
+    services: int,
+    activations: int,
+    seed: int = 42,
+) -> None:
+    """
+    Build one of the ``sql_db_preparation.LAYOUTS`` and fill it
+    with synthetic rows. Each customer has one device.
+    """
+    rng = random.Random(seed)
+    with redirect_stdout(io.StringIO()):
+        sql_db_preparation.LAYOUTS[layout](connection)
+    cursor = connection.cursor()
+    cursor.executemany(
+        "INSERT INTO customer(customer_name) VALUES(?)",
+        ((name,) for name in synthetic_names("customer", customers)),
+    )
+    cursor.execute(
+        "INSERT INTO device_type(device_type_name) VALUES('t')"
+    )
+    cursor.execute(
+        "INSERT INTO customer_device(customer_id, type_id, device_name) "
+        "SELECT rowid, 1, 'device' FROM customer"
+    )
+    cursor.executemany(
+        "INSERT INTO service(service_name) VALUES(?)",
+        ((name,) for name in synthetic_names("service", services)),
+    )
+    cursor.executemany(
+        "INSERT INTO customer_device_service("
+        "customer_device_id, service_id, start, latitude, longitude) "
+        "VALUES(?, ?, ?, ?, ?)",
+        (
+            (
+                rng.randint(1, customers),
+                rng.randint(1, services),
+                "2024-07-30T09:19:00+00:00",
+                rng.uniform(-90, 90),
+                rng.uniform(-180, 180),
+            )
+            for _ in range(activations)
+        ),
+    )
+    connection.commit()
+    cursor.close()
+
+
+def schema_benchmark(
+    customers: int, services: int, activations: int, lookups: int
+) -> dict[tuple[str, str], float]:
+    """Lookup by natural key and join speed of each layout."""
+    rng = random.Random(42)
+    names = rng.choices(
+        synthetic_names("customer", customers), k=lookups
+    )
+
+    def lookup(connection: db.Connection) -> None:
+        cursor = connection.cursor()
+        for name in names:
+            cursor.execute(
+                "SELECT rowid FROM customer WHERE customer_name = ?",
+                (name,),
+            )
+            cursor.fetchone()
+        cursor.close()
+
+    def service_join(connection: db.Connection) -> None:
+        connection.execute(
+            "SELECT service.service_name, count(*) "
+            "FROM customer_device_service "
+            "JOIN service "
+            "ON service.rowid = customer_device_service.service_id "
+            "GROUP BY service.service_name"
+        ).fetchall()
+
+    def customer_join(connection: db.Connection) -> None:
+        connection.execute(
+            "SELECT customer.customer_name, count(*) "
+            "FROM customer_device_service "
+            "JOIN customer_device "
+            "ON customer_device.rowid "
+            "= customer_device_service.customer_device_id "
+            "JOIN customer "
+            "ON customer.rowid = customer_device.customer_id "
+            "GROUP BY customer.customer_name"
+        ).fetchall()
+
+    results = {}
+    for layout in sql_db_preparation.LAYOUTS:
+        with temporary_database(layout) as connection:
+            results[layout, "populate"] = timed(
+                populate,
+                connection,
+                layout,
+                customers,
+                services,
+                activations,
+            )
+            results[layout, f"{lookups} name lookups"] = timed(
+                lookup, connection
+            )
+            results[layout, "service join"] = timed(
+                service_join, connection
+            )
+            results[layout, "customer join"] = timed(
+                customer_join, connection
+            )
+    return results
+
+
+def aggregate_benchmark(
+    scales: list[tuple[int, int]],
+) -> dict[tuple[str, str], float]:
+    """
+    Each ``extract_engine`` strategy at each (services, activations)
+    scale. The ``auto`` choice among the scans is shown for comparison;
+    the ``materialized`` counts are built after choosing it.
+    """
+    results = {}
+    for services, activations in scales:
+        scale = f"{services}/{activations}"
+        with temporary_database(scale.replace("/", "_")) as connection:
+            populate(connection, "legacy", 1_000, services, activations)
+            sizes = extract_engine.table_sizes(connection)
+            with redirect_stdout(io.StringIO()):
+                service_counts.make_service_counts(connection)
+            for name, strategy in extract_engine.STRATEGIES.items():
+                results[name, scale] = timed(strategy, connection)
+            auto = extract_engine.choose_strategy(sizes)
+            results[f"auto={auto}", scale] = results[auto, scale]
+    return results
+
+
+def spatial_benchmark(
+    activations: int, queries: int, size: float
+) -> dict[tuple[str, str], float]:
+    """
+    Bounding-box and radius counts, with the R*Tree and with a scan,
+    for ``queries`` random boxes ``size`` degrees on a side.
+    """
+    rng = random.Random(42)
+    boxes = [
+        (lat, lon, lat + size, lon + size)
+        for lat, lon in (
+            (rng.uniform(-90, 90 - size), rng.uniform(-180, 180 - size))
+            for _ in range(queries)
+        )
+    ]
+    km = size * spatial_index.KM_PER_DEGREE / 2
+
+    def box_counts(connection: db.Connection, indexed: bool) -> None:
+        for box in boxes:
+            spatial_index.in_box(connection, *box, indexed=indexed)
+
+    def radius_counts(connection: db.Connection, indexed: bool) -> None:
+        for south, west, north, east in boxes:
+            spatial_index.in_radius(
+                connection,
+                (south + north) / 2,
+                (west + east) / 2,
+                km,
+                indexed=indexed,
+            )
+
+    results = {}
+    with temporary_database("spatial") as connection:
+        connection_factory.register_functions(connection)
+        results["both", "populate"] = timed(
+            populate, connection, "legacy", 1_000, 100, activations
+        )
+        for variant, indexed in (("scan", False), ("rtree", True)):
+            if indexed:
+                with redirect_stdout(io.StringIO()):
+                    results[variant, "create index"] = timed(
+                        spatial_index.make_spatial_index, connection
+                    )
+            results[variant, f"{queries} box counts"] = timed(
+                box_counts, connection, indexed
+            )
+            results[variant, f"{queries} radius counts"] = timed(
+                radius_counts, connection, indexed
+            )
+    return results
+
+
+class RowidServiceNameMapping(efficiencies.ServiceNameMapping):
+    """The per-row lookup, against the ``service`` table's rowid."""
+
+    query = (
+        "SELECT rowid AS service_id, service_name "
+        "FROM service WHERE rowid = :service_id"
+    )
+
+
+def join_benchmark(
+    cardinalities: list[int], activations: int
+) -> dict[tuple[str, str], float]:
+    """
+    Service names for every activation: a cached lookup per row,
+    as in ``efficiencies.lookup_something``, against batched IN-list
+    lookups, and a hash join built from the whole ``service`` table,
+    at several numbers of services.
+    """
+    activation_query = "SELECT service_id FROM customer_device_service"
+    service_query = (
+        "SELECT rowid AS service_id, service_name FROM service"
+    )
+
+    def lookup(connection: db.Connection) -> None:
+        connection.row_factory = db.Row
+        mapping = RowidServiceNameMapping(connection)
+        for row in efficiencies.query_rows(
+            connection, activation_query
+        ):
+            row["service_name"] = mapping[row["service_id"]][
+                "service_name"
+            ]
+        mapping.close()
+
+    def batched(connection: db.Connection) -> None:
+        lookup = efficiencies.BatchLookup(
+            connection,
+            "SELECT rowid AS service_id, service_name "
+            "FROM service WHERE rowid IN ({keys})",
+            "service_id",
+        )
+        for row in efficiencies.batched_lookup(
+            lookup,
+            efficiencies.query_rows(connection, activation_query),
+            "service_id",
+            "service",
+        ):
+            row["service_name"] = row["service"][1]
+        lookup.close()
+
+    def hash_join(connection: db.Connection) -> None:
+        stats = efficiencies.JoinStats()
+        for row in efficiencies.hash_join(
+            efficiencies.query_rows(connection, service_query),
+            efficiencies.query_rows(connection, activation_query),
+            "service_id",
+            stats=stats,
+        ):
+            pass
+        assert stats.output_rows == activations, stats
+
+    results = {}
+    for services in cardinalities:
+        scale = f"{services}/{activations}"
+        with temporary_database(f"join_{services}") as connection:
+            populate(connection, "legacy", 1_000, services, activations)
+            results["lookup", scale] = timed(lookup, connection)
+            results["batched", scale] = timed(batched, connection)
+            results["hash join", scale] = timed(hash_join, connection)
+    return results
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    schema = subparsers.add_parser(
+        "schema", help="legacy vs. strict physical layout"
+    )
+    schema.add_argument("--customers", type=int, default=10_000)
+    schema.add_argument("--services", type=int, default=100)
+    schema.add_argument("--activations", type=int, default=100_000)
+    schema.add_argument("--lookups", type=int, default=1_000)
+
+    aggregate = subparsers.add_parser(
+        "aggregate", help="extract_engine strategies at several scales"
+    )
+    aggregate.add_argument(
+        "--scale",
+        type=lambda text: tuple(map(int, text.split("/"))),
+        action="append",
+        help="services/activations, e.g., 100/1000000; repeatable",
+    )
+
+    spatial = subparsers.add_parser(
+        "spatial", help="R*Tree vs. scan for location queries"
+    )
+    spatial.add_argument("--activations", type=int, default=10_000_000)
+    spatial.add_argument("--queries", type=int, default=20)
+    spatial.add_argument(
+        "--size", type=float, default=1.0, help="box size in degrees"
+    )
+
+    join = subparsers.add_parser(
+        "join", help="per-row lookups vs. a hash join"
+    )
+    join.add_argument(
+        "--services",
+        type=int,
+        action="append",
+        help="number of services; repeatable",
+    )
+    join.add_argument("--activations", type=int, default=1_000_000)
+    return parser.parse_args(argv)
+
+
+def main(options: argparse.Namespace) -> None:
+    match options.benchmark:
+        case "schema":
+            results = schema_benchmark(
+                options.customers,
+                options.services,
+                options.activations,
+                options.lookups,
+            )
+            report("schema", results)
+        case "aggregate":
+            scales = options.scale or [
+                (10, 10_000),
+                (100, 1_000_000),
+                (10_000, 1_000_000),
+                (100_000, 200_000),
+                (200_000, 200_000),
+            ]
+            results = aggregate_benchmark(scales)
+            report("aggregate services/activations", results)
+        case "spatial":
+            results = spatial_benchmark(
+                options.activations, options.queries, options.size
+            )
+            report(
+                f"spatial {options.activations} activations", results
+            )
+        case "join":
+            results = join_benchmark(
+                options.services or [100, 10_000, 100_000, 1_000_000],
+                options.activations,
+            )
+            report("join services/activations", results)
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(options)
@@ -0,0 +1,319 @@
+"""
+Checkpoints, so a load of a very large file can be resumed.
+
+The ``load_checkpoint`` control table has a row for each loader and
+source file: the byte offset and row number just past the last row
+whose results are safely committed.
+
+-   The SQL loader saves its checkpoint in the same transaction as
+    each batch of inserts, and each batch of the persist step, so the
+    checkpoint and the rows can't disagree.
+
+-   The Python loader's output is a CSV file. Its control table is in
+    a separate small database beside the output file, because its
+    connection to the main database is read-only. At each checkpoint,
+    the output is flushed to disk before the checkpoint, with the
+    output's size, is committed. On a resume, the output is truncated
+    to that size: anything written after the checkpoint is written
+    again.
+
+Either way, a crash costs at most one batch.
+
+Checkpoints are optional: the SQL loader saves them with
+``--checkpoint``, the Python loader with ``--checkpoint-every``, and
+both with ``--resume``. When the whole load is complete, its
+checkpoints are removed: the SQL loader's rows, and the Python
+loader's control database.
+
+An :py:class:`OffsetReader` reads the source, like a
+``csv.DictReader``, keeping track of the byte offset. On a resume,
+it reads the header, then seeks straight to the checkpoint's offset.
+
+..  code-block:: bash
+
+    python src/sql_load_process.py --batch-size 10000 --checkpoint data/activation_source.csv
+    python src/sql_load_process.py --batch-size 10000 --resume data/activation_source.csv
+
+"""
+
+from collections.abc import Iterable, Iterator
+import csv
+from dataclasses import dataclass, field
+import json
+import os
+from pathlib import Path
+import sqlite3 as db
+from textwrap import dedent
+from typing import Any, BinaryIO, TextIO
+
+import connection_factory
+
+
+@dataclass
+class Checkpoint:
+    """
+    How far one loader got with one source file.
+    The SQL loader sets ``loaded`` when the whole file is in the
+    ``activation`` table, and ``persisted`` to the last ``activation``
+    rowid persisted. The Python loader sets ``target_offset`` to the
+    size of its output, and keeps its ``counts``.
+    """
+
+    loader: str
+    source: str
+    byte_offset: int = 0
+    row_number: int = 0
+    loaded: bool = False
+    persisted: int | None = None
+    target_offset: int | None = None
+    counts: dict[str, int] = field(default_factory=dict)
+
+
+def make_checkpoint_table(connection: db.Connection) -> None:
+    create_checkpoint_table = dedent("""
+        CREATE TABLE IF NOT EXISTS load_checkpoint(
+            loader TEXT NOT NULL,
+            source TEXT NOT NULL,
+            byte_offset INTEGER NOT NULL,
+            row_number INTEGER NOT NULL,
+            loaded INTEGER NOT NULL,
+            persisted INTEGER,
+            target_offset INTEGER,
+            counts TEXT NOT NULL,
+            updated TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY(loader, source)
+        )
+        """)
+    cursor = connection.cursor()
+    cursor.execute(create_checkpoint_table)
+    connection.commit()
+    cursor.close()
+
+
+def control_path(target: Path) -> Path:
+    return target.with_name(f"{target.name}.checkpoint.db")
+
+
+def control_database(target: Path) -> db.Connection:
+    """The control database beside an output file."""
+    connection = connection_factory.connect(
+        control_path(target), "bulk-load"
+    )
+    make_checkpoint_table(connection)
+    return connection
+
+
+def remove_control_database(target: Path) -> None:
+    """
+    After a complete load, there's nothing to resume.
+    The connection must be closed first. The WAL files are
+    usually gone by then, but not always.
+    """
+    path = control_path(target)
+    for suffix in ("", "-wal", "-shm"):
+        path.with_name(f"{path.name}{suffix}").unlink(missing_ok=True)
+
+
+def source_key(source: Path) -> str:
+    return str(source.resolve())
+
+
+def start(
+    connection: db.Connection, loader: str, source: Path, resume: bool
+) -> Checkpoint:
+    """
+    The saved checkpoint, when resuming.
+    Otherwise, the saved checkpoint is removed, and this starts over.
+    """
+    select_checkpoint = dedent("""
+        SELECT byte_offset, row_number, loaded, persisted,
+            target_offset, counts
+        FROM load_checkpoint
+        WHERE loader = :loader AND source = :source
+        """)
+    delete_checkpoint = dedent("""
+        DELETE FROM load_checkpoint
+        WHERE loader = :loader AND source = :source
+        """)
+    key = {"loader": loader, "source": source_key(source)}
+    cursor = connection.cursor()
+    if not resume:
+        cursor.execute(delete_checkpoint, key)
+        connection.commit()
+        cursor.close()
+        return Checkpoint(loader, key["source"])
+    cursor.row_factory = db.Row
+    cursor.execute(select_checkpoint, key)
+    saved = cursor.fetchone()
+    cursor.close()
+    if saved is None:
+        return Checkpoint(loader, key["source"])
+    state = Checkpoint(
+        loader,
+        key["source"],
+        byte_offset=saved["byte_offset"],
+        row_number=saved["row_number"],
+        loaded=bool(saved["loaded"]),
+        persisted=saved["persisted"],
+        target_offset=saved["target_offset"],
+        counts=json.loads(saved["counts"]),
+    )
+    if state.byte_offset > source.stat().st_size:
+        raise ValueError(
+            f"{source} is smaller than its checkpoint; it was replaced"
+        )
+    print(
+        f"resuming {source} after row {state.row_number}, "
+        f"byte {state.byte_offset}"
+    )
+    return state
+
+
+def has_checkpoints(connection: db.Connection, loader: str) -> bool:
+    """True if the loader has anything to resume."""
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT count(*) FROM load_checkpoint
+            WHERE loader = :loader
+        """),
+        {"loader": loader},
+    )
+    (saved,) = cursor.fetchone()
+    cursor.close()
+    return saved > 0
+
+
+def finish(
+    connection: db.Connection, loader: str, sources: Iterable[Path]
+) -> None:
+    """After a complete load, remove its sources' checkpoints."""
+    delete_checkpoint = dedent("""
+        DELETE FROM load_checkpoint
+        WHERE loader = :loader AND source = :source
+        """)
+    cursor = connection.cursor()
+    cursor.executemany(
+        delete_checkpoint,
+        [
+            {"loader": loader, "source": source_key(source)}
+            for source in sources
+        ],
+    )
+    connection.commit()
+    cursor.close()
+
+
+def save(connection: db.Connection, checkpoint: Checkpoint) -> None:
+    """Record the checkpoint. The caller commits it with its rows."""
+    save_checkpoint = dedent("""
+        INSERT OR REPLACE INTO load_checkpoint(
+            loader, source, byte_offset, row_number, loaded,
+            persisted, target_offset, counts
+        )
+        VALUES(
+            :loader, :source, :byte_offset, :row_number, :loaded,
+            :persisted, :target_offset, :counts
+        )
+        """)
+    cursor = connection.cursor()
+    cursor.execute(
+        save_checkpoint,
+        {
+            "loader": checkpoint.loader,
+            "source": checkpoint.source,
+            "byte_offset": checkpoint.byte_offset,
+            "row_number": checkpoint.row_number,
+            "loaded": checkpoint.loaded,
+            "persisted": checkpoint.persisted,
+            "target_offset": checkpoint.target_offset,
+            "counts": json.dumps(checkpoint.counts),
+        },
+    )
+    cursor.close()
+
+
+class OffsetReader:
+    """
+    Rows of a CSV file opened in binary mode, as dicts.
+    After each row, ``offset`` is the byte offset just past it,
+    and ``row_number`` is the number of rows read.
+    A text file can't report its position while it's being iterated.
+    """
+
+    def __init__(
+        self,
+        source_file: BinaryIO,
+        checkpoint: Checkpoint | None = None,
+        encoding: str = "utf-8",
+    ) -> None:
+        self.file = source_file
+        self.encoding = encoding
+        self.offset = 0
+        self.fieldnames = next(csv.reader(self.lines()), None)
+        self.row_number = 0
+        if checkpoint and checkpoint.byte_offset > self.offset:
+            self.file.seek(checkpoint.byte_offset)
+            self.offset = checkpoint.byte_offset
+            self.row_number = checkpoint.row_number
+
+    def lines(self) -> Iterator[str]:
+        """The csv module reads one line at a time, only as needed."""
+        for line in self.file:
+            self.offset += len(line)
+            yield line.decode(self.encoding)
+
+    def __iter__(self) -> Iterator[dict[str, str]]:
+        for row in csv.DictReader(self.lines(), self.fieldnames):
+            self.row_number += 1
+            yield row
+
+
+def advance(
+    connection: db.Connection,
+    checkpoint: Checkpoint,
+    reader: OffsetReader,
+) -> None:
+    """Save the reader's position, to be committed with its rows."""
+    checkpoint.byte_offset = reader.offset
+    checkpoint.row_number = reader.row_number
+    save(connection, checkpoint)
+
+
+def advance_output(
+    connection: db.Connection,
+    checkpoint: Checkpoint,
+    reader: OffsetReader,
+    target_file: TextIO,
+    counts: dict[str, int],
+) -> None:
+    """Flush the output to disk, then commit the checkpoint."""
+    target_file.flush()
+    os.fsync(target_file.fileno())
+    checkpoint.target_offset = target_file.tell()
+    checkpoint.counts = dict(counts)
+    advance(connection, checkpoint, reader)
+    connection.commit()
+
+
+def checkpointed(
+    connection: db.Connection,
+    checkpoint: Checkpoint,
+    reader: OffsetReader,
+    target_file: TextIO,
+    counts: dict[str, int],
+    every: int,
+    rows: Iterable[Any],
+) -> Iterator[Any]:
+    """
+    A pipeline stage after the output is written.
+    Every ``every`` rows, commit a checkpoint.
+    The stages are generators, so when a row reaches this stage,
+    every source row before it has been written or rejected.
+    """
+    for number, row in enumerate(rows, start=1):
+        if number % every == 0:
+            advance_output(
+                connection, checkpoint, reader, target_file, counts
+            )
+        yield row
@@ -0,0 +1,282 @@
+"""
+Database connections configured for a workload.
+
+Each application's ``main()`` gets its connection from :py:func:`connect`,
+naming one of the :py:data:`PROFILES`.
+The profile provides the PRAGMA settings and the statement cache size.
+All connections get the shared user-defined functions, like ``regexp()``.
+
+..  code-block:: python
+
+    connection = connection_factory.connect(
+        "data/unlearning_sql.db", "bulk-load"
+    )
+
+"""
+
+import argparse
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import math
+from pathlib import Path
+import random
+import re
+import sqlite3 as db
+from textwrap import dedent
+import time
+from typing import Any
+
+import geohash
+import instrumentation
+
+
+@dataclass(frozen=True)
+class Profile:
+    """PRAGMA settings and statement cache size for a kind of workload."""
+
+    name: str
+    pragmas: dict[str, Any] = field(default_factory=dict)
+    cached_statements: int = 128
+
+
+PROFILES = {
+    profile.name: profile
+    for profile in [
+        # SQLite's own defaults.
+        Profile("default"),
+        # Large write transactions.
+        # WAL with NORMAL sync is durable at each checkpoint,
+        # and lets readers continue during a load.
+        Profile(
+            "bulk-load",
+            {
+                "journal_mode": "WAL",
+                "synchronous": "NORMAL",
+                "cache_size": -262_144,  # KiB, i.e., 256 MiB
+                "temp_store": "MEMORY",
+                "mmap_size": 268_435_456,
+                "busy_timeout": 30_000,
+            },
+            cached_statements=256,
+        ),
+        # Large scans and lookups; no writes.
+        Profile(
+            "read-extract",
+            {
+                "cache_size": -131_072,  # KiB, i.e., 128 MiB
+                "temp_store": "MEMORY",
+                "mmap_size": 1_073_741_824,
+                "busy_timeout": 10_000,
+                "query_only": "ON",
+            },
+            cached_statements=64,
+        ),
+        # Disposable databases for testing. Durability is irrelevant.
+        Profile(
+            "test-memory",
+            {
+                "journal_mode": "MEMORY",
+                "synchronous": "OFF",
+                "temp_store": "MEMORY",
+            },
+            cached_statements=32,
+        ),
+    ]
+}
+
+
+def regexp(pattern: str, data: str) -> bool:
+    """The function behind SQLite's ``data REGEXP pattern`` operator."""
+    return re.match(pattern, data) is not None
+
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(
+    lat_1: float, lon_1: float, lat_2: float, lon_2: float
+) -> float | None:
+    """Great-circle distance in km between two points, in degrees."""
+    if None in (lat_1, lon_1, lat_2, lon_2):
+        return None
+    phi_1, phi_2 = math.radians(lat_1), math.radians(lat_2)
+    d_phi = phi_2 - phi_1
+    d_lambda = math.radians(lon_2 - lon_1)
+    a = (
+        math.sin(d_phi / 2) ** 2
+        + math.cos(phi_1)
+        * math.cos(phi_2)
+        * math.sin(d_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def register_functions(connection: db.Connection) -> None:
+    """Adds the shared user-defined functions to a connection."""
+    connection.create_function("regexp", 2, regexp, deterministic=True)
+    connection.create_function(
+        "haversine_km", 4, haversine_km, deterministic=True
+    )
+    connection.create_function(
+        "geohash", 3, geohash.geohash_sql, deterministic=True
+    )
+
+
+def schema_layout(connection: db.Connection) -> str | None:
+    """
+    Which of ``sql_db_preparation.LAYOUTS`` the database has:
+    ``"strict"`` or ``"legacy"``; None if it's empty.
+    """
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT sql FROM sqlite_schema
+            WHERE type = 'table' AND name = 'customer'
+        """)
+    )
+    row = cursor.fetchone()
+    cursor.close()
+    if row is None:
+        return None
+    (table_sql,) = row
+    return (
+        "strict" if table_sql.rstrip().endswith("STRICT") else "legacy"
+    )
+
+
+def read_only_uri(database: str | Path) -> str:
+    """
+    A ``file:...?mode=ro`` URI for a database path.
+    SQLite itself refuses writes, so the connection can't
+    disturb a live loader.
+    """
+    text = str(database)
+    if text.startswith("file:"):
+        separator = "&" if "?" in text else "?"
+        return f"{text}{separator}mode=ro"
+    return f"{Path(database).resolve().as_uri()}?mode=ro"
+
+
+def connect(
+    database: str | Path,
+    profile: str = "default",
+    read_only: bool = False,
+    instrument: instrumentation.Settings | None = None,
+) -> db.Connection:
+    """
+    Connect and apply the named profile.
+    With ``read_only``, open the file with a read-only URI.
+    With ``instrument`` settings, the connection records its statements;
+    see :py:mod:`instrumentation`.
+
+    Foreign keys are enforced when the database has the strict layout.
+    (The legacy layout's ``REFERENCES customer(rowid)`` can't be enforced.)
+    """
+    settings = PROFILES[profile]
+    if read_only:
+        database = read_only_uri(database)
+    connection = db.connect(
+        database,
+        cached_statements=settings.cached_statements,
+        uri=str(database).startswith("file:"),
+        factory=(
+            instrumentation.InstrumentedConnection
+            if instrument
+            else db.Connection
+        ),
+    )
+    cursor = connection.cursor()
+    for name, value in settings.pragmas.items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+    if schema_layout(connection) == "strict":
+        connection.execute("PRAGMA foreign_keys = ON")
+    register_functions(connection)
+    if instrument and isinstance(
+        connection, instrumentation.InstrumentedConnection
+    ):
+        connection.instrument(instrument)
+    return connection
+
+
+def is_busy(error: db.OperationalError) -> bool:
+    """SQLITE_BUSY or SQLITE_LOCKED: another connection has the lock."""
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+
+def retry_busy(
+    connection: db.Connection,
+    operation: Callable[[], Any],
+    attempts: int = 6,
+    delay: float = 0.05,
+) -> Any:
+    """
+    Run ``operation()``, retrying with exponential backoff (and jitter)
+    when the database is busy or locked.
+
+    The ``busy_timeout`` PRAGMA handles most lock waits inside SQLite.
+    SQLite can still return SQLITE_BUSY immediately; for example, when
+    a read transaction can't be upgraded to a write transaction.
+    The pending transaction is rolled back, so the operation must be
+    a complete transaction that can be safely repeated.
+    """
+    for attempt in range(attempts):
+        try:
+            return operation()
+        except db.OperationalError as error:
+            if not is_busy(error) or attempt == attempts - 1:
+                raise
+            connection.rollback()
+            pause = delay * 2**attempt * random.uniform(0.5, 1.5)
+            print(f"{error}; retry {attempt + 1} in {pause:.3f}s")
+            time.sleep(pause)
+    raise AssertionError("unreachable")  # pragma: no cover
+
+
+@contextmanager
+def read_snapshot(connection: db.Connection) -> Iterator[db.Connection]:
+    """
+    A read transaction: every query inside sees the same committed data.
+
+    In WAL mode, the snapshot is fixed by the first read after ``BEGIN``.
+    Writers aren't blocked; their commits become visible after this ends.
+    Starting the snapshot is retried if the database is busy.
+    """
+    cursor = connection.cursor()
+
+    def begin() -> None:
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT count(*) FROM sqlite_schema")
+        cursor.fetchone()
+
+    retry_busy(connection, begin)
+    try:
+        yield connection
+    finally:
+        cursor.close()
+        connection.rollback()
+
+
+def add_profile_option(
+    parser: argparse.ArgumentParser, default: str
+) -> None:
+    """The ``--profile`` option shared by all the applications."""
+    parser.add_argument(
+        "--profile",
+        action="store",
+        choices=list(PROFILES),
+        default=default,
+        help=f"connection settings (default {default})",
+    )
+
+
+def add_read_only_option(parser: argparse.ArgumentParser) -> None:
+    """The ``--read-only`` option shared by the extracts."""
+    parser.add_argument(
+        "--read-only",
+        action="store_true",
+        default=False,
+        help="open the database with a read-only file: URI",
+    )
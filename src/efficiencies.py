@@ -2,15 +2,25 @@
 Efficiencies
 """
 
-from collections.abc import Iterable, Iterator
-from collections import Counter
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from collections import Counter, defaultdict
 import csv
+from dataclasses import dataclass
+import heapq
+from itertools import groupby, islice
 from pathlib import Path
+import tempfile
 from textwrap import dedent
-from functools import lru_cache
+from functools import lru_cache, partial
+from operator import itemgetter
+import pickle
 import sqlite3 as db
 from typing import Any
 
+from lookup_cache import LookupCache
+from pipeline import Pipeline, Stage
+
 
 @lru_cache(128)
 def fetch_a_thing(connection: db.Connection, the_key: Any) -> Any:
@@ -35,18 +45,81 @@ class ServiceNameMapping:
         WHERE service_id = :service_id
     """)
 
-    def __init__(self, connection: db.Connection):
+    def __init__(
+        self,
+        connection: db.Connection,
+        maxsize: int = 128,
+        policy: str = "lru",
+    ):
         self.cursor = connection.cursor()
+        self.cache = LookupCache(self.fetch, maxsize, policy)
 
     def close(self):
         self.cursor.close()
+        self.cache.clear()
 
-    @lru_cache(128)
-    def __getitem__(self, service_id: int) -> dict[str, Any]:
+    def fetch(self, service_id: int) -> dict[str, Any]:
         self.cursor.execute(self.query, {"service_id": service_id})
         row = self.cursor.fetchone()
         return row
 
+    def __getitem__(self, service_id: int) -> dict[str, Any]:
+        return self.cache[service_id]
+
+
+class BatchLookup:
+    """
+    Rows by key, many keys to a query.
+    The ``query`` has a ``{keys}`` placeholder for the IN list,
+    for example, ``SELECT * FROM service WHERE rowid IN ({keys})``;
+    the ``key_column`` of its result is matched to the keys.
+    The IN list is split to stay under SQLite's variable limit.
+    Unknown keys get ``None``.
+    """
+
+    def __init__(
+        self,
+        connection: db.Connection,
+        query: str,
+        key_column: str,
+        maxsize: int = 10_000,
+        policy: str = "lru",
+    ) -> None:
+        self.cursor = connection.cursor()
+        self.query = query
+        self.key_column = key_column
+        self.limit = connection.getlimit(
+            db.SQLITE_LIMIT_VARIABLE_NUMBER
+        )
+        self.cache = LookupCache(self.fetch, maxsize, policy)
+        self.queries = 0
+
+    def close(self) -> None:
+        self.cursor.close()
+        self.cache.clear()
+
+    def fetch(self, key: Any) -> Any:
+        return self.fetch_many([key])[key]
+
+    def fetch_many(self, keys: list[Any]) -> dict[Any, Any]:
+        found = dict.fromkeys(keys)
+        for start in range(0, len(keys), self.limit):
+            chunk = keys[start : start + self.limit]
+            in_list = ", ".join("?" * len(chunk))
+            self.cursor.execute(self.query.format(keys=in_list), chunk)
+            self.queries += 1
+            columns = [name for name, *_ in self.cursor.description]
+            index = columns.index(self.key_column)
+            for row in self.cursor.fetchall():
+                found[row[index]] = row
+        return found
+
+    def __getitem__(self, key: Any) -> Any:
+        return self.cache[key]
+
+    def get_many(self, keys: Iterable[Any]) -> dict[Any, Any]:
+        return self.cache.get_many(keys, self.fetch_many)
+
 
 type Row = dict[str, Any]
 
@@ -69,6 +142,26 @@ def lookup_something(
     something_lookup.close()
 
 
+def batched_lookup(
+    lookup: BatchLookup,
+    row_source: Iterable[Row],
+    key: str,
+    into: str,
+    batch_size: int = 1_000,
+) -> Iterator[Row]:
+    """
+    Like :py:func:`lookup_something`, but ``batch_size`` rows at a time:
+    the batch's uncached keys are resolved with one query, then the
+    rows are emitted in order, with ``row[into]`` set to the match.
+    """
+    rows = iter(row_source)
+    while batch := list(islice(rows, batch_size)):
+        found = lookup.get_many(row[key] for row in batch)
+        for row in batch:
+            row[into] = found[row[key]]
+            yield row
+
+
 def compute_something(
     connection: db.Connection, row_source: Iterable[Row]
 ) -> Iterator[Row]:
@@ -80,19 +173,27 @@ def compute_something(
         yield row
 
 
+def full_pipeline(connection: db.Connection) -> Pipeline:
+    """The query, the lookup, and the computation, as stages."""
+    return Pipeline(
+        Stage("query", lambda rows: query_table(connection)),
+        Stage("lookup", partial(lookup_something, connection)),
+        Stage("compute", partial(compute_something, connection)),
+    )
+
+
 def full_process(connection: db.Connection) -> Iterator[Row]:
-    base = query_table(connection)
-    joined = lookup_something(connection, base)
-    computed = compute_something(connection, joined)
-    yield from computed
+    yield from full_pipeline(connection).run()
 
 
 def process_and_write(connection: db.Connection, target: Path) -> None:
     FIELDNAMES = ["something", "computed", "key", "this", "that"]
+    pipeline = full_pipeline(connection)
     with target.open("w", newline="") as tgt_file:
         writer = csv.DictWriter(tgt_file, fieldnames=FIELDNAMES)
         writer.writeheader()
-        writer.writerows(full_process(connection))
+        writer.writerows(pipeline.run())
+    print(pipeline.report())
 
 
 def group_by(
@@ -104,3 +205,565 @@ def group_by(
         for group_id, count in counts.items()
     )
     yield from group_rows
+
+
+class Accumulator[T: "Accumulator"](ABC):
+    """
+    The running state of one aggregate for one group.
+    Accumulators of the same kind can be merged, so partial results
+    from separate workers, or spilled runs, combine.
+    As in SQL, ``None`` values are ignored.
+    Each kind is an ``Accumulator`` of itself, so ``merge`` takes
+    another of the same kind.
+    """
+
+    __slots__ = ()
+
+    @abstractmethod
+    def add(self, value: Any) -> None: ...
+
+    @abstractmethod
+    def merge(self, other: T) -> None: ...
+
+    @abstractmethod
+    def result(self) -> Any: ...
+
+
+class Count(Accumulator["Count"]):
+    __slots__ = ("count",)
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def add(self, value: Any) -> None:
+        if value is not None:
+            self.count += 1
+
+    def merge(self, other: "Count") -> None:
+        self.count += other.count
+
+    def result(self) -> int:
+        return self.count
+
+
+class Sum(Accumulator["Sum"]):
+    __slots__ = ("total",)
+
+    def __init__(self) -> None:
+        self.total = None
+
+    def add(self, value: Any) -> None:
+        if value is not None:
+            self.total = (
+                value if self.total is None else self.total + value
+            )
+
+    def merge(self, other: "Sum") -> None:
+        self.add(other.total)
+
+    def result(self) -> Any:
+        return self.total
+
+
+class Min(Accumulator["Min"]):
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = None
+
+    def add(self, value: Any) -> None:
+        if value is not None and (
+            self.value is None or value < self.value
+        ):
+            self.value = value
+
+    def merge(self, other: "Min") -> None:
+        self.add(other.value)
+
+    def result(self) -> Any:
+        return self.value
+
+
+class Max(Min):
+    __slots__ = ()
+
+    def add(self, value: Any) -> None:
+        if value is not None and (
+            self.value is None or value > self.value
+        ):
+            self.value = value
+
+
+class Mean(Accumulator["Mean"]):
+    __slots__ = ("count", "total")
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.count = 0
+
+    def add(self, value: Any) -> None:
+        if value is not None:
+            self.total += value
+            self.count += 1
+
+    def merge(self, other: "Mean") -> None:
+        self.total += other.total
+        self.count += other.count
+
+    def result(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+
+class CountDistinct(Accumulator["CountDistinct"]):
+    """Holds every distinct value of its group."""
+
+    __slots__ = ("values",)
+
+    def __init__(self) -> None:
+        self.values: set[Any] = set()
+
+    def add(self, value: Any) -> None:
+        if value is not None:
+            self.values.add(value)
+
+    def merge(self, other: "CountDistinct") -> None:
+        self.values |= other.values
+
+    def result(self) -> int:
+        return len(self.values)
+
+
+AGGREGATES: dict[str, type[Accumulator]] = {
+    "count": Count,
+    "sum": Sum,
+    "min": Min,
+    "max": Max,
+    "mean": Mean,
+    "count_distinct": CountDistinct,
+}
+
+
+def group_order(key: Any) -> tuple:
+    """A sort key for group keys; ``None`` sorts first, as in SQLite."""
+    if not isinstance(key, tuple):
+        return (key is not None, key)
+    return tuple((value is not None, value) for value in key)
+
+
+def by_group(item: tuple[Any, list[Accumulator]]) -> tuple:
+    return group_order(item[0])
+
+
+class GroupBy:
+    """
+    Several aggregates at once, over one or more key columns.
+    The ``aggregates`` map an output column to a function name in
+    :py:data:`AGGREGATES` and an input column; ``None`` counts rows,
+    like ``count(*)``.
+
+    ..  code-block:: python
+
+        engine = GroupBy(
+            ["customer_device_id", "service_id"],
+            {"count(*)": ("count", None), "first": ("min", "start")},
+        )
+        engine.add_all(rows)
+        yield from engine.results()
+
+    When there are more than ``max_groups`` groups in memory, they're
+    sorted and spilled to a temporary directory under ``directory``.
+    The results of a spilled engine are in key order, and the keys
+    must be comparable with each other.
+
+    To combine workers' results, each worker sends ``list(partials())``,
+    and the parent engine ``merge()``s them.
+    """
+
+    def __init__(
+        self,
+        keys: str | Sequence[str],
+        aggregates: dict[str, tuple[str, str | None]],
+        max_groups: int = 100_000,
+        directory: Path | None = None,
+    ) -> None:
+        self.keys = [keys] if isinstance(keys, str) else list(keys)
+        self.key = itemgetter(*self.keys)
+        self.names = list(aggregates)
+        self.functions = [
+            AGGREGATES[function] for function, _ in aggregates.values()
+        ]
+        self.getters = [
+            itemgetter(column) if column else lambda row: True
+            for _, column in aggregates.values()
+        ]
+        self.max_groups = max_groups
+        self.directory = directory
+        self.groups: dict[Any, list[Accumulator]] = {}
+        self.temp_dir: tempfile.TemporaryDirectory | None = None
+        self.runs: list[Path] = []
+
+    def accumulators(self, key: Any) -> list[Accumulator]:
+        accumulators = self.groups.get(key)
+        if accumulators is None:
+            if len(self.groups) >= self.max_groups:
+                self.spill()
+            accumulators = [function() for function in self.functions]
+            self.groups[key] = accumulators
+        return accumulators
+
+    def add(self, row: Row) -> None:
+        accumulators = self.accumulators(self.key(row))
+        for accumulator, get in zip(accumulators, self.getters):
+            accumulator.add(get(row))
+
+    def add_all(self, rows: Iterable[Row]) -> None:
+        for row in rows:
+            self.add(row)
+
+    def merge(
+        self, partials: Iterable[tuple[Any, list[Accumulator]]]
+    ) -> None:
+        """Combine another engine's ``partials()``."""
+        for key, others in partials:
+            accumulators = self.accumulators(key)
+            for accumulator, other in zip(accumulators, others):
+                accumulator.merge(other)
+
+    def spill(self) -> None:
+        if self.temp_dir is None:
+            self.temp_dir = tempfile.TemporaryDirectory(
+                dir=self.directory
+            )
+        items = sorted(self.groups.items(), key=by_group)
+        self.runs.append(write_run(items, Path(self.temp_dir.name)))
+        self.groups = {}
+
+    def partials(self) -> Iterator[tuple[Any, list[Accumulator]]]:
+        """Each group's key and accumulators, merged across runs."""
+        if not self.runs:
+            yield from self.groups.items()
+            return
+        merged = heapq.merge(
+            *map(read_run, self.runs),
+            sorted(self.groups.items(), key=by_group),
+            key=by_group,
+        )
+        # A group has at most one item from each run.
+        for _, group in groupby(merged, key=by_group):
+            (key, accumulators), *later = group
+            for _, others in later:
+                for accumulator, other in zip(accumulators, others):
+                    accumulator.merge(other)
+            yield key, accumulators
+
+    def results(self) -> Iterator[Row]:
+        """One row per group; then the spilled runs are removed."""
+        try:
+            for key, accumulators in self.partials():
+                values = key if len(self.keys) > 1 else (key,)
+                row = dict(zip(self.keys, values))
+                for name, accumulator in zip(self.names, accumulators):
+                    row[name] = accumulator.result()
+                yield row
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.temp_dir is not None:
+            self.temp_dir.cleanup()
+            self.temp_dir = None
+        self.runs = []
+        self.groups = {}
+
+
+def group_by_aggregates(
+    row_source: Iterable[Row],
+    keys: str | Sequence[str],
+    aggregates: dict[str, tuple[str, str | None]],
+    max_groups: int = 100_000,
+    directory: Path | None = None,
+) -> Iterator[Row]:
+    """A :py:class:`GroupBy` as a pipeline step."""
+    engine = GroupBy(keys, aggregates, max_groups, directory)
+    engine.add_all(row_source)
+    yield from engine.results()
+
+
+def query_rows(
+    connection: db.Connection, query: str, params: Any = ()
+) -> Iterator[Row]:
+    """The rows of a query, as dicts, for either side of a join."""
+    cursor = connection.cursor()
+    cursor.row_factory = None
+    cursor.execute(query, params)
+    columns = [name for name, *_ in cursor.description]
+    while batch := cursor.fetchmany(1000):
+        for values in batch:
+            yield dict(zip(columns, values))
+    cursor.close()
+
+
+@dataclass
+class JoinStats:
+    """
+    For a sort-merge join, ``build_keys`` counts only the keys
+    reached before the probe side ran out, and ``runs`` counts the
+    sorted runs spilled to disk.
+    """
+
+    build_rows: int = 0
+    build_keys: int = 0
+    probe_rows: int = 0
+    output_rows: int = 0
+    runs: int = 0
+
+    def __str__(self) -> str:
+        spilled = f", spilled {self.runs} runs" if self.runs else ""
+        return (
+            f"built {self.build_rows} rows ({self.build_keys} keys), "
+            f"probed {self.probe_rows} rows, "
+            f"joined {self.output_rows} rows{spilled}"
+        )
+
+
+JOINS = ("inner", "left", "anti")
+
+
+def key_columns(
+    keys: str | Sequence[str], build_keys: str | Sequence[str] | None
+) -> tuple[list[str], list[str]]:
+    """The probe and build key columns, as lists."""
+    probe_keys = [keys] if isinstance(keys, str) else list(keys)
+    if build_keys is None:
+        return probe_keys, probe_keys
+    if isinstance(build_keys, str):
+        return probe_keys, [build_keys]
+    return probe_keys, list(build_keys)
+
+
+def matchable(key: Any) -> bool:
+    """
+    False for a key with a ``None``. One key column is a bare value;
+    several are a tuple, from :py:func:`operator.itemgetter`.
+    """
+    return key is not None and not (
+        isinstance(key, tuple) and None in key
+    )
+
+
+def hash_join(
+    build: Iterable[Row],
+    probe: Iterable[Row],
+    keys: str | Sequence[str],
+    build_keys: str | Sequence[str] | None = None,
+    how: str = "inner",
+    stats: JoinStats | None = None,
+) -> Iterator[Row]:
+    """
+    Join two row sources on equal ``keys``.
+    The ``build`` side, which should be the smaller, is read into a
+    dict of lists; the ``probe`` side is streamed through it.
+    A dict lookup replaces a query for each probe row.
+
+    -   ``inner``: a probe row merged with each of its build rows.
+    -   ``left``: the same, and unmatched probe rows with the build
+        columns set to ``None``.
+    -   ``anti``: only the unmatched probe rows.
+
+    As in SQL, a key with a ``None`` never matches.
+    The build side's columns replace any probe columns of the same name.
+    The ``stats``, if given, are filled in as the rows are produced.
+    """
+    if how not in JOINS:
+        raise ValueError(f"unknown join {how!r}")
+    probe_keys, build_keys = key_columns(keys, build_keys)
+    stats = stats if stats is not None else JoinStats()
+    build_key, probe_key = (
+        itemgetter(*build_keys),
+        itemgetter(*probe_keys),
+    )
+
+    table: defaultdict[Any, list[Row]] = defaultdict(list)
+    build_columns: dict[str, None] = {}
+    for row in build:
+        stats.build_rows += 1
+        build_columns.update(dict.fromkeys(row))
+        key = build_key(row)
+        if matchable(key):
+            table[key].append(row)
+    stats.build_keys = len(table)
+    missing = dict.fromkeys(
+        name for name in build_columns if name not in probe_keys
+    )
+
+    for row in probe:
+        stats.probe_rows += 1
+        matches = table.get(probe_key(row), ())
+        if how == "anti":
+            if not matches:
+                stats.output_rows += 1
+                yield row
+        elif matches:
+            for match in matches:
+                stats.output_rows += 1
+                yield row | match
+        elif how == "left":
+            stats.output_rows += 1
+            yield row | missing
+
+
+SPILL_BATCH = 1_000
+
+
+def write_run(rows: list[Any], directory: Path) -> Path:
+    """
+    Spill sorted rows, pickled in batches.
+    Pickle shares the repeated column names within each batch.
+    """
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory, suffix=".run", delete=False
+    ) as run_file:
+        for start in range(0, len(rows), SPILL_BATCH):
+            pickle.dump(
+                rows[start : start + SPILL_BATCH],
+                run_file,
+                pickle.HIGHEST_PROTOCOL,
+            )
+    return Path(run_file.name)
+
+
+def read_run(path: Path) -> Iterator[Any]:
+    with path.open("rb") as run_file:
+        while True:
+            try:
+                batch = pickle.load(run_file)
+            except EOFError:
+                return
+            yield from batch
+
+
+def external_sort(
+    rows: Iterable[Row],
+    key: Callable[[Row], Any],
+    memory_rows: int,
+    directory: Path,
+    stats: JoinStats,
+) -> Iterator[Row]:
+    """
+    Sort in runs of ``memory_rows``. If there's more than one run,
+    each is spilled to ``directory``, then they're merged;
+    the merge holds one batch of each run in memory.
+    """
+    runs: list[Path] = []
+    buffer: list[Row] = []
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= memory_rows:
+            buffer.sort(key=key)
+            runs.append(write_run(buffer, directory))
+            buffer = []
+    buffer.sort(key=key)
+    if not runs:
+        yield from buffer
+        return
+    if buffer:
+        runs.append(write_run(buffer, directory))
+    del buffer
+    stats.runs += len(runs)
+    yield from heapq.merge(*map(read_run, runs), key=key)
+
+
+def sort_merge_join(
+    build: Iterable[Row],
+    probe: Iterable[Row],
+    keys: str | Sequence[str],
+    build_keys: str | Sequence[str] | None = None,
+    how: str = "inner",
+    memory_rows: int = 100_000,
+    directory: Path | None = None,
+    stats: JoinStats | None = None,
+) -> Iterator[Row]:
+    """
+    The same join as :py:func:`hash_join`, for sides too big for memory.
+    Each side is sorted on its keys with :py:func:`external_sort`,
+    in a temporary directory under ``directory``, and the two sorted
+    streams are merged. The rows come out in key order.
+
+    At most ``memory_rows`` rows of each side are held while sorting;
+    while merging, one batch per run, and the build rows of one key.
+    The key values must be comparable with each other.
+    """
+    if how not in JOINS:
+        raise ValueError(f"unknown join {how!r}")
+    probe_keys, build_keys = key_columns(keys, build_keys)
+    stats = stats if stats is not None else JoinStats()
+    build_key, probe_key = (
+        itemgetter(*build_keys),
+        itemgetter(*probe_keys),
+    )
+
+    def sort_key(get: Callable[[Row], Any]) -> Callable[[Row], tuple]:
+        # Keys with a None sort first, and never match.
+        def key(row: Row) -> tuple:
+            value = get(row)
+            return (True, value) if matchable(value) else (False,)
+
+        return key
+
+    def counted(rows: Iterable[Row], field: str) -> Iterator[Row]:
+        for row in rows:
+            setattr(stats, field, getattr(stats, field) + 1)
+            yield row
+
+    build_columns: dict[str, None] = {}
+
+    def columns(rows: Iterable[Row]) -> Iterator[Row]:
+        for row in rows:
+            build_columns.update(dict.fromkeys(row))
+            yield row
+
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        sorted_build = external_sort(
+            columns(counted(build, "build_rows")),
+            sort_key(build_key),
+            memory_rows,
+            Path(temp_dir),
+            stats,
+        )
+        sorted_probe = external_sort(
+            counted(probe, "probe_rows"),
+            sort_key(probe_key),
+            memory_rows,
+            Path(temp_dir),
+            stats,
+        )
+        builds = groupby(sorted_build, sort_key(build_key))
+        # Reading the first build row sorts the whole build side.
+        build_value, build_rows = next(builds, (None, None))
+        missing = dict.fromkeys(
+            name for name in build_columns if name not in probe_keys
+        )
+        for value, rows in groupby(sorted_probe, sort_key(probe_key)):
+            # The (None, None) sentinel: the build side is finished.
+            while build_value is not None and build_value < value:
+                build_value, build_rows = next(builds, (None, None))
+            matches: list[Row] = []
+            if (
+                build_rows is not None
+                and build_value == value
+                and value[0]
+            ):
+                matches = list(build_rows)
+                stats.build_keys += 1
+            for row in rows:
+                if how == "anti":
+                    if not matches:
+                        stats.output_rows += 1
+                        yield row
+                elif matches:
+                    for match in matches:
+                        stats.output_rows += 1
+                        yield row | match
+                elif how == "left":
+                    stats.output_rows += 1
+                    yield row | missing
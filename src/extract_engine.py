@@ -0,0 +1,234 @@
+"""
+Extract engine for service name counts.
+
+Logical query:
+        SELECT service.service_name, count(*) as count
+        FROM customer_device_service
+        JOIN service
+           ON service.rowid = customer_device_service.service_id
+        GROUP BY service.service_name
+
+There are three physical plans:
+
+-   ``sql``: the whole query runs in SQLite.
+
+-   ``python``: stream ``service_id`` values; hash aggregate and
+    dict join in Python, like ``python_extract_1``.
+
+-   ``hybrid``: ``GROUP BY service_id`` in SQLite, then map the
+    (few) ids to names in Python.
+
+-   ``materialized``: read the trigger-maintained counts
+    from ``service_counts``; no fact table scan at all.
+
+The ``auto`` strategy picks a plan from the table sizes.
+See ``python src/benchmark.py aggregate`` for the measurements behind it.
+"""
+
+import argparse
+from collections import Counter
+from collections.abc import Callable, Iterable
+import csv
+from pathlib import Path
+import sqlite3 as db
+import sys
+from textwrap import dedent
+
+import connection_factory
+import instrumentation
+import service_counts
+
+
+def service_name_map(connection: db.Connection) -> dict[int, str]:
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT rowid, service_name
+            FROM service
+        """)
+    )
+    mapping = dict(cursor.fetchall())
+    cursor.close()
+    return mapping
+
+
+def named_counts(
+    names: dict[int, str], by_id: Iterable[tuple[int, int]]
+) -> Counter[str]:
+    """
+    Counts by service name from ``(service_id, count)`` pairs.
+    Like the SQL ``JOIN``, an id with no ``service`` row is left out;
+    the legacy layout can't enforce the foreign key.
+    """
+    counter = Counter()
+    for service_id, count in by_id:
+        if service_id in names:
+            counter[names[service_id]] += count
+    return counter
+
+
+def counts_sql(connection: db.Connection) -> Counter[str]:
+    """Join and aggregate in SQLite."""
+    query = dedent("""
+        SELECT service.service_name, count(*)
+        FROM customer_device_service
+        JOIN service
+           ON service.rowid = customer_device_service.service_id
+        GROUP BY service.service_name
+    """)
+    cursor = connection.cursor()
+    cursor.execute(query)
+    counter = Counter(dict(cursor.fetchall()))
+    cursor.close()
+    return counter
+
+
+def counts_python(
+    connection: db.Connection, arraysize: int = 1000
+) -> Counter[str]:
+    """Hash aggregate and dict join in Python."""
+    names = service_name_map(connection)
+    query = dedent("""
+        SELECT service_id
+        FROM customer_device_service
+    """)
+    cursor = connection.cursor()
+    cursor.arraysize = arraysize
+    cursor.execute(query)
+    by_id = Counter()
+    while batch := cursor.fetchmany():
+        by_id.update(service_id for (service_id,) in batch)
+    cursor.close()
+    return named_counts(names, by_id.items())
+
+
+def counts_hybrid(connection: db.Connection) -> Counter[str]:
+    """Aggregate by id in SQLite; map ids to names in Python."""
+    names = service_name_map(connection)
+    query = dedent("""
+        SELECT service_id, count(*)
+        FROM customer_device_service
+        GROUP BY service_id
+    """)
+    cursor = connection.cursor()
+    cursor.execute(query)
+    counter = named_counts(names, cursor.fetchall())
+    cursor.close()
+    return counter
+
+
+def counts_materialized(connection: db.Connection) -> Counter[str]:
+    """One row per service from ``service_activation_count``."""
+    return service_counts.service_name_counts(connection)
+
+
+STRATEGIES: dict[str, Callable[[db.Connection], Counter[str]]] = {
+    "sql": counts_sql,
+    "python": counts_python,
+    "hybrid": counts_hybrid,
+    "materialized": counts_materialized,
+}
+
+
+def table_sizes(connection: db.Connection) -> dict[str, int]:
+    """
+    Estimated row counts. ``max(rowid)`` is a b-tree descent,
+    not a scan, and is exact unless rows have been deleted.
+    The ``service_activation_count`` table is included if it exists.
+    """
+    tables = ["service", "customer_device_service"]
+    if service_counts.is_materialized(connection):
+        tables.append("service_activation_count")
+    sizes = {}
+    cursor = connection.cursor()
+    for table in tables:
+        cursor.execute(f"SELECT coalesce(max(rowid), 0) FROM {table}")
+        (sizes[table],) = cursor.fetchone()
+    cursor.close()
+    return sizes
+
+
+def choose_strategy(sizes: dict[str, int]) -> str:
+    """
+    Grouping by the integer id in SQLite and mapping the groups to names
+    in Python is fastest, unless there are more services than activations.
+    Then most services have no activations, and loading the whole
+    name map into Python costs more than the join inside SQLite.
+
+    The ``python`` plan is never the fastest; its per-row cost is
+    higher than SQLite's ``GROUP BY``.
+
+    Materialized counts, when they exist, beat any scan.
+    """
+    if "service_activation_count" in sizes:
+        return "materialized"
+    if sizes["service"] > sizes["customer_device_service"]:
+        return "sql"
+    return "hybrid"
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data/service_name_counts.csv"),
+    )
+    parser.add_argument(
+        "--strategy",
+        action="store",
+        choices=["auto", *STRATEGIES],
+        default="auto",
+    )
+    connection_factory.add_profile_option(parser, "read-extract")
+    connection_factory.add_read_only_option(parser)
+    instrumentation.add_instrument_options(parser)
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect: str,
+    target: Path,
+    strategy: str = "auto",
+    profile: str = "read-extract",
+    read_only: bool = False,
+    instrument: instrumentation.Settings | None = None,
+) -> None:
+    OUTPUT_FIELDNAMES = ["service_name", "count"]
+
+    connection = connection_factory.connect(
+        database_connect, profile, read_only, instrument
+    )
+    with connection_factory.read_snapshot(connection):
+        if strategy == "auto":
+            sizes = table_sizes(connection)
+            strategy = choose_strategy(sizes)
+            print(f"table sizes {sizes}: {strategy} strategy")
+        counts = STRATEGIES[strategy](connection)
+
+    with target.open("w", newline="") as target_file:
+        writer = csv.DictWriter(target_file, OUTPUT_FIELDNAMES)
+        writer.writeheader()
+        rows = (
+            {"service_name": key, "count": value}
+            for key, value in counts.items()
+        )
+        writer.writerows(rows)
+    instrumentation.write_report(connection)
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(
+        database_connect=options.db,
+        target=options.output,
+        strategy=options.strategy,
+        profile=options.profile,
+        read_only=options.read_only,
+        instrument=instrumentation.settings_from(options),
+    )
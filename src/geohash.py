@@ -0,0 +1,278 @@
+"""
+Geohash cells for activation locations.
+
+A geohash names a cell of a grid. Each character adds five bits,
+alternately splitting longitude and latitude, so a longer hash is
+a smaller cell inside the cell of any of its prefixes.
+At precision 5 a cell is about 5km on a side; at 7, about 150m.
+
+With an indexed ``geohash`` column in ``customer_device_service``,
+"activations per cell" is a ``GROUP BY`` and "activations near here"
+is nine index range scans: a cell and its neighbours.
+No trigonometry is needed at query time.
+
+The Python loader computes the hash in its transform step, with
+``--geohash N``. The SQL loader fills in missing hashes after each load
+with the ``geohash()`` function registered by ``connection_factory``.
+
+..  code-block:: bash
+
+    python src/geohash.py add --precision 7
+    python src/geohash.py cells --precision 5 -o data/cells.csv
+    python src/geohash.py near --lat 0.5 --lon -0.5 --precision 6
+
+"""
+
+import argparse
+import csv
+from pathlib import Path
+import sqlite3 as db
+import sys
+from textwrap import dedent
+
+import connection_factory
+
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+DEFAULT_PRECISION = 7
+
+
+def encode(
+    lat: float, lon: float, precision: int = DEFAULT_PRECISION
+) -> str:
+    """The geohash of the cell containing a point."""
+    south, north = -90.0, 90.0
+    west, east = -180.0, 180.0
+    chars = []
+    bits, value = 0, 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            middle = (west + east) / 2
+            if lon >= middle:
+                value = value << 1 | 1
+                west = middle
+            else:
+                value = value << 1
+                east = middle
+        else:
+            middle = (south + north) / 2
+            if lat >= middle:
+                value = value << 1 | 1
+                south = middle
+            else:
+                value = value << 1
+                north = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def decode(geohash: str) -> tuple[float, float, float, float]:
+    """The ``(south, west, north, east)`` bounds of a cell."""
+    south, north = -90.0, 90.0
+    west, east = -180.0, 180.0
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = value >> shift & 1
+            if even:
+                middle = (west + east) / 2
+                if bit:
+                    west = middle
+                else:
+                    east = middle
+            else:
+                middle = (south + north) / 2
+                if bit:
+                    south = middle
+                else:
+                    north = middle
+            even = not even
+    return south, west, north, east
+
+
+def neighbours(geohash: str) -> list[str]:
+    """
+    The (up to) eight cells around a cell, with the same precision.
+    Longitude wraps around; there's nothing beyond a pole.
+    """
+    south, west, north, east = decode(geohash)
+    lat, lon = (south + north) / 2, (west + east) / 2
+    height, width = north - south, east - west
+    cells = []
+    for d_lat in (-1, 0, 1):
+        for d_lon in (-1, 0, 1):
+            if d_lat == d_lon == 0:
+                continue
+            n_lat = lat + d_lat * height
+            if not -90 < n_lat < 90:
+                continue
+            n_lon = (lon + d_lon * width + 180) % 360 - 180
+            cell = encode(n_lat, n_lon, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def geohash_sql(
+    lat: float | None, lon: float | None, precision: int
+) -> str | None:
+    """The ``geohash(lat, lon, precision)`` SQL function."""
+    if lat is None or lon is None:
+        return None
+    return encode(lat, lon, precision)
+
+
+def has_geohash(connection: db.Connection) -> bool:
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA table_info(customer_device_service)")
+    names = {row[1] for row in cursor.fetchall()}
+    cursor.close()
+    return "geohash" in names
+
+
+def add_geohash_column(
+    connection: db.Connection, precision: int = DEFAULT_PRECISION
+) -> None:
+    """Add and index the column, if needed, then fill it in."""
+    add_column = dedent("""
+        ALTER TABLE customer_device_service ADD COLUMN geohash TEXT
+        """)
+    create_geohash_index = dedent("""
+        CREATE INDEX IF NOT EXISTS customer_device_service_geohash_ix
+            ON customer_device_service(geohash)
+        """)
+    cursor = connection.cursor()
+    if not has_geohash(connection):
+        cursor.execute(add_column)
+    cursor.execute(create_geohash_index)
+    connection.commit()
+    cursor.close()
+    fill_geohash(connection, precision)
+
+
+def fill_geohash(connection: db.Connection, precision: int) -> int:
+    """
+    Compute the missing hashes; for example, rows from the SQL loader.
+    The index finds the NULLs, so this doesn't scan the table.
+    Requires the ``geohash()`` function from ``connection_factory``.
+    """
+    fill_missing = dedent("""
+        UPDATE customer_device_service
+            SET geohash = geohash(latitude, longitude, :precision)
+            WHERE geohash IS NULL
+            AND latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+    cursor = connection.cursor()
+    cursor.execute(fill_missing, {"precision": precision})
+    updates = cursor.rowcount
+    connection.commit()
+    print(f"computed {updates} geohash values")
+    cursor.close()
+    return updates
+
+
+def cell_counts(
+    connection: db.Connection, precision: int
+) -> list[tuple[str, int]]:
+    """Activations per cell, for any precision up to the stored one."""
+    query = dedent("""
+        SELECT substr(geohash, 1, :precision) AS cell, count(*)
+        FROM customer_device_service
+        WHERE geohash IS NOT NULL
+        GROUP BY cell
+        ORDER BY cell
+        """)
+    cursor = connection.cursor()
+    cursor.execute(query, {"precision": precision})
+    counts = cursor.fetchall()
+    cursor.close()
+    return counts
+
+
+def near_counts(
+    connection: db.Connection, lat: float, lon: float, precision: int
+) -> dict[str, int]:
+    """
+    Activations in the cell containing a point, and its neighbours.
+    Each cell is a range scan of the index: the hashes with its prefix.
+    """
+    query = dedent("""
+        SELECT count(*)
+        FROM customer_device_service
+        WHERE geohash >= :cell AND geohash < :cell || '~'
+        """)
+    cell = encode(lat, lon, precision)
+    cursor = connection.cursor()
+    counts = {}
+    for name in [cell, *neighbours(cell)]:
+        cursor.execute(query, {"cell": name})
+        (counts[name],) = cursor.fetchone()
+    cursor.close()
+    return counts
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "--precision",
+        action="store",
+        type=int,
+        default=DEFAULT_PRECISION,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data/geohash_cells.csv"),
+    )
+    connection_factory.add_profile_option(parser, "default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("add", help="add, index, and fill the column")
+    commands.add_parser("cells", help="activations per cell")
+    near = commands.add_parser(
+        "near", help="activations in a point's cell and its neighbours"
+    )
+    near.add_argument("--lat", type=float, required=True)
+    near.add_argument("--lon", type=float, required=True)
+    return parser.parse_args(argv)
+
+
+def main(options: argparse.Namespace) -> None:
+    connection = connection_factory.connect(options.db, options.profile)
+    match options.command:
+        case "add":
+            add_geohash_column(connection, options.precision)
+        case "cells":
+            with connection_factory.read_snapshot(connection):
+                counts = cell_counts(connection, options.precision)
+            with options.output.open("w", newline="") as target_file:
+                writer = csv.writer(target_file)
+                writer.writerow(["geohash", "count"])
+                writer.writerows(counts)
+            print(f"wrote {len(counts)} cells")
+        case "near":
+            with connection_factory.read_snapshot(connection):
+                counts = near_counts(
+                    connection,
+                    options.lat,
+                    options.lon,
+                    options.precision,
+                )
+            for cell, count in counts.items():
+                print(f"{cell} {count}")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main(get_options())
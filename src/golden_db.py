@@ -0,0 +1,188 @@
+"""
+Golden database cloning.
+
+Preparing a database -- schema plus dimension tables -- is the same work
+every time the schema, the source, and the code are the same.
+Build it once, keep it in a cache directory, and clone it for each consumer.
+
+The cache key is a hash of the schema file, the source files,
+the layout, and the preparation code itself: ``sql_db_preparation``
+and every local module it imports, directly or not, such as the
+profiles in ``connection_factory``.
+Any change to one of these builds a new golden database.
+
+..  code-block:: bash
+
+    python src/golden_db.py --db data/dry_run.db data/activation_source.csv
+
+"""
+
+import argparse
+import ast
+from collections.abc import Iterable
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import sqlite3 as db
+import sys
+
+import sql_db_preparation
+
+
+def build_modules() -> list[Path]:
+    """
+    ``sql_db_preparation.py``, and the modules beside it that it
+    imports, following their imports in turn.
+    """
+    start = Path(sql_db_preparation.__file__)
+    pending = [start]
+    found: list[Path] = []
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.append(path)
+        for node in ast.walk(ast.parse(path.read_bytes())):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module:
+                names = [node.module]
+            else:
+                continue
+            pending.extend(
+                module
+                for name in names
+                if (module := start.with_name(f"{name}.py")).exists()
+            )
+    return sorted(found)
+
+
+def golden_key(
+    schema_path: Path, sources: Iterable[Path], layout: str = "legacy"
+) -> str:
+    """SHA-256 of everything that determines the prepared database."""
+    digest = hashlib.sha256()
+    digest.update(layout.encode("utf-8"))
+    for module_path in build_modules():
+        digest.update(module_path.read_bytes())
+    digest.update(schema_path.read_bytes())
+    for source_path in sources:
+        digest.update(source_path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_golden(
+    cache_dir: Path,
+    schema_path: Path,
+    sources: list[Path],
+    layout: str = "legacy",
+) -> Path:
+    """
+    The path to the golden database, building it if it's not cached.
+
+    The database is built under a temporary name and renamed,
+    so a concurrent reader never sees a partial file.
+    """
+    key = golden_key(schema_path, sources, layout)
+    golden_path = cache_dir / f"golden-{key[:16]}.db"
+    if golden_path.exists():
+        return golden_path
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    build_path = golden_path.with_suffix(f".{os.getpid()}.tmp")
+    build_path.unlink(missing_ok=True)
+    sql_db_preparation.main(
+        schema_path, str(build_path), sources, layout=layout
+    )
+    # A single, self-contained file: no -wal or -shm companions.
+    connection = db.connect(build_path)
+    connection.execute("PRAGMA journal_mode = DELETE")
+    connection.close()
+    os.replace(build_path, golden_path)
+    return golden_path
+
+
+def clone(
+    golden_path: Path, target: str | Path | db.Connection
+) -> db.Connection:
+    """
+    Copy the golden database with the ``sqlite3`` backup API.
+
+    The ``target`` can be a path, ``":memory:"``, or an open connection.
+    An existing target's content is replaced.
+    """
+    source = db.connect(f"file:{golden_path}?mode=ro", uri=True)
+    if isinstance(target, db.Connection):
+        connection = target
+    else:
+        connection = db.connect(target)
+    source.backup(connection)
+    source.close()
+    return connection
+
+
+def copy(golden_path: Path, target_path: Path) -> None:
+    """Clone by file copy. The target must not be open."""
+    shutil.copyfile(golden_path, target_path)
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-s",
+        "--schema",
+        action="store",
+        type=Path,
+        default=Path("activation_source.schema"),
+    )
+    parser.add_argument(
+        "-d",
+        "--db",
+        action="store",
+        type=Path,
+        default=Path("data/dry_run.db"),
+    )
+    parser.add_argument(
+        "-c",
+        "--cache",
+        action="store",
+        type=Path,
+        default=Path("data/golden"),
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        action="store",
+        choices=list(sql_db_preparation.LAYOUTS),
+        default="legacy",
+    )
+    parser.add_argument(
+        "source",
+        nargs="*",
+        type=Path,
+        default=[Path("data/activation_source.csv")],
+    )
+    return parser.parse_args(argv)
+
+
+def main(
+    schema_path: Path,
+    target: Path,
+    cache_dir: Path,
+    sources: list[Path],
+    layout: str = "legacy",
+) -> None:
+    golden_path = build_golden(cache_dir, schema_path, sources, layout)
+    print(f"cloning {golden_path} to {target}")
+    copy(golden_path, target)
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(
+        options.schema,
+        options.db,
+        options.cache,
+        options.source,
+        options.layout,
+    )
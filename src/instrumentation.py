@@ -0,0 +1,396 @@
+"""
+Statement instrumentation for the loaders and extracts.
+
+A connection made with :py:func:`connection_factory.connect` and
+a :py:class:`Settings` is an :py:class:`InstrumentedConnection`.
+Its cursors record, for each distinct SQL statement, the number of
+calls, the rows affected or fetched, and the time spent executing
+and fetching.
+
+With ``explain``, the first execution of each statement also captures
+its ``EXPLAIN QUERY PLAN``. An ``executemany()`` is explained with its
+first parameter set. An ``executescript()`` isn't explained: it's
+many statements, and ``EXPLAIN`` takes one. A ``SCAN`` of a table with at least
+``big_table_rows`` rows is flagged as a full scan. (A scan of a covering
+index is flagged, too: it still reads every row.)
+A statement with a call slower than ``slow_ms`` is flagged as slow.
+
+The report is text, or JSON, on stdout or in a file.
+
+..  code-block:: bash
+
+    python src/sql_load_process.py --instrument text --explain data/activation_source.csv
+    python src/extract_engine.py --instrument json --instrument-output data/plans.json
+
+"""
+
+import argparse
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from dataclasses import asdict, dataclass, field
+from itertools import chain
+import json
+from pathlib import Path
+import re
+import sqlite3 as db
+import time
+from typing import Any, TypeVar, overload
+
+
+EXPLAINED = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH"}
+
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+
+ALIAS = re.compile(
+    r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", re.IGNORECASE
+)
+
+CursorT = TypeVar("CursorT", bound=db.Cursor)
+
+
+@dataclass
+class Settings:
+    """What to capture, and where to report it."""
+
+    explain: bool = False
+    slow_ms: float = 100.0
+    big_table_rows: int = 100_000
+    report_format: str = "text"
+    output: Path | None = None
+
+
+@dataclass
+class StatementStats:
+    """Totals for one SQL statement."""
+
+    sql: str
+    calls: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    plan: list[str] | None = None
+    full_scans: list[str] = field(default_factory=list)
+
+    def add(self, seconds: float, rows: int = 0) -> None:
+        self.seconds += seconds
+        self.rows += rows
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class InstrumentedCursor(db.Cursor):
+    """A cursor recording its statements on its connection."""
+
+    statement: StatementStats | None = None
+
+    def __init__(self, connection: "InstrumentedConnection") -> None:
+        super().__init__(connection)
+        self.instrumented = connection
+
+    def record(self, sql: str, params: Any) -> None:
+        self.statement = self.instrumented.statement(sql, params)
+
+    def finish(self, start: float) -> None:
+        elapsed = time.perf_counter() - start
+        statement = self.statement
+        if statement is None:
+            return
+        statement.calls += 1
+        statement.add(elapsed, max(self.rowcount, 0))
+        statement.max_seconds = max(statement.max_seconds, elapsed)
+
+    def execute(self, sql: str, params: Any = ()) -> db.Cursor:
+        self.record(sql, params)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self.finish(start)
+
+    def executemany(
+        self, sql: str, seq_of_params: Iterable[Any]
+    ) -> db.Cursor:
+        """Explained with the first parameter set, if there is one."""
+        params = iter(seq_of_params)
+        first = next(params, None)
+        self.record(sql, first)
+        start = time.perf_counter()
+        try:
+            return super().executemany(
+                sql, params if first is None else chain([first], params)
+            )
+        finally:
+            self.finish(start)
+
+    def executescript(self, sql_script: str) -> db.Cursor:
+        self.record(sql_script, None)
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            self.finish(start)
+
+    def fetched(self, start: float, rows: int) -> None:
+        if self.statement:
+            self.statement.add(time.perf_counter() - start, rows)
+
+    def fetchone(self) -> Any:
+        start = time.perf_counter()
+        row = super().fetchone()
+        self.fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size: int | None = None) -> list[Any]:
+        start = time.perf_counter()
+        rows = super().fetchmany(
+            self.arraysize if size is None else size
+        )
+        self.fetched(start, len(rows))
+        return rows
+
+    def fetchall(self) -> list[Any]:
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self.fetched(start, len(rows))
+        return rows
+
+    def __next__(self) -> Any:
+        start = time.perf_counter()
+        row = super().__next__()
+        self.fetched(start, 1)
+        return row
+
+
+class InstrumentedConnection(db.Connection):
+    """
+    A connection whose cursors are :py:class:`InstrumentedCursor`.
+    Nothing is recorded until :py:meth:`instrument` is called,
+    so the profile's own PRAGMAs aren't in the report.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.settings: Settings | None = None
+        self.statements: dict[str, StatementStats] = {}
+        self.table_rows: dict[str, int] = {}
+
+    def instrument(self, settings: Settings) -> None:
+        self.settings = settings
+
+    @overload
+    def cursor(self, factory: None = None) -> db.Cursor: ...
+
+    @overload
+    def cursor(
+        self, factory: Callable[[db.Connection], CursorT]
+    ) -> CursorT: ...
+
+    def cursor(
+        self, factory: Callable[[Any], db.Cursor] | None = None
+    ) -> db.Cursor:
+        if factory is None:
+            factory = InstrumentedCursor if self.settings else db.Cursor
+        return super().cursor(factory)
+
+    # The Connection shortcuts don't call cursor().
+
+    def execute(self, sql: str, params: Any = ()) -> db.Cursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(
+        self, sql: str, seq_of_params: Iterable[Any]
+    ) -> db.Cursor:
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, sql_script: str) -> db.Cursor:
+        return self.cursor().executescript(sql_script)
+
+    def statement(self, sql: str, params: Any) -> StatementStats:
+        """The stats for a statement; the first time, its plan."""
+        key = normalize_sql(sql)
+        if key not in self.statements:
+            self.statements[key] = StatementStats(key)
+            settings = self.settings
+            if settings and settings.explain and params is not None:
+                self.explain(
+                    self.statements[key],
+                    sql,
+                    params,
+                    settings.big_table_rows,
+                )
+        return self.statements[key]
+
+    def explain(
+        self,
+        statement: StatementStats,
+        sql: str,
+        params: Sequence[Any] | Mapping[str, Any],
+        big_table_rows: int,
+    ) -> None:
+        words = sql.split(maxsplit=1)
+        if not words or words[0].upper() not in EXPLAINED:
+            return
+        cursor = db.Cursor(self)
+        cursor.row_factory = None
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = cursor.fetchall()
+        except db.Error as error:
+            statement.plan = [f"not explained: {error}"]
+            return
+        finally:
+            cursor.close()
+        aliases = {
+            alias.lower(): table for table, alias in ALIAS.findall(sql)
+        }
+        depth = {0: 0}
+        statement.plan = []
+        for node, parent, _, detail in plan:
+            depth[node] = depth.get(parent, 0) + 1
+            statement.plan.append("  " * (depth[node] - 1) + detail)
+            if match := SCAN.match(detail):
+                name = match.group(1)
+                table = aliases.get(name.lower(), name)
+                rows = self.rows_in(table)
+                if rows >= big_table_rows:
+                    statement.full_scans.append(
+                        f"{table} ({rows} rows)"
+                    )
+
+    def rows_in(self, table: str) -> int:
+        """Estimated rows, from ``max(rowid)``, like extract_engine."""
+        if table not in self.table_rows:
+            cursor = db.Cursor(self)
+            try:
+                cursor.execute(
+                    f'SELECT coalesce(max(rowid), 0) FROM "{table}"'
+                )
+                (self.table_rows[table],) = cursor.fetchone()
+            except db.Error:
+                # A subquery, a CTE, or a table without a rowid.
+                self.table_rows[table] = 0
+            finally:
+                cursor.close()
+        return self.table_rows[table]
+
+
+def flags(statement: StatementStats, settings: Settings) -> list[str]:
+    result = []
+    if statement.max_seconds * 1000 >= settings.slow_ms:
+        result.append("slow")
+    result.extend(
+        f"full scan of {scan}" for scan in statement.full_scans
+    )
+    return result
+
+
+def report(connection: InstrumentedConnection) -> str:
+    """Statements, slowest total time first."""
+    settings = connection.settings or Settings()
+    statements = sorted(
+        connection.statements.values(),
+        key=lambda statement: statement.seconds,
+        reverse=True,
+    )
+    if settings.report_format == "json":
+        return json.dumps(
+            [
+                asdict(statement)
+                | {"flags": flags(statement, settings)}
+                for statement in statements
+            ],
+            indent=2,
+        )
+    lines = []
+    for statement in statements:
+        lines.append(
+            f"{statement.calls} calls, {statement.rows} rows, "
+            f"{statement.seconds * 1000:.1f} ms total, "
+            f"{statement.max_seconds * 1000:.1f} ms max: "
+            f"{statement.sql[:100]}"
+        )
+        lines.extend(
+            f"    ** {flag}" for flag in flags(statement, settings)
+        )
+        lines.extend(f"    {step}" for step in statement.plan or [])
+    return "\n".join(lines)
+
+
+def merge(connection: db.Connection, other: db.Connection) -> None:
+    """Add another connection's statements; a worker thread's, say."""
+    if not isinstance(connection, InstrumentedConnection):
+        return
+    if not isinstance(other, InstrumentedConnection):
+        return
+    for key, theirs in other.statements.items():
+        if key not in connection.statements:
+            connection.statements[key] = StatementStats(
+                key, plan=theirs.plan, full_scans=theirs.full_scans
+            )
+        ours = connection.statements[key]
+        ours.calls += theirs.calls
+        ours.add(theirs.seconds, theirs.rows)
+        ours.max_seconds = max(ours.max_seconds, theirs.max_seconds)
+
+
+def write_report(connection: db.Connection) -> None:
+    """Print or save the report of an instrumented connection."""
+    if not isinstance(connection, InstrumentedConnection):
+        return
+    text = report(connection)
+    output = connection.settings and connection.settings.output
+    if output:
+        output.write_text(text + "\n")
+        print(f"wrote statement report to {output}")
+    else:
+        print(text)
+
+
+def add_instrument_options(parser: argparse.ArgumentParser) -> None:
+    """The options shared by the loaders and extracts."""
+    parser.add_argument(
+        "--instrument",
+        action="store",
+        choices=["text", "json"],
+        default=None,
+        help="report the time and rows of each SQL statement",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        default=False,
+        help="capture each statement's EXPLAIN QUERY PLAN",
+    )
+    parser.add_argument(
+        "--slow-ms",
+        action="store",
+        type=float,
+        default=Settings.slow_ms,
+    )
+    parser.add_argument(
+        "--big-table-rows",
+        action="store",
+        type=int,
+        default=Settings.big_table_rows,
+        help="flag full scans of tables this big",
+    )
+    parser.add_argument(
+        "--instrument-output",
+        action="store",
+        type=Path,
+        default=None,
+    )
+
+
+def settings_from(options: argparse.Namespace) -> Settings | None:
+    """The :py:class:`Settings`, if ``--instrument`` was given."""
+    if not options.instrument:
+        return None
+    return Settings(
+        explain=options.explain,
+        slow_ms=options.slow_ms,
+        big_table_rows=options.big_table_rows,
+        report_format=options.instrument,
+        output=options.instrument_output,
+    )
@@ -0,0 +1,201 @@
+"""
+Per-instance lookup cache.
+
+``@lru_cache`` on a method shares one cache among all instances,
+keeps every ``self`` (and its database connection) alive,
+and doesn't report how well it's working.
+A :py:class:`LookupCache` belongs to one object and goes away with it.
+
+..  code-block:: python
+
+    class ServiceNameMapping:
+        def __init__(self, connection):
+            self.connection = connection
+            self.cache = LookupCache(self.fetch, maxsize=128)
+
+        def fetch(self, service_id):
+            ...  # the database query
+
+        def __getitem__(self, service_id):
+            return self.cache[service_id]
+
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable, Iterable
+from dataclasses import dataclass
+from typing import cast
+
+
+POLICIES = ("lru", "lfu", "unbounded")
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def add(self, other: "CacheStats") -> None:
+        """Add another cache's stats; a worker thread's, say."""
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evictions, "
+            f"{self.hit_ratio:.1%} hit ratio"
+        )
+
+
+class LookupCache[K: Hashable, V]:
+    """
+    Cache the results of ``loader(key)``.
+
+    The ``policy`` is ``"lru"`` (evict the least recently used),
+    ``"lfu"`` (evict the least frequently used), or ``"unbounded"``
+    (never evict; ``maxsize`` is ignored).
+    A bounded cache with a ``maxsize`` of zero (or less) keeps nothing,
+    like ``functools.lru_cache(0)``; every lookup is a miss.
+
+    ``None`` results -- unknown keys -- are cached, too.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[K], V],
+        maxsize: int = 128,
+        policy: str = "lru",
+    ) -> None:
+        if policy not in POLICIES:
+            raise ValueError(f"unknown policy {policy!r}")
+        self.loader = loader
+        self.maxsize = maxsize
+        self.policy = policy
+        self.values: OrderedDict[K, V] = OrderedDict()
+        # For "lfu": each key's use count, and the keys with each count,
+        # least recently used first. Eviction takes the first key
+        # with the fewest uses, without a scan.
+        self.uses: dict[K, int] = {}
+        self.by_uses: dict[int, OrderedDict[K, None]] = {}
+        self.fewest_uses = 0
+        self.stats = CacheStats()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.values
+
+    def __getitem__(self, key: K) -> V:
+        try:
+            value = self.values[key]
+        except KeyError:
+            self.stats.misses += 1
+            value = self.loader(key)
+            self.store(key, value)
+            return value
+        self.stats.hits += 1
+        self.used(key)
+        return value
+
+    def get_many(
+        self,
+        keys: Iterable[K],
+        loader: Callable[[list[K]], dict[K, V]],
+    ) -> dict[K, V]:
+        """
+        The values of several keys. All the misses are loaded with one
+        ``loader(missing_keys)`` call, which returns a dict; a key it
+        leaves out gets ``None``, like an unknown key's ``loader(key)``.
+        Every value is returned, even if the cache can't keep them all.
+        """
+        found: dict[K, V] = {}
+        missing: list[K] = []
+        for key in dict.fromkeys(keys):
+            if key in self.values:
+                found[key] = self[key]
+            else:
+                missing.append(key)
+        if missing:
+            self.stats.misses += len(missing)
+            loaded = loader(missing)
+            for key in missing:
+                found[key] = cast(V, loaded.get(key))
+                self.store(key, found[key])
+        return found
+
+    def used(self, key: K) -> None:
+        """Note a use of a cached key."""
+        if self.policy == "lru":
+            self.values.move_to_end(key)
+        elif self.policy == "lfu":
+            count = self.uses.get(key, 0)
+            if count:
+                self.unlist(key, count)
+            else:
+                self.fewest_uses = 1
+            self.uses[key] = count + 1
+            self.by_uses.setdefault(count + 1, OrderedDict())[key] = (
+                None
+            )
+
+    def unlist(self, key: K, count: int) -> None:
+        """Remove a key from the keys used ``count`` times."""
+        keys = self.by_uses[count]
+        del keys[key]
+        if not keys:
+            del self.by_uses[count]
+            if self.fewest_uses == count:
+                self.fewest_uses = count + 1
+
+    def store(self, key: K, value: V) -> None:
+        if key in self.values:
+            self.values[key] = value
+            self.used(key)
+            return
+        if self.policy != "unbounded":
+            if self.maxsize <= 0:
+                return
+            if len(self.values) >= self.maxsize:
+                self.evict()
+        self.values[key] = value
+        self.used(key)
+
+    def evict(self) -> None:
+        if self.policy == "lfu":
+            # The least recently used of the least frequently used.
+            key = next(iter(self.by_uses[self.fewest_uses]))
+        else:
+            key = next(iter(self.values))
+        self.forget(key)
+        self.stats.evictions += 1
+
+    def forget(self, key: K) -> None:
+        del self.values[key]
+        if key in self.uses:
+            self.unlist(key, self.uses.pop(key))
+
+    def prefetch(self, items: Iterable[tuple[K, V]]) -> None:
+        """
+        Bulk load ``(key, value)`` pairs; for example, a whole dimension.
+        Nothing is evicted: a bounded cache grows to hold them all.
+        """
+        for key, value in items:
+            self.values[key] = value
+            self.used(key)
+        self.maxsize = max(self.maxsize, len(self.values))
+
+    def clear(self) -> None:
+        """Release all cached values. The statistics are kept."""
+        self.values.clear()
+        self.uses.clear()
+        self.by_uses.clear()
+        self.fewest_uses = 0
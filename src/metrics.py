@@ -0,0 +1,66 @@
+"""
+Measurements reported by the applications.
+"""
+
+from collections.abc import Iterable, Iterator, Sequence
+from dataclasses import dataclass, field
+import resource
+import sys
+import time
+from typing import Any
+
+
+def peak_rss_kib() -> int:
+    """
+    Peak resident set size of this process, in KiB.
+
+    This is a high-water mark: it never decreases.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # macOS reports bytes; Linux reports KiB.
+        peak //= 1024
+    return peak
+
+
+@dataclass
+class RunStats:
+    """
+    Rows produced by a query, and how quickly.
+    The clock starts when this is created, before the query runs.
+    """
+
+    name: str
+    rows: int = 0
+    seconds: float = 0.0
+    first_row_seconds: float | None = None
+    started: float = field(
+        default_factory=time.perf_counter, repr=False
+    )
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def measure(
+        self, batches: Iterable[Sequence[Any]]
+    ) -> Iterator[Sequence[Any]]:
+        """Count the rows in each batch as they pass through."""
+        try:
+            for batch in batches:
+                if batch and self.first_row_seconds is None:
+                    self.first_row_seconds = (
+                        time.perf_counter() - self.started
+                    )
+                self.rows += len(batch)
+                yield batch
+        finally:
+            self.seconds = time.perf_counter() - self.started
+
+    def __str__(self) -> str:
+        first = self.first_row_seconds or 0.0
+        return (
+            f"{self.name}: {self.rows} rows in {self.seconds:.3f}s, "
+            f"{self.rows_per_second:,.0f} rows/s, "
+            f"first row after {first:.3f}s"
+        )
@@ -0,0 +1,178 @@
+"""
+Parallel, range-partitioned service name counts.
+
+The ``customer_device_service`` rowids are split into ranges.
+Each range is aggregated by ``service_id`` in a separate process,
+with its own read-only connection and memory-mapped I/O.
+The partial counts are merged, then mapped to service names.
+
+The ranges end at the largest rowid when the extract starts.
+A live loader only appends rows, so rows it adds later are
+left out of every range, even though each worker has its own snapshot.
+
+..  code-block:: bash
+
+    python src/parallel_extract.py --workers 4 -o data/service_name_counts.csv
+
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from functools import partial
+import os
+from pathlib import Path
+import sqlite3 as db
+import sys
+from textwrap import dedent
+
+import connection_factory
+import extract_engine
+
+
+def rowid_ranges(
+    connection: db.Connection, partitions: int
+) -> list[tuple[int, int]]:
+    """Inclusive ``(low, high)`` ranges of about the same size."""
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT min(rowid), max(rowid)
+            FROM customer_device_service
+        """)
+    )
+    first, last = cursor.fetchone()
+    cursor.close()
+    if first is None:
+        return []
+    size = -(-(last - first + 1) // partitions)
+    return [
+        (low, min(low + size - 1, last))
+        for low in range(first, last + 1, size)
+    ]
+
+
+def count_range(
+    database: str | Path,
+    mmap_size: int,
+    rowid_range: tuple[int, int],
+) -> Counter[int]:
+    """
+    Activations per ``service_id`` in one range of rowids.
+    Runs in a worker process, with its own read-only connection.
+
+    The ``read-extract`` profile's large page cache and in-memory
+    temp store make this ``GROUP BY`` slower, so the worker uses
+    SQLite's defaults, plus memory-mapped I/O.
+    """
+    query = dedent("""
+        SELECT service_id, count(*)
+        FROM customer_device_service
+        WHERE rowid BETWEEN :low AND :high
+        GROUP BY service_id
+    """)
+    low, high = rowid_range
+    connection = connection_factory.connect(
+        database, "default", read_only=True
+    )
+    connection.execute(f"PRAGMA mmap_size = {mmap_size:d}")
+    cursor = connection.cursor()
+    cursor.execute(query, {"low": low, "high": high})
+    counts = Counter(dict(cursor.fetchall()))
+    cursor.close()
+    connection.close()
+    return counts
+
+
+def parallel_counts(
+    database: str | Path,
+    workers: int,
+    partitions: int | None = None,
+    mmap_size: int = 1_073_741_824,
+) -> Counter[str]:
+    """
+    Merge the per-range counts from a pool of ``workers`` processes.
+    By default, there's one range per worker.
+    """
+    connection = connection_factory.connect(
+        database, "read-extract", read_only=True
+    )
+    with connection_factory.read_snapshot(connection):
+        ranges = rowid_ranges(connection, partitions or workers)
+        names = extract_engine.service_name_map(connection)
+    connection.close()
+
+    by_id: Counter[int] = Counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for partial_counts in executor.map(
+            partial(count_range, database, mmap_size), ranges
+        ):
+            by_id.update(partial_counts)
+    counter = extract_engine.named_counts(names, by_id.items())
+    print(f"merged {len(ranges)} ranges from {workers} workers")
+    return counter
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data/service_name_counts.csv"),
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--partitions",
+        action="store",
+        type=int,
+        default=None,
+        help="rowid ranges (default: one per worker)",
+    )
+    parser.add_argument(
+        "--mmap-size", action="store", type=int, default=1_073_741_824
+    )
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect: str,
+    target: Path,
+    workers: int,
+    partitions: int | None = None,
+    mmap_size: int = 1_073_741_824,
+) -> None:
+    OUTPUT_FIELDNAMES = ["service_name", "count"]
+
+    counts = parallel_counts(
+        database_connect, workers, partitions, mmap_size
+    )
+    with target.open("w", newline="") as target_file:
+        writer = csv.DictWriter(target_file, OUTPUT_FIELDNAMES)
+        writer.writeheader()
+        rows = (
+            {"service_name": key, "count": value}
+            for key, value in counts.items()
+        )
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(
+        options.db,
+        options.output,
+        options.workers,
+        options.partitions,
+        options.mmap_size,
+    )
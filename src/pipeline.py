@@ -0,0 +1,415 @@
+"""
+Stage-composable pipelines, with per-stage metrics.
+
+A :py:class:`Stage` is a named function from an iterable of rows to an
+iterator of rows, like ``efficiencies.lookup_something()``.
+A :py:class:`Pipeline` chains its stages: each one consumes the rows
+produced by the one before it. The first stage may ignore its input
+and produce rows of its own; a query, for example.
+
+Each stage's :py:class:`StageStats` has the rows in, the rows out,
+and the time spent in the stage itself, not counting the time
+spent waiting for rows from the stages before it.
+Timing every row would cost more than a simple stage does, so every
+row is counted, but only one pull in ``sample`` is timed, and scaled.
+The first pull is always timed, so a stage that reads all of its
+input before producing anything (a sort, a ``GROUP BY``) isn't missed.
+
+Any stage can be run differently, without changing it:
+
+-   ``Stage(..., threaded=True)`` runs the stage, and the stages before
+    it, in a thread. Rows are passed on in batches, through a bounded
+    queue, so a slow consumer holds back the producer.
+
+-   :py:func:`map_stage` applies a function to each row in a pool of
+    processes. The function and the rows must be picklable.
+
+-   :py:func:`parallel` has a reader thread split the rows into
+    batches for several worker threads, each running its own copy
+    of some stages. The results come back in order, or as completed.
+
+..  code-block:: python
+
+    pipeline = Pipeline(
+        Stage("query", lambda rows: query_table(connection)),
+        Stage("lookup", partial(lookup_something, connection)),
+        map_stage("compute", compute, workers=4),
+    )
+    rows = list(pipeline.run())
+    print(pipeline.report())
+
+"""
+
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from itertools import count, islice
+import os
+from queue import Empty, Full, Queue
+from threading import BoundedSemaphore, Event, Thread
+import time
+from typing import Any
+
+
+SAMPLE = 16
+
+QUEUE_BATCHES = 8
+
+BATCH_SIZE = 1_000
+
+DONE = object()
+
+
+@dataclass
+class StageStats:
+    """Rows in and out of one stage, and the time spent in it."""
+
+    name: str
+    rows_in: int = 0
+    rows_out: int = 0
+    seconds: float = 0.0
+
+    def add(self, other: "StageStats") -> None:
+        """Add another run's totals; another worker's, say."""
+        self.rows_in += other.rows_in
+        self.rows_out += other.rows_out
+        self.seconds += other.seconds
+
+    @property
+    def rows_per_second(self) -> float:
+        rows = max(self.rows_in, self.rows_out)
+        return rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.rows_in} rows in, "
+            f"{self.rows_out} rows out, {self.seconds:.3f}s, "
+            f"{self.rows_per_second:,.0f} rows/s"
+        )
+
+
+@dataclass
+class Stage:
+    """
+    A named step of a pipeline.
+    With ``threaded``, it runs in a thread; the queue between it
+    and the next stage holds ``queue_batches`` batches of
+    ``batch_size`` rows.
+    """
+
+    name: str
+    process: Callable[[Iterable[Any]], Iterable[Any]]
+    threaded: bool = False
+    queue_batches: int = QUEUE_BATCHES
+    batch_size: int = BATCH_SIZE
+
+
+def close(iterator: Iterator[Any]) -> None:
+    """
+    Close a generator now, so its ``finally`` runs; for example,
+    a stage's cleanup. Other iterators have nothing to close.
+    """
+    closer = getattr(iterator, "close", None)
+    if closer is not None:
+        closer()
+
+
+def metered(
+    stage: Stage,
+    rows: Iterable[Any],
+    stats: StageStats,
+    sample: int = SAMPLE,
+) -> Iterator[Any]:
+    """
+    The stage's output, counting rows in and out.
+    While one of its pulls is timed, so are its pulls of input rows;
+    the difference is the time spent in the stage.
+    """
+    timing = False
+    upstream = 0.0
+
+    def inputs() -> Iterator[Any]:
+        nonlocal upstream
+        source = iter(rows)
+        while True:
+            if timing:
+                start = time.perf_counter()
+                row = next(source, DONE)
+                upstream += time.perf_counter() - start
+            else:
+                row = next(source, DONE)
+            if row is DONE:
+                return
+            stats.rows_in += 1
+            yield row
+
+    outputs = iter(stage.process(inputs()))
+    pulls = 0
+    try:
+        while True:
+            if pulls % sample == 0:
+                timing, upstream = True, 0.0
+                start = time.perf_counter()
+                row = next(outputs, DONE)
+                elapsed = time.perf_counter() - start - upstream
+                stats.seconds += elapsed * (sample if pulls else 1)
+                timing = False
+            else:
+                row = next(outputs, DONE)
+            if row is DONE:
+                return
+            pulls += 1
+            stats.rows_out += 1
+            yield row
+    finally:
+        close(outputs)
+
+
+def put(queue: Queue, item: Any, stop: Event) -> bool:
+    """Wait for room in the queue, unless the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def get(queue: Queue, stop: Event) -> Any:
+    """Wait for an item, unless the consumer has stopped."""
+    while not stop.is_set():
+        try:
+            return queue.get(timeout=0.1)
+        except Empty:
+            pass
+    return DONE
+
+
+def threaded(
+    rows: Iterable[Any], queue_batches: int, batch_size: int
+) -> Iterator[Any]:
+    """
+    Produce the rows in a thread, a batch at a time.
+    An exception in the thread is raised here.
+    If the consumer stops early, the thread stops at the next batch.
+    """
+    queue: Queue = Queue(queue_batches)
+    stop = Event()
+
+    def produce() -> None:
+        source = iter(rows)
+        try:
+            while batch := list(islice(source, batch_size)):
+                if not put(queue, batch, stop):
+                    return
+            put(queue, DONE, stop)
+        # Anything, even SystemExit, is raised in the consumer's thread.
+        except BaseException as error:  # noqa: BLE001
+            put(queue, error, stop)
+        finally:
+            close(source)
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (batch := queue.get()) is not DONE:
+            if isinstance(batch, BaseException):
+                raise batch
+            yield from batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+def apply(
+    function: Callable[[Any], Any], chunk: list[Any]
+) -> list[Any]:
+    """Runs in a worker process. A ``None`` result drops the row."""
+    results = map(function, chunk)
+    return [result for result in results if result is not None]
+
+
+def pool_map(
+    function: Callable[[Any], Any],
+    workers: int | None,
+    chunksize: int,
+    rows: Iterable[Any],
+) -> Iterator[Any]:
+    """
+    Apply the function to chunks of rows in a process pool, in order.
+    Only two chunks per worker are in flight; ``Executor.map()``
+    would read all of the rows first.
+    """
+    workers = workers or os.cpu_count() or 1
+    source = iter(rows)
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        while chunk := list(islice(source, chunksize)):
+            pending.append(executor.submit(apply, function, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def map_stage(
+    name: str,
+    function: Callable[[Any], Any],
+    workers: int | None = None,
+    chunksize: int = BATCH_SIZE,
+) -> Stage:
+    """
+    A stage applying a picklable function to each row, in a pool of
+    ``workers`` processes. Rows it maps to ``None`` are dropped.
+    """
+    return Stage(name, partial(pool_map, function, workers, chunksize))
+
+
+def parallel(
+    work: Callable[[Iterable[list[Any]]], Iterable[list[Any]]],
+    rows: Iterable[Any],
+    workers: int,
+    ordered: bool = True,
+    batch_size: int = BATCH_SIZE,
+    max_batches: int | None = None,
+) -> Iterator[list[Any]]:
+    """
+    A reader thread splits the rows into batches. Each of ``workers``
+    threads runs ``work`` over its share of them: a generator taking
+    batches, and yielding one batch of results for each, so it can
+    set up and clean up around its loop; opening its own connection,
+    for example.
+    The result batches are yielded here, in their input order,
+    or, if not ``ordered``, as they're completed.
+
+    At most ``max_batches`` (by default, two per worker) are in flight:
+    read, but not yet yielded. The reader waits for the consumer,
+    so the queues, and the batches held back to restore the order,
+    are bounded.
+
+    The workers share nothing but the queues. With a free-threaded
+    build of Python, they run in parallel; with the GIL, they overlap
+    file and SQLite I/O, which release it.
+    """
+    max_batches = max_batches or 2 * workers
+    todo: Queue = Queue(max_batches + workers)
+    done: Queue = Queue(max_batches + 2 * workers + 1)
+    in_flight = BoundedSemaphore(max_batches)
+    stop = Event()
+
+    def read() -> None:
+        source = iter(rows)
+        try:
+            for number in count():
+                batch = list(islice(source, batch_size))
+                if not batch:
+                    break
+                while not in_flight.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if not put(todo, (number, batch), stop):
+                    return
+        # Anything, even SystemExit, is raised in the consumer's thread.
+        except BaseException as error:  # noqa: BLE001
+            put(done, ("error", None, error), stop)
+        finally:
+            for _ in range(workers):
+                put(todo, DONE, stop)
+            close(source)
+
+    def run_worker() -> None:
+        number = None
+
+        def batches() -> Iterator[list[Any]]:
+            nonlocal number
+            while (item := get(todo, stop)) is not DONE:
+                number, batch = item
+                yield batch
+
+        try:
+            for result in work(batches()):
+                put(done, ("result", number, result), stop)
+        # Anything, even SystemExit, is raised in the consumer's thread.
+        except BaseException as error:  # noqa: BLE001
+            put(done, ("error", number, error), stop)
+        finally:
+            put(done, DONE, stop)
+
+    threads = [Thread(target=read, daemon=True)] + [
+        Thread(target=run_worker, daemon=True) for _ in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    pending: dict[int, list[Any]] = {}
+    expected = 0
+    running = workers
+    try:
+        while running:
+            item = done.get()
+            if item is DONE:
+                running -= 1
+                continue
+            kind, number, value = item
+            if kind == "error":
+                raise value
+            if not ordered:
+                in_flight.release()
+                yield value
+                continue
+            pending[number] = value
+            while expected in pending:
+                in_flight.release()
+                yield pending.pop(expected)
+                expected += 1
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def report(stats: Iterable[StageStats]) -> str:
+    return "\n".join(map(str, stats))
+
+
+class Pipeline:
+    """
+    Stages, composed.
+    The ``stats`` of an earlier run can be passed in to accumulate
+    the totals of several runs; for example, several source files.
+    """
+
+    def __init__(
+        self,
+        *stages: Stage,
+        stats: list[StageStats] | None = None,
+        sample: int = SAMPLE,
+    ) -> None:
+        self.stages = stages
+        self.stats = stats or [
+            StageStats(stage.name) for stage in stages
+        ]
+        if [s.name for s in self.stats] != [s.name for s in stages]:
+            raise ValueError("stats don't match the stages")
+        self.sample = sample
+
+    def run(self, source: Iterable[Any] = ()) -> Iterator[Any]:
+        rows = source
+        for stage, stats in zip(self.stages, self.stats):
+            rows = metered(stage, rows, stats, self.sample)
+            if stage.threaded:
+                rows = threaded(
+                    rows, stage.queue_batches, stage.batch_size
+                )
+        yield from rows
+
+    def drain(self, source: Iterable[Any] = ()) -> list[StageStats]:
+        """Run for the side effects of the stages; a loader, say."""
+        for _ in self.run(source):
+            pass
+        return self.stats
+
+    def report(self) -> str:
+        return report(self.stats)
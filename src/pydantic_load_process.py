@@ -39,6 +39,8 @@ from pydantic.functional_validators import (
     AfterValidator,
 )
 
+import connection_factory
+
 
 def latlon_conversion(source: str | float) -> float:
     """Parses latitude or longitude string to produce a normalized float result."""
@@ -196,13 +198,17 @@ def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
         type=Path,
         default=Path("data/activation_source.csv"),
     )
+    connection_factory.add_profile_option(parser, "read-extract")
     return parser.parse_args(argv)
 
 
 def main(
-    database_connect: str, target: Path, sources: list[Path]
+    database_connect: str,
+    target: Path,
+    sources: list[Path],
+    profile: str = "read-extract",
 ) -> None:
-    connection = db.connect(database_connect)
+    connection = connection_factory.connect(database_connect, profile)
     counts = Counter()
     field_names = [
         n
@@ -229,4 +235,4 @@ def main(
 
 if __name__ == "__main__":
     options = get_options()
-    main(options.db, options.output, options.source)
+    main(options.db, options.output, options.source, options.profile)
@@ -20,6 +20,10 @@ import sys
 from textwrap import dedent
 from typing import Any
 
+import connection_factory
+import instrumentation
+import metrics
+
 
 def service_names(connection: db.Connection) -> dict[str, Any]:
     service_name_query = dedent("""
@@ -33,21 +37,29 @@ def service_names(connection: db.Connection) -> dict[str, Any]:
     return mapping
 
 
-def cst_dev_svc_counts(connection: db.Connection) -> Counter[str]:
+def cst_dev_svc_counts(
+    connection: db.Connection, arraysize: int = 1000
+) -> Counter[str]:
+    """
+    Streams the rows, ``arraysize`` at a time.
+    Memory use doesn't depend on the size of the table.
+    """
     service_name_mapping = service_names(connection)
     counter = Counter()
     customer_device_service_query = dedent("""
-        SELECT * 
+        SELECT service_id
         FROM customer_device_service
     """)
     cursor = connection.cursor()
+    cursor.arraysize = arraysize
     cursor.execute(customer_device_service_query)
-    for cst_dev_svc in cursor.fetchall():
-        service_name_row = service_name_mapping[
-            cst_dev_svc["service_id"]
-        ]
-        service_name = service_name_row["service_name"]
-        counter[service_name] += 1
+    while batch := cursor.fetchmany():
+        for cst_dev_svc in batch:
+            service_name_row = service_name_mapping[
+                cst_dev_svc["service_id"]
+            ]
+            service_name = service_name_row["service_name"]
+            counter[service_name] += 1
     cursor.close()
     return counter
 
@@ -64,25 +76,50 @@ def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
         type=Path,
         default=Path("data/service_name_counts.csv"),
     )
+    parser.add_argument(
+        "--arraysize",
+        action="store",
+        type=int,
+        default=1000,
+        help="rows fetched from the database at a time",
+    )
+    connection_factory.add_profile_option(parser, "read-extract")
+    connection_factory.add_read_only_option(parser)
+    instrumentation.add_instrument_options(parser)
     return parser.parse_args(argv)
 
 
-def main(database_connect: str, target: Path) -> None:
+def main(
+    database_connect: str,
+    target: Path,
+    profile: str = "read-extract",
+    arraysize: int = 1000,
+    read_only: bool = False,
+    instrument: instrumentation.Settings | None = None,
+) -> None:
     OUTPUT_FIELDNAMES = ["service_name", "count"]
 
-    connection = db.connect(database_connect)
+    connection = connection_factory.connect(
+        database_connect, profile, read_only, instrument
+    )
     connection.row_factory = db.Row
 
     with target.open("w", newline="") as target_file:
         writer = csv.DictWriter(target_file, OUTPUT_FIELDNAMES)
         writer.writeheader()
-        with connection:
-            counts = cst_dev_svc_counts(connection)
-            rows = (
-                {"service_name": key, "count": value}
-                for key, value in counts.items()
-            )
-            writer.writerows(rows)
+        rss_before = metrics.peak_rss_kib()
+        with connection_factory.read_snapshot(connection):
+            counts = cst_dev_svc_counts(connection, arraysize)
+        rss_after = metrics.peak_rss_kib()
+        print(
+            f"peak RSS {rss_before} KiB before, {rss_after} KiB after"
+        )
+        rows = (
+            {"service_name": key, "count": value}
+            for key, value in counts.items()
+        )
+        writer.writerows(rows)
+    instrumentation.write_report(connection)
 
 
 if __name__ == "__main__":
@@ -90,4 +127,8 @@ if __name__ == "__main__":
     main(
         database_connect=options.db,
         target=options.output,
+        profile=options.profile,
+        arraysize=options.arraysize,
+        read_only=options.read_only,
+        instrument=instrumentation.settings_from(options),
     )
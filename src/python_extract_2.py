@@ -16,29 +16,44 @@ to provide the mapping by doing lookups as needed.
 import argparse
 import csv
 from collections import Counter
-from functools import lru_cache
 from pathlib import Path
 import sqlite3 as db
 import sys
 from textwrap import dedent
 from typing import Any
 
+import connection_factory
+import instrumentation
+from lookup_cache import POLICIES, LookupCache
+import metrics
+
 
 class ServiceNameMapping:
     """
     Initialized with a DB connection.
     This behaves like a mapping, so ``snm["service"]`` does the database lookup.
+
+    Each instance has its own :py:class:`lookup_cache.LookupCache`.
+    With ``prefetch``, the whole service table is loaded at once.
     """
 
-    def __init__(self, connection: db.Connection) -> None:
+    def __init__(
+        self,
+        connection: db.Connection,
+        maxsize: int = 32,
+        policy: str = "lru",
+        prefetch: bool = False,
+    ) -> None:
         self.connection = connection
+        self.cache = LookupCache(self.fetch, maxsize, policy)
+        if prefetch:
+            self.prefetch()
 
-    @lru_cache(32)
-    def get(self, service_id: str, default: str | None = None) -> Any:
+    def fetch(self, service_id: str) -> Any:
         cursor = self.connection.cursor()
         cursor.execute(
             dedent("""
-                SELECT * 
+                SELECT rowid, service_name
                 FROM service 
                 WHERE rowid = :service_id
             """),
@@ -46,6 +61,28 @@ class ServiceNameMapping:
         )
         row = cursor.fetchone()
         cursor.close()
+        return row
+
+    def prefetch(self) -> None:
+        """
+        Load every service; the cache grows to hold them all.
+        The rows are the same as the ones ``fetch`` returns.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute(
+            dedent("""
+                SELECT rowid, service_name
+                FROM service
+            """)
+        )
+        self.cache.prefetch((row[0], row) for row in cursor)
+        cursor.close()
+
+    def close(self) -> None:
+        self.cache.clear()
+
+    def get(self, service_id: str, default: str | None = None) -> Any:
+        row = self.cache[service_id]
         if row is None and default is None:
             raise ValueError(f"unknown service_id {service_id!r}")
         elif row is None and default is not None:
@@ -56,22 +93,40 @@ class ServiceNameMapping:
         return self.get(service_id)
 
 
-def cst_dev_svc_counts(connection: db.Connection) -> Counter[str]:
-    service_name_mapping = ServiceNameMapping(connection)
+def cst_dev_svc_counts(
+    connection: db.Connection,
+    arraysize: int = 1000,
+    maxsize: int = 32,
+    policy: str = "lru",
+    prefetch: bool = False,
+) -> Counter[str]:
+    """
+    Streams the rows, ``arraysize`` at a time.
+    Memory use doesn't depend on the size of the table.
+    The ``maxsize``, ``policy``, and ``prefetch`` options
+    configure the service name cache.
+    """
+    service_name_mapping = ServiceNameMapping(
+        connection, maxsize, policy, prefetch
+    )
     counter = Counter()
     customer_device_service_query = dedent("""
-        SELECT * 
+        SELECT service_id
         FROM customer_device_service
     """)
     cursor = connection.cursor()
+    cursor.arraysize = arraysize
     cursor.execute(customer_device_service_query)
-    for cst_dev_svc in cursor.fetchall():
-        service_name_row = service_name_mapping[
-            cst_dev_svc["service_id"]
-        ]
-        service_name = service_name_row["service_name"]
-        counter[service_name] += 1
+    while batch := cursor.fetchmany():
+        for cst_dev_svc in batch:
+            service_name_row = service_name_mapping[
+                cst_dev_svc["service_id"]
+            ]
+            service_name = service_name_row["service_name"]
+            counter[service_name] += 1
     cursor.close()
+    print(f"service name lookups: {service_name_mapping.cache.stats}")
+    service_name_mapping.close()
     return counter
 
 
@@ -87,25 +142,78 @@ def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
         type=Path,
         default=Path("data/service_name_counts.csv"),
     )
+    parser.add_argument(
+        "--arraysize",
+        action="store",
+        type=int,
+        default=1000,
+        help="rows fetched from the database at a time",
+    )
+    parser.add_argument(
+        "--cache-size",
+        action="store",
+        type=int,
+        default=32,
+        help="service names kept in the lookup cache; 0 keeps none",
+    )
+    parser.add_argument(
+        "--cache-policy",
+        action="store",
+        choices=POLICIES,
+        default="lru",
+    )
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        default=False,
+        help="load the whole service table into the cache first",
+    )
+    connection_factory.add_profile_option(parser, "read-extract")
+    connection_factory.add_read_only_option(parser)
+    instrumentation.add_instrument_options(parser)
     return parser.parse_args(argv)
 
 
-def main(database_connect: str, target: Path) -> None:
+def main(
+    database_connect: str,
+    target: Path,
+    profile: str = "read-extract",
+    arraysize: int = 1000,
+    read_only: bool = False,
+    instrument: instrumentation.Settings | None = None,
+    cache_size: int = 32,
+    cache_policy: str = "lru",
+    prefetch: bool = False,
+) -> None:
     OUTPUT_FIELDNAMES = ["service_name", "count"]
 
-    connection = db.connect(database_connect)
+    connection = connection_factory.connect(
+        database_connect, profile, read_only, instrument
+    )
     connection.row_factory = db.Row
 
     with target.open("w", newline="") as target_file:
         writer = csv.DictWriter(target_file, OUTPUT_FIELDNAMES)
         writer.writeheader()
-        with connection:
-            counts = cst_dev_svc_counts(connection)
-            rows = (
-                {"service_name": key, "count": value}
-                for key, value in counts.items()
+        rss_before = metrics.peak_rss_kib()
+        with connection_factory.read_snapshot(connection):
+            counts = cst_dev_svc_counts(
+                connection,
+                arraysize,
+                cache_size,
+                cache_policy,
+                prefetch,
             )
-            writer.writerows(rows)
+        rss_after = metrics.peak_rss_kib()
+        print(
+            f"peak RSS {rss_before} KiB before, {rss_after} KiB after"
+        )
+        rows = (
+            {"service_name": key, "count": value}
+            for key, value in counts.items()
+        )
+        writer.writerows(rows)
+    instrumentation.write_report(connection)
 
 
 if __name__ == "__main__":
@@ -113,4 +221,11 @@ if __name__ == "__main__":
     main(
         database_connect=options.db,
         target=options.output,
+        profile=options.profile,
+        arraysize=options.arraysize,
+        read_only=options.read_only,
+        instrument=instrumentation.settings_from(options),
+        cache_size=options.cache_size,
+        cache_policy=options.cache_policy,
+        prefetch=options.prefetch,
     )
@@ -15,10 +15,13 @@ Follow-up processing might be the following CLI command to load the valid rows.
 
 import argparse
 from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
 import csv
 from dataclasses import dataclass, field
 import datetime
-from functools import lru_cache
+import os
+from functools import partial
+from itertools import chain
 from pathlib import Path
 import re
 import sqlite3 as db
@@ -28,6 +31,14 @@ from typing import Any
 
 from dateutil import parser as date_parser
 
+import checkpoint
+import connection_factory
+import geohash
+import instrumentation
+from lookup_cache import LookupCache
+import pipeline
+import timestamps
+
 
 def latlon_conversion(source: str) -> float:
     """Parses latitude or longitude string to produce a normalized float result."""
@@ -61,7 +72,10 @@ from dataclasses import dataclass, field
 
 @dataclass
 class Activation:
-    """Initialization handled eagerly by the application."""
+    """
+    Initialization handled eagerly by the application.
+    With a ``geohash_precision``, the geohash is computed, too.
+    """
 
     customer_name: str
     device_name: str
@@ -69,14 +83,20 @@ class Activation:
     start_date: str
     latitude: str
     longitude: str
+    geohash_precision: int | None = None
     lat_real: float = field(init=False)
     lon_real: float = field(init=False)
     start_date_datetime: datetime.datetime = field(init=False)
+    geohash: str | None = field(init=False, default=None)
 
     def __post_init__(self) -> None:
         self.lat_real = latlon_conversion(self.latitude)
         self.lon_real = latlon_conversion(self.longitude)
         self.start_date_datetime = datetime_conversion(self.start_date)
+        if self.geohash_precision:
+            self.geohash = geohash.encode(
+                self.lat_real, self.lon_real, self.geohash_precision
+            )
 
 
 from dataclasses import dataclass, field
@@ -145,7 +165,6 @@ def bad_data(counts: Counter[str], row: dict[str, str]) -> bool:
     return bad
 
 
-@lru_cache(128)
 def fetch_customer_id(
     connection: db.Connection, customer_name: str
 ) -> Any | None:
@@ -164,7 +183,6 @@ def fetch_customer_id(
     return rowid
 
 
-@lru_cache(128)
 def fetch_service_id(
     connection: db.Connection, service_name: str
 ) -> Any | None:
@@ -183,7 +201,6 @@ def fetch_service_id(
     return rowid
 
 
-@lru_cache(128)
 def fetch_customer_device_id(
     connection: db.Connection, customer_name: str, device_name: str
 ) -> Any | None:
@@ -208,21 +225,86 @@ def fetch_customer_device_id(
     return rowid
 
 
+class References:
+    """
+    The customer, service, and customer-device lookups for one loader.
+    Each has its own :py:class:`lookup_cache.LookupCache`, so the cached
+    ids, and the connection, go away when the loader is finished.
+    """
+
+    def __init__(
+        self,
+        connection: db.Connection,
+        maxsize: int = 128,
+        policy: str = "lru",
+    ) -> None:
+        self.connection = connection
+        self.customers = LookupCache(
+            partial(fetch_customer_id, connection), maxsize, policy
+        )
+        self.services = LookupCache(
+            partial(fetch_service_id, connection), maxsize, policy
+        )
+        self.customer_devices = LookupCache(
+            self.fetch_customer_device_id, maxsize, policy
+        )
+
+    def fetch_customer_device_id(
+        self, key: tuple[str, str]
+    ) -> Any | None:
+        customer_name, device_name = key
+        return fetch_customer_device_id(
+            self.connection, customer_name, device_name
+        )
+
+    def customer_id(self, customer_name: str) -> Any | None:
+        return self.customers[customer_name]
+
+    def service_id(self, service_name: str) -> Any | None:
+        return self.services[service_name]
+
+    def customer_device_id(
+        self, customer_name: str, device_name: str
+    ) -> Any | None:
+        return self.customer_devices[customer_name, device_name]
+
+    def caches(self) -> dict[str, LookupCache]:
+        return {
+            "customer": self.customers,
+            "service": self.services,
+            "customer device": self.customer_devices,
+        }
+
+    def add_stats(self, other: "References") -> None:
+        """Add another loader's lookup stats; a worker thread's, say."""
+        for ours, theirs in zip(
+            self.caches().values(), other.caches().values()
+        ):
+            ours.stats.add(theirs.stats)
+
+    def report(self) -> str:
+        return "\n".join(
+            f"{name} lookups: {cache.stats}"
+            for name, cache in self.caches().items()
+        )
+
+    def close(self) -> None:
+        """Release the cached ids. The statistics are kept."""
+        for cache in self.caches().values():
+            cache.clear()
+
+
 def bad_references(
-    counts: Counter[str], connection: db.Connection, row: dict[str, Any]
+    counts: Counter[str], references: References, row: dict[str, Any]
 ) -> bool:
     """Attempt to fetch all required foreign key values."""
     rule_failure = {
-        "customer_name": fetch_customer_id(
-            connection, row["customer_name"]
-        )
+        "customer_name": references.customer_id(row["customer_name"])
         is None,
-        "service_name": fetch_service_id(
-            connection, row["service_name"]
-        )
+        "service_name": references.service_id(row["service_name"])
         is None,
-        "customer_name,device_name": fetch_customer_device_id(
-            connection, row["customer_name"], row["device_name"]
+        "customer_name,device_name": references.customer_device_id(
+            row["customer_name"], row["device_name"]
         )
         is None,
     }
@@ -236,12 +318,21 @@ def bad_references(
 
 
 def transform_data_dict(
-    counts: Counter[str], row: dict[str, Any]
+    counts: Counter[str],
+    row: dict[str, Any],
+    geohash_precision: int | None = None,
 ) -> dict[str, Any]:
-    """Base transformations from raw string values."""
+    """
+    Base transformations from raw string values.
+    With a ``geohash_precision``, add the geohash, too.
+    """
     row["lat_real"] = latlon_conversion(row["latitude"])
     row["lon_real"] = latlon_conversion(row["longitude"])
     row["start_date_datetime"] = datetime_conversion(row["start_date"])
+    if geohash_precision:
+        row["geohash"] = geohash.encode(
+            row["lat_real"], row["lon_real"], geohash_precision
+        )
     counts["transform"] += 1
     return row
 
@@ -261,35 +352,43 @@ def transform_data_dcp(
 
 
 def persist_data_dict(
-    counts: Counter[str], connection: db.Connection, row: dict[str, Any]
+    counts: Counter[str],
+    references: References,
+    row: dict[str, Any],
+    timestamps_mode: str = "raw",
 ) -> dict[str, Any]:
     """
     Write a final object suitable for loading the database.
+    The ``start_date`` is in the given :py:mod:`timestamps` storage mode.
     """
     output = {
-        "customer_device_id": fetch_customer_device_id(
-            connection, row["customer_name"], row["device_name"]
+        "customer_device_id": references.customer_device_id(
+            row["customer_name"], row["device_name"]
+        ),
+        "service_id": references.service_id(row["service_name"]),
+        "start_date": timestamps.to_storage(
+            row["start_date_datetime"], timestamps_mode
         ),
-        "service_id": fetch_service_id(connection, row["service_name"]),
-        "start_date": row["start_date_datetime"],
         "latitude": row["lat_real"],
         "longitude": row["lon_real"],
     }
+    if "geohash" in row:
+        output["geohash"] = row["geohash"]
     counts["saved"] += 1
     return output
 
 
 def persist_data_dc(
-    counts: Counter[str], connection: db.Connection, row: Activation
+    counts: Counter[str], references: References, row: Activation
 ) -> dict[str, Any]:
     """
     Write a final object suitable for loading the database.
     """
     output = {
-        "customer_device_id": fetch_customer_device_id(
-            connection, row.customer_name, row.device_name
+        "customer_device_id": references.customer_device_id(
+            row.customer_name, row.device_name
         ),
-        "service_id": fetch_service_id(connection, row.service_name),
+        "service_id": references.service_id(row.service_name),
         "start_date": str(row.start_date_datetime),
         "latitude": row.lat_real,
         "longitude": row.lon_real,
@@ -306,32 +405,222 @@ OUTPUT_FIELDNAMES = [
     "longitude",
 ]
 
+# Appended by ``geohash.add_geohash_column()``, so it's last for the import.
+GEOHASH_FIELDNAMES = OUTPUT_FIELDNAMES + ["geohash"]
 
-def activation_loader(
-    counts: Counter[str],
-    connection: db.Connection,
-    reader: csv.DictReader,
-    writer: csv.DictWriter,
-) -> None:
-    for row in reader:
+LOADER = "python_load_process"
+# How often a resumed load saves checkpoints, unless it's told.
+RESUME_CHECKPOINT_EVERY = 10_000
+
+
+def valid_rows(
+    counts: Counter[str], rows: Iterable[dict[str, str]]
+) -> Iterator[dict[str, str]]:
+    for row in rows:
         counts["raw"] += 1
-        any_field_bad = bad_data(counts, row)
-        if any_field_bad:
-            continue
-        any_reference_bad = bad_references(counts, connection, row)
-        if any_reference_bad:
-            continue
+        if not bad_data(counts, row):
+            yield row
+
+
+def valid_references(
+    counts: Counter[str],
+    references: References,
+    rows: Iterable[dict[str, str]],
+) -> Iterator[dict[str, str]]:
+    for row in rows:
+        if not bad_references(counts, references, row):
+            yield row
+
+
+def transformed(
+    counts: Counter[str],
+    geohash_precision: int | None,
+    rows: Iterable[dict[str, Any]],
+) -> Iterator[dict[str, Any]]:
+    for row in rows:
         # Uses dict[str, Any]
         try:
-            good_row = transform_data_dict(counts, row)
+            yield transform_data_dict(counts, row, geohash_precision)
         except ValueError as ex:
             print(ex)
             print(row)
             counts["invalid transform"] += 1
-            continue
-        final = persist_data_dict(counts, connection, good_row)
+
+
+def persisted(
+    counts: Counter[str],
+    references: References,
+    timestamps_mode: str,
+    rows: Iterable[dict[str, Any]],
+) -> Iterator[dict[str, Any]]:
+    for row in rows:
+        yield persist_data_dict(
+            counts, references, row, timestamps_mode
+        )
+
+
+def written(
+    writer: csv.DictWriter, rows: Iterable[dict[str, Any]]
+) -> Iterator[dict[str, Any]]:
+    for final in rows:
         print(final)
         writer.writerow(final)
+        yield final
+
+
+def loader_stages(
+    counts: Counter[str],
+    references: References,
+    timestamps_mode: str = "raw",
+    geohash_precision: int | None = None,
+) -> list[pipeline.Stage]:
+    """Everything but the output."""
+    return [
+        pipeline.Stage("validate", partial(valid_rows, counts)),
+        pipeline.Stage(
+            "references", partial(valid_references, counts, references)
+        ),
+        pipeline.Stage(
+            "transform", partial(transformed, counts, geohash_precision)
+        ),
+        pipeline.Stage(
+            "persist",
+            partial(persisted, counts, references, timestamps_mode),
+        ),
+    ]
+
+
+def activation_loader(
+    counts: Counter[str],
+    connection: db.Connection,
+    reader: Iterable[dict[str, str]],
+    writer: csv.DictWriter,
+    timestamps_mode: str = "raw",
+    geohash_precision: int | None = None,
+    stats: list[pipeline.StageStats] | None = None,
+    checkpoint_stage: pipeline.Stage | None = None,
+) -> list[pipeline.StageStats]:
+    """
+    The validation, lookups, transformation, and output, as stages.
+    Returns their stats; pass them back in to add up several sources.
+    A ``checkpoint_stage`` follows the output.
+    The lookups are cached for this loader only.
+    """
+    references = References(connection)
+    loader = pipeline.Pipeline(
+        *loader_stages(
+            counts, references, timestamps_mode, geohash_precision
+        ),
+        pipeline.Stage("write", partial(written, writer)),
+        *([checkpoint_stage] if checkpoint_stage else []),
+        stats=stats,
+    )
+    try:
+        return loader.drain(reader)
+    finally:
+        print(references.report())
+        references.close()
+
+
+WorkerResult = tuple[
+    Counter[str], list[pipeline.StageStats], References
+]
+
+
+def activation_worker(
+    connect: Callable[[], db.Connection],
+    timestamps_mode: str,
+    geohash_precision: int | None,
+    results: list[WorkerResult],
+    batches: Iterable[list[dict[str, str]]],
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    The stages before the output, for one worker thread.
+    A worker has its own connection, lookup caches, counts, and stats;
+    an SQLite connection can't be shared by threads, and a shared cache
+    would be a bottleneck. The caches are cleared with the connection.
+    """
+    references = References(connect())
+    counts = Counter()
+    stages = loader_stages(
+        counts, references, timestamps_mode, geohash_precision
+    )
+    stats = [pipeline.StageStats(stage.name) for stage in stages]
+    try:
+        for batch in batches:
+            work = pipeline.Pipeline(*stages, stats=stats)
+            yield list(work.run(batch))
+    finally:
+        references.close()
+        references.connection.close()
+        results.append((counts, stats, references))
+
+
+def threaded_activation_loader(
+    counts: Counter[str],
+    connection: db.Connection,
+    reader: Iterable[dict[str, str]],
+    writer: csv.DictWriter,
+    timestamps_mode: str = "raw",
+    geohash_precision: int | None = None,
+    stats: list[pipeline.StageStats] | None = None,
+    connect: Callable[[], db.Connection] | None = None,
+    workers: int = 4,
+    ordered: bool = True,
+    batch_size: int = 100,
+) -> list[pipeline.StageStats]:
+    """
+    Like :py:func:`activation_loader`, with a reader thread,
+    ``workers`` threads to validate, look up, and transform,
+    and this thread to write, connected by bounded queues.
+    Unless ``ordered``, rows are written as their batch is finished.
+
+    Each worker opens its own connection with ``connect()``.
+    The stats of the worker stages, and of their lookups, are added
+    up, so their time is the total for all the workers.
+    """
+    if connect is None:
+        raise ValueError("each worker needs connect() for a connection")
+    results: list[WorkerResult] = []
+    work = partial(
+        activation_worker,
+        connect,
+        timestamps_mode,
+        geohash_precision,
+        results,
+    )
+    lookups = References(connection)
+    totals = stats or [
+        pipeline.StageStats(stage.name)
+        for stage in loader_stages(counts, lookups)
+    ] + [pipeline.StageStats("write")]
+    batches = pipeline.parallel(
+        work, reader, workers, ordered, batch_size
+    )
+    writing = pipeline.Pipeline(
+        pipeline.Stage("write", partial(written, writer)),
+        stats=totals[-1:],
+    )
+    writing.drain(chain.from_iterable(batches))
+    for worker_counts, worker_stats, worker_references in results:
+        counts.update(worker_counts)
+        for total, worker_stage in zip(totals, worker_stats):
+            total.add(worker_stage)
+        lookups.add_stats(worker_references)
+        instrumentation.merge(connection, worker_references.connection)
+    print(lookups.report())
+    return totals
+
+
+def report_counts(counts: Counter[str]) -> None:
+    print(f"Source had {counts['raw']} rows")
+    print(f"Invalid {counts['invalid']} rows")
+    print(f"Valid {counts['valid']} rows")
+    print(f"Invalid references {counts['invalid references']} rows")
+    print(f"valid references {counts['valid references']} rows")
+    print(f"Invalid transformations {counts['invalid transform']} rows")
+    print(f"valid transformations {counts['transform']} rows")
+    print(f"Saved {counts['saved']} rows")
 
 
 def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
@@ -348,36 +637,187 @@ def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
     )
     parser.add_argument(
         "source",
-        nargs=1,
+        nargs="*",
         type=Path,
-        default=Path("data/activation_source.csv"),
+        default=[Path("data/activation_source.csv")],
     )
+    timestamps.add_timestamps_option(parser)
+    parser.add_argument(
+        "--geohash",
+        action="store",
+        type=int,
+        default=None,
+        metavar="PRECISION",
+        help="add a geohash column; see geohash.py add",
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=0,
+        help="threads to validate and transform (default: none)",
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        action="store",
+        type=int,
+        default=0,
+        metavar="ROWS",
+        help=(
+            "commit a checkpoint every N output rows "
+            f"(default: never; {RESUME_CHECKPOINT_EVERY} with --resume)"
+        ),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="continue from the last checkpoint",
+    )
+    parser.add_argument(
+        "--unordered",
+        action="store_true",
+        default=False,
+        help="with --workers, write rows as they're finished",
+    )
+    connection_factory.add_profile_option(parser, "read-extract")
+    instrumentation.add_instrument_options(parser)
     return parser.parse_args(argv)
 
 
 def main(
-    database_connect: str, target: Path, sources: list[Path]
+    database_connect: str,
+    target: Path,
+    sources: list[Path],
+    profile: str = "read-extract",
+    timestamps_mode: str = "raw",
+    geohash_precision: int | None = None,
+    instrument: instrumentation.Settings | None = None,
+    workers: int = 0,
+    ordered: bool = True,
+    checkpoint_every: int = 0,
+    resume: bool = False,
 ) -> None:
-    connection = db.connect(database_connect)
+    """
+    With ``checkpoint_every``, and without ``workers``, the progress
+    through each source is saved every ``checkpoint_every`` output
+    rows, in a control database beside the ``target``. It's removed
+    when the whole load is complete.
+    With ``resume``, the target is cut back to the last checkpoint,
+    and each source continues from there.
+    """
+    if resume and workers:
+        raise ValueError("resume needs checkpoints, without workers")
+    if resume and not checkpoint_every:
+        checkpoint_every = RESUME_CHECKPOINT_EVERY
+    connection = connection_factory.connect(
+        database_connect, profile, instrument=instrument
+    )
+    if workers:
+        loader = partial(
+            threaded_activation_loader,
+            connect=partial(
+                connection_factory.connect,
+                database_connect,
+                profile,
+                instrument=instrument,
+            ),
+            workers=workers,
+            ordered=ordered,
+        )
+    else:
+        loader = activation_loader
+    fieldnames = (
+        GEOHASH_FIELDNAMES if geohash_precision else OUTPUT_FIELDNAMES
+    )
     counts = Counter()
-    for source in sources:
-        with source.open() as source_file:
-            reader = csv.DictReader(source_file)
-            with target.open("w", newline="") as target_file:
-                writer = csv.DictWriter(target_file, OUTPUT_FIELDNAMES)
-                writer.writeheader()
-                activation_loader(counts, connection, reader, writer)
-
-    print(f"Source had {counts['raw']} rows")
-    print(f"Invalid {counts['invalid']} rows")
-    print(f"Valid {counts['valid']} rows")
-    print(f"Invalid references {counts['invalid references']} rows")
-    print(f"valid references {counts['valid references']} rows")
-    print(f"Invalid transformations {counts['invalid transform']} rows")
-    print(f"valid transformations {counts['transform']} rows")
-    print(f"Saved {counts['saved']} rows")
+    stats = None
+    control = None
+    states: dict[Path, checkpoint.Checkpoint] = {}
+    if checkpoint_every and not workers:
+        control = checkpoint.control_database(target)
+        states = {
+            source: checkpoint.start(control, LOADER, source, resume)
+            for source in sources
+        }
+    latest = max(
+        states.values(),
+        key=lambda state: (
+            state.target_offset or 0,
+            state.counts.get("raw", 0),
+        ),
+        default=None,
+    )
+    appending = False
+    if resume and latest and latest.target_offset:
+        # Rows written after the checkpoint will be written again.
+        os.truncate(target, latest.target_offset)
+        counts.update(latest.counts)
+        appending = True
+    with target.open(
+        "a" if appending else "w", newline=""
+    ) as target_file:
+        writer = csv.DictWriter(target_file, fieldnames)
+        if not appending:
+            writer.writeheader()
+        for source in sources:
+            state = states.get(source)
+            if state and state.loaded:
+                continue
+            with source.open("rb") as source_file:
+                reader = checkpoint.OffsetReader(source_file, state)
+                load = loader
+                if state and control:
+                    load = partial(
+                        loader,
+                        checkpoint_stage=pipeline.Stage(
+                            "checkpoint",
+                            partial(
+                                checkpoint.checkpointed,
+                                control,
+                                state,
+                                reader,
+                                target_file,
+                                counts,
+                                checkpoint_every,
+                            ),
+                        ),
+                    )
+                stats = load(
+                    counts,
+                    connection,
+                    reader,
+                    writer,
+                    timestamps_mode,
+                    geohash_precision,
+                    stats,
+                )
+            if state and control:
+                state.loaded = True
+                checkpoint.advance_output(
+                    control, state, reader, target_file, counts
+                )
+    if control:
+        control.close()
+        checkpoint.remove_control_database(target)
+
+    report_counts(counts)
+    print(pipeline.report(stats or []))
+    instrumentation.write_report(connection)
 
 
 if __name__ == "__main__":
     options = get_options()
-    main(options.db, options.output, options.source)
+    main(
+        options.db,
+        options.output,
+        options.source,
+        options.profile,
+        options.timestamps,
+        options.geohash,
+        instrumentation.settings_from(options),
+        options.workers,
+        not options.unordered,
+        options.checkpoint_every,
+        options.resume,
+    )
@@ -0,0 +1,110 @@
+"""
+Named extracts, streamed to a sink.
+
+An extract is a registered SQL query. :py:func:`run` executes it and
+fetches the rows in batches with ``fetchmany()``, as plain tuples;
+no :py:class:`sqlite3.Row` or dict is built for each row.
+
+A sink is a callable given the column names once, then an iterable
+of tuples. :py:func:`csv_sink` and :py:func:`jsonl_sink` write to
+an open file; :py:func:`print_sink` prints a dict for each row.
+
+..  code-block:: python
+
+    with Path("data/query_1.csv").open("w", newline="") as target:
+        stats = query_runner.run(connection, "query_1", csv_sink(target))
+    print(stats)
+
+"""
+
+from collections.abc import Callable, Iterable, Mapping, Sequence
+import csv
+from itertools import chain
+import json
+import sqlite3 as db
+from textwrap import dedent
+from typing import Any, TextIO
+
+from metrics import RunStats
+from result_cache import ResultCache
+
+
+Sink = Callable[[list[str], Iterable[tuple]], None]
+
+DEFAULT_BATCH_SIZE = 1000
+
+EXTRACTS: dict[str, str] = {}
+
+
+def register(name: str, sql: str) -> str:
+    """Register the SQL of an extract, and return it."""
+    sql = dedent(sql)
+    if EXTRACTS.get(name, sql) != sql:
+        raise ValueError(f"extract {name!r} is already registered")
+    EXTRACTS[name] = sql
+    return sql
+
+
+def print_sink(columns: list[str], rows: Iterable[tuple]) -> None:
+    for row in rows:
+        print(dict(zip(columns, row)))
+
+
+def csv_sink(target: TextIO) -> Sink:
+    """A header row, then the rows."""
+
+    def write(columns: list[str], rows: Iterable[tuple]) -> None:
+        writer = csv.writer(target)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+    return write
+
+
+def jsonl_sink(target: TextIO) -> Sink:
+    """A JSON object on each line; values JSON can't encode are text."""
+
+    def write(columns: list[str], rows: Iterable[tuple]) -> None:
+        for row in rows:
+            target.write(
+                json.dumps(dict(zip(columns, row)), default=str)
+            )
+            target.write("\n")
+
+    return write
+
+
+FORMATS: dict[str, Callable[[TextIO], Sink]] = {
+    "csv": csv_sink,
+    "jsonl": jsonl_sink,
+}
+
+
+def run(
+    connection: db.Connection,
+    name: str,
+    sink: Sink,
+    params: Sequence[Any] | Mapping[str, Any] = (),
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    cache: ResultCache | None = None,
+) -> RunStats:
+    """
+    Stream the rows of the extract ``name`` to the ``sink``.
+    With a ``cache``, the rows come from the cache, in one batch.
+    """
+    sql = EXTRACTS[name]
+    stats = RunStats(name)
+    cursor = None
+    if cache is not None:
+        columns, rows = cache.fetch(sql, params)
+        batches: Iterable[Sequence[tuple]] = [rows]
+    else:
+        cursor = connection.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        columns = [column for column, *_ in cursor.description or []]
+        batches = iter(lambda: cursor.fetchmany(batch_size), [])
+    sink(columns, chain.from_iterable(stats.measure(batches)))
+    if cursor:
+        cursor.close()
+    return stats
@@ -0,0 +1,231 @@
+"""
+Query result cache for the extracts.
+
+A result is cached under its normalized SQL text, its parameters,
+and a version of the database. Any commit changes the version,
+so a cached result is never stale; it's simply not found.
+
+-   In memory, the version is ``PRAGMA data_version`` (changed by
+    other connections' commits) with ``total_changes`` (changed by this
+    connection's own). The results are in a :py:class:`LookupCache`.
+
+-   In an optional SQLite cache file, shared by processes,
+    the version is the database header's file change counter with the
+    size and modification time of the database and its WAL file.
+    (In WAL mode, the header isn't updated until a checkpoint.)
+    The file version must be taken *before* a read transaction starts:
+    use :py:meth:`ResultCache.snapshot`. Inside any other transaction,
+    the cache file isn't used.
+
+Results are column names with a list of tuples, or a list of dicts,
+and must be treated as read-only.
+Values must be JSON-compatible to be saved in a cache file.
+
+..  code-block:: python
+
+    cache = ResultCache(connection, path=Path("data/result_cache.db"))
+    with cache.snapshot():
+        rows = cache.fetchall("SELECT * FROM service")
+
+"""
+
+from collections.abc import Iterator, Mapping, Sequence
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3 as db
+from textwrap import dedent
+from typing import Any
+
+import connection_factory
+from lookup_cache import CacheStats, LookupCache
+
+
+Rows = list[dict[str, Any]]
+
+Result = tuple[list[str], list[tuple]]
+
+# ``("named", ((name, value), ...))`` or ``("positional", (value, ...))``
+Frozen = tuple[str, tuple[Any, ...]]
+
+# SQL, parameters, and the connection's version.
+Key = tuple[str, Frozen, tuple[int, int]]
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace, so indentation doesn't change the key."""
+    return " ".join(sql.split())
+
+
+def freeze(params: Sequence[Any] | Mapping[str, Any]) -> Frozen:
+    """Hashable parameters, distinguishing named from positional."""
+    if isinstance(params, Mapping):
+        return ("named", tuple(sorted(params.items())))
+    return ("positional", tuple(params))
+
+
+def thaw(frozen: Frozen) -> Sequence[Any] | Mapping[str, Any]:
+    kind, values = frozen
+    return dict(values) if kind == "named" else values
+
+
+def file_version(path: Path) -> str:
+    """A version of the database file that any process can compute."""
+    with path.open("rb") as database_file:
+        database_file.seek(24)
+        counter = int.from_bytes(database_file.read(4), "big")
+    parts = [counter]
+    for file in (path, path.with_name(f"{path.name}-wal")):
+        if file.exists():
+            status = os.stat(file)
+            parts.extend([status.st_mtime_ns, status.st_size])
+    return ":".join(map(str, parts))
+
+
+class ResultCache:
+    """
+    Cached ``fetchall()`` results for one connection.
+    The ``path`` names an optional cache file.
+    """
+
+    def __init__(
+        self,
+        connection: db.Connection,
+        maxsize: int = 128,
+        path: Path | None = None,
+    ) -> None:
+        self.connection = connection
+        self.memory = LookupCache(self.load, maxsize)
+        self.database_path: Path | None = None
+        self.disk: db.Connection | None = None
+        self.pinned: str | None = None
+        if path:
+            self.database_path = self.main_file()
+            self.disk = connection_factory.connect(path, "bulk-load")
+            self.disk.execute(
+                dedent("""
+                    CREATE TABLE IF NOT EXISTS result(
+                        key TEXT PRIMARY KEY,
+                        version TEXT NOT NULL,
+                        columns TEXT NOT NULL,
+                        rows TEXT NOT NULL
+                    )
+                """)
+            )
+            self.disk.commit()
+
+    @property
+    def stats(self) -> CacheStats:
+        return self.memory.stats
+
+    def main_file(self) -> Path:
+        cursor = self.connection.cursor()
+        cursor.execute("PRAGMA database_list")
+        files = {name: file for _, name, file in cursor.fetchall()}
+        cursor.close()
+        if not files.get("main"):
+            raise ValueError("a cache file needs a database file")
+        return Path(files["main"])
+
+    def version(self) -> tuple[int, int]:
+        cursor = self.connection.cursor()
+        cursor.execute("PRAGMA data_version")
+        (data_version,) = cursor.fetchone()
+        cursor.close()
+        return data_version, self.connection.total_changes
+
+    @contextmanager
+    def snapshot(self) -> Iterator[db.Connection]:
+        """
+        A read snapshot, with the file version taken just before it.
+        If a commit slips in between, the snapshot is newer than the
+        version; that version is gone, so no one else will look for it.
+        """
+        if self.database_path is not None:
+            self.pinned = file_version(self.database_path)
+        try:
+            with connection_factory.read_snapshot(self.connection):
+                yield self.connection
+        finally:
+            self.pinned = None
+
+    def fetch(
+        self,
+        sql: str,
+        params: Sequence[Any] | Mapping[str, Any] = (),
+    ) -> Result:
+        """The column names and the rows, as tuples."""
+        key = (normalize_sql(sql), freeze(params), self.version())
+        return self.memory[key]
+
+    def fetchall(
+        self,
+        sql: str,
+        params: Sequence[Any] | Mapping[str, Any] = (),
+    ) -> Rows:
+        columns, rows = self.fetch(sql, params)
+        return [dict(zip(columns, row)) for row in rows]
+
+    def load(self, key: Key) -> Result:
+        """On a memory miss, try the cache file, then the database."""
+        sql, frozen, _ = key
+        if self.disk is None or self.database_path is None:
+            return self.query(sql, thaw(frozen))
+        if self.pinned:
+            version = self.pinned
+        elif not self.connection.in_transaction:
+            version = file_version(self.database_path)
+        else:
+            # Can't tell which file version this transaction sees.
+            return self.query(sql, thaw(frozen))
+        disk_key = hashlib.sha256(
+            json.dumps([sql, frozen]).encode("utf-8")
+        ).hexdigest()
+        cursor = self.disk.cursor()
+        cursor.execute(
+            "SELECT columns, rows FROM result "
+            "WHERE key = :key AND version = :version",
+            {"key": disk_key, "version": version},
+        )
+        saved = cursor.fetchone()
+        if saved:
+            columns, rows = map(json.loads, saved)
+            cursor.close()
+            return columns, list(map(tuple, rows))
+        columns, rows = self.query(sql, thaw(frozen))
+        # Results of any older version can't be used again.
+        cursor.execute(
+            "DELETE FROM result WHERE version != :version",
+            {"version": version},
+        )
+        cursor.execute(
+            "INSERT OR REPLACE INTO result(key, version, columns, rows) "
+            "VALUES(:key, :version, :columns, :rows)",
+            {
+                "key": disk_key,
+                "version": version,
+                "columns": json.dumps(columns),
+                "rows": json.dumps(rows),
+            },
+        )
+        self.disk.commit()
+        cursor.close()
+        return columns, rows
+
+    def query(
+        self, sql: str, params: Sequence[Any] | Mapping[str, Any]
+    ) -> Result:
+        cursor = self.connection.cursor()
+        cursor.row_factory = None
+        cursor.execute(sql, params)
+        columns = [name for name, *_ in cursor.description or []]
+        rows = cursor.fetchall()
+        cursor.close()
+        return columns, rows
+
+    def close(self) -> None:
+        if self.disk:
+            self.disk.close()
+        self.memory.clear()
@@ -0,0 +1,292 @@
+"""
+Time-bucketed rollups of activations.
+
+The ``activation_rollup`` table has one row for each service, period,
+and bucket, with the count of activations and the bounding box
+of their locations.
+The periods are ``day``, ``week`` (starting Monday), and ``month``.
+Each bucket is named by the ISO date (in UTC) of its first day.
+Any :py:mod:`timestamps` storage mode of ``start`` works.
+
+The ``rollup_state`` table has a high-water mark: the last
+``customer_device_service`` rowid included in the rollups.
+A refresh only reads the rows added since then.
+The SQL loader refreshes the rollups after each load, if they exist;
+after a ``sqlite3 .import`` use the ``refresh`` command.
+
+Rows are only ever appended by the loaders.
+After an update or delete of ``customer_device_service`` rows,
+use the ``rebuild`` command.
+
+..  code-block:: bash
+
+    python src/rollups.py create
+    python src/rollups.py extract --period week --from 2001-01-01 --to 2001-12-31
+
+"""
+
+import argparse
+import csv
+from pathlib import Path
+import sqlite3 as db
+import sys
+from textwrap import dedent
+
+import connection_factory
+import timestamps
+
+
+PERIODS = {
+    "day": "date({start})",
+    "week": "date({start}, '-6 days', 'weekday 1')",
+    "month": "strftime('%Y-%m-01', {start})",
+}
+
+
+def make_rollups(connection: db.Connection) -> None:
+    """Create the tables, then roll up the existing rows."""
+    create_rollup_table = dedent("""
+        CREATE TABLE IF NOT EXISTS activation_rollup(
+            service_id INTEGER NOT NULL,
+            period TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            min_lat REAL,
+            max_lat REAL,
+            min_lon REAL,
+            max_lon REAL,
+            PRIMARY KEY(service_id, period, bucket)
+        ) WITHOUT ROWID
+        """)
+    create_bucket_index = dedent("""
+        CREATE INDEX IF NOT EXISTS activation_rollup_bucket_ix
+            ON activation_rollup(period, bucket)
+        """)
+    create_state_table = dedent("""
+        CREATE TABLE IF NOT EXISTS rollup_state(
+            table_name TEXT PRIMARY KEY,
+            high_water INTEGER NOT NULL
+        )
+        """)
+    cursor = connection.cursor()
+    for ddl in (
+        create_rollup_table,
+        create_bucket_index,
+        create_state_table,
+    ):
+        cursor.execute(ddl)
+    connection.commit()
+    cursor.close()
+    refresh_rollups(connection)
+
+
+def has_rollups(connection: db.Connection) -> bool:
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT count(*) FROM sqlite_schema
+            WHERE type = 'table' AND name = 'rollup_state'
+        """)
+    )
+    (exists,) = cursor.fetchone()
+    cursor.close()
+    return bool(exists)
+
+
+def refresh_rollups(
+    connection: db.Connection, rebuild: bool = False
+) -> int:
+    """
+    Fold the rows added since the high-water mark into the rollups.
+    With ``rebuild``, discard the rollups and the mark first,
+    and roll up every row.
+    The rollups and the mark change in one transaction,
+    retried if the database is busy.
+    Returns the number of rows rolled up.
+    """
+    high_water_mark = dedent("""
+        SELECT coalesce(
+            (SELECT high_water FROM rollup_state
+             WHERE table_name = 'customer_device_service'),
+            0
+        ), (SELECT coalesce(max(rowid), 0) FROM customer_device_service)
+        """)
+    rollup_template = dedent("""
+        INSERT INTO activation_rollup(
+            service_id, period, bucket, count,
+            min_lat, max_lat, min_lon, max_lon
+        )
+            SELECT service_id, :period, {bucket} AS bucket, count(*),
+                min(latitude), max(latitude), min(longitude), max(longitude)
+            FROM customer_device_service
+            WHERE rowid > :low AND rowid <= :high
+            AND {bucket} IS NOT NULL
+            GROUP BY service_id, bucket
+        ON CONFLICT(service_id, period, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            min_lat = min(min_lat, excluded.min_lat),
+            max_lat = max(max_lat, excluded.max_lat),
+            min_lon = min(min_lon, excluded.min_lon),
+            max_lon = max(max_lon, excluded.max_lon)
+        """)
+    count_new_rows = dedent("""
+        SELECT count(*)
+        FROM customer_device_service
+        WHERE rowid > :low AND rowid <= :high
+        """)
+    update_high_water = dedent("""
+        INSERT INTO rollup_state(table_name, high_water)
+            VALUES('customer_device_service', :high)
+        ON CONFLICT(table_name) DO UPDATE SET
+            high_water = excluded.high_water
+        """)
+    cursor = connection.cursor()
+
+    def refresh() -> int:
+        if rebuild:
+            cursor.execute("DELETE FROM activation_rollup")
+            cursor.execute("DELETE FROM rollup_state")
+        cursor.execute(high_water_mark)
+        low, high = cursor.fetchone()
+        cursor.execute(count_new_rows, {"low": low, "high": high})
+        (count,) = cursor.fetchone()
+        for period, bucket in PERIODS.items():
+            cursor.execute(
+                rollup_template.format(
+                    bucket=bucket.format(
+                        start=timestamps.text_sql("start")
+                    )
+                ),
+                {"period": period, "low": low, "high": high},
+            )
+        cursor.execute(update_high_water, {"high": high})
+        connection.commit()
+        return count
+
+    rows = connection_factory.retry_busy(connection, refresh)
+    print(f"rolled up {rows} new rows")
+    cursor.close()
+    return rows
+
+
+def rollup_range(
+    connection: db.Connection,
+    period: str,
+    start: str,
+    end: str,
+    service_name: str | None = None,
+) -> list[tuple]:
+    """
+    The buckets of a period from ``start`` to ``end``, inclusive,
+    optionally for a single service.
+    Buckets are named by their first day, so a ``start`` in the middle
+    of a week or month excludes that week or month.
+    """
+    query = dedent("""
+        SELECT service.service_name, bucket, count,
+            min_lat, max_lat, min_lon, max_lon
+        FROM activation_rollup
+        JOIN service
+            ON service.rowid = activation_rollup.service_id
+        WHERE period = :period
+        AND bucket BETWEEN :start AND :end
+        AND (:service_name IS NULL OR service.service_name = :service_name)
+        ORDER BY bucket, service.service_name
+        """)
+    cursor = connection.cursor()
+    cursor.execute(
+        query,
+        {
+            "period": period,
+            "start": start,
+            "end": end,
+            "service_name": service_name,
+        },
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "command", choices=["create", "refresh", "rebuild", "extract"]
+    )
+    parser.add_argument(
+        "--period", action="store", choices=list(PERIODS), default="day"
+    )
+    parser.add_argument(
+        "--from", dest="start", action="store", default="0000-01-01"
+    )
+    parser.add_argument(
+        "--to", dest="end", action="store", default="9999-12-31"
+    )
+    parser.add_argument("--service", action="store", default=None)
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data/activation_rollup.csv"),
+    )
+    connection_factory.add_profile_option(parser, "default")
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect: str,
+    command: str,
+    target: Path,
+    period: str = "day",
+    start: str = "0000-01-01",
+    end: str = "9999-12-31",
+    service_name: str | None = None,
+    profile: str = "default",
+) -> None:
+    OUTPUT_FIELDNAMES = [
+        "service_name",
+        "bucket",
+        "count",
+        "min_lat",
+        "max_lat",
+        "min_lon",
+        "max_lon",
+    ]
+
+    connection = connection_factory.connect(database_connect, profile)
+    match command:
+        case "create":
+            make_rollups(connection)
+        case "refresh":
+            refresh_rollups(connection)
+        case "rebuild":
+            refresh_rollups(connection, rebuild=True)
+        case "extract":
+            with connection_factory.read_snapshot(connection):
+                rows = rollup_range(
+                    connection, period, start, end, service_name
+                )
+            with target.open("w", newline="") as target_file:
+                writer = csv.writer(target_file)
+                writer.writerow(OUTPUT_FIELDNAMES)
+                writer.writerows(rows)
+            print(f"wrote {len(rows)} {period} buckets")
+    connection.close()
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(
+        options.db,
+        options.command,
+        options.output,
+        period=options.period,
+        start=options.start,
+        end=options.end,
+        service_name=options.service,
+        profile=options.profile,
+    )
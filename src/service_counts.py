@@ -0,0 +1,226 @@
+"""
+Materialized service activation counts.
+
+The ``service_activation_count`` table has one row per service
+with the number of ``customer_device_service`` rows that refer to it.
+Triggers maintain it, so every loader keeps it current:
+the SQL ``persist()``, and the ``sqlite3 .import``
+of the Python loader's output.
+The count changes in the same transaction as the rows it counts.
+
+An extract reads one row per service instead of scanning the fact table.
+
+..  code-block:: bash
+
+    python src/service_counts.py create
+    python src/service_counts.py extract -o data/service_name_counts.csv
+    python src/service_counts.py verify
+
+"""
+
+import argparse
+from collections import Counter
+import csv
+from pathlib import Path
+import sqlite3 as db
+import sys
+from textwrap import dedent
+
+import connection_factory
+
+
+def make_service_counts(connection: db.Connection) -> None:
+    """Create the table and its triggers, then populate it."""
+    create_table = dedent("""
+        CREATE TABLE IF NOT EXISTS service_activation_count(
+            service_id INTEGER PRIMARY KEY,
+            activations INTEGER NOT NULL
+        )
+        """)
+    create_insert_trigger = dedent("""
+        CREATE TRIGGER IF NOT EXISTS service_activation_count_insert
+            AFTER INSERT ON customer_device_service
+        BEGIN
+            INSERT INTO service_activation_count(service_id, activations)
+                VALUES(NEW.service_id, 1)
+                ON CONFLICT(service_id)
+                DO UPDATE SET activations = activations + 1;
+        END
+        """)
+    create_delete_trigger = dedent("""
+        CREATE TRIGGER IF NOT EXISTS service_activation_count_delete
+            AFTER DELETE ON customer_device_service
+        BEGIN
+            UPDATE service_activation_count
+                SET activations = activations - 1
+                WHERE service_id = OLD.service_id;
+        END
+        """)
+    create_update_trigger = dedent("""
+        CREATE TRIGGER IF NOT EXISTS service_activation_count_update
+            AFTER UPDATE OF service_id ON customer_device_service
+        BEGIN
+            UPDATE service_activation_count
+                SET activations = activations - 1
+                WHERE service_id = OLD.service_id;
+            INSERT INTO service_activation_count(service_id, activations)
+                VALUES(NEW.service_id, 1)
+                ON CONFLICT(service_id)
+                DO UPDATE SET activations = activations + 1;
+        END
+        """)
+    cursor = connection.cursor()
+    for ddl in (
+        create_table,
+        create_insert_trigger,
+        create_delete_trigger,
+        create_update_trigger,
+    ):
+        cursor.execute(ddl)
+    cursor.close()
+    rebuild(connection)
+
+
+def is_materialized(connection: db.Connection) -> bool:
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT count(*) FROM sqlite_schema
+            WHERE type = 'table' AND name = 'service_activation_count'
+        """)
+    )
+    (exists,) = cursor.fetchone()
+    cursor.close()
+    return bool(exists)
+
+
+def rebuild(connection: db.Connection) -> None:
+    """Recompute every count from the fact table."""
+    clear_counts = dedent("""
+        DELETE FROM service_activation_count
+        """)
+    compute_counts = dedent("""
+        INSERT INTO service_activation_count(service_id, activations)
+            SELECT service_id, count(*)
+            FROM customer_device_service
+            GROUP BY service_id
+        """)
+    cursor = connection.cursor()
+    cursor.execute(clear_counts)
+    cursor.execute(compute_counts)
+    print(f"rebuilt {cursor.rowcount} service counts")
+    connection.commit()
+    cursor.close()
+
+
+def verify(connection: db.Connection) -> dict[int, tuple[int, int]]:
+    """
+    Compare the materialized counts with a full scan.
+    Returns ``{service_id: (materialized, actual)}`` for each difference.
+    """
+    actual_counts = dedent("""
+        SELECT service_id, count(*)
+        FROM customer_device_service
+        GROUP BY service_id
+        """)
+    materialized_counts = dedent("""
+        SELECT service_id, activations
+        FROM service_activation_count
+        WHERE activations != 0
+        """)
+    cursor = connection.cursor()
+    cursor.execute(actual_counts)
+    actual = dict(cursor.fetchall())
+    cursor.execute(materialized_counts)
+    materialized = dict(cursor.fetchall())
+    cursor.close()
+    return {
+        service_id: (
+            materialized.get(service_id, 0),
+            actual.get(service_id, 0),
+        )
+        for service_id in materialized.keys() | actual.keys()
+        if materialized.get(service_id) != actual.get(service_id)
+    }
+
+
+def service_name_counts(connection: db.Connection) -> Counter[str]:
+    """The extract: one row per service, not one per activation."""
+    query = dedent("""
+        SELECT service.service_name, sum(activations)
+        FROM service_activation_count
+        JOIN service
+            ON service.rowid = service_activation_count.service_id
+        GROUP BY service.service_name
+        HAVING sum(activations) > 0
+        """)
+    cursor = connection.cursor()
+    cursor.execute(query)
+    counter = Counter(dict(cursor.fetchall()))
+    cursor.close()
+    return counter
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "command", choices=["create", "rebuild", "extract", "verify"]
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data/service_name_counts.csv"),
+    )
+    connection_factory.add_profile_option(parser, "default")
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect: str,
+    command: str,
+    target: Path,
+    profile: str = "default",
+) -> int:
+    OUTPUT_FIELDNAMES = ["service_name", "count"]
+
+    connection = connection_factory.connect(database_connect, profile)
+    match command:
+        case "create":
+            make_service_counts(connection)
+        case "rebuild":
+            rebuild(connection)
+        case "extract":
+            with connection_factory.read_snapshot(connection):
+                counts = service_name_counts(connection)
+            with target.open("w", newline="") as target_file:
+                writer = csv.DictWriter(target_file, OUTPUT_FIELDNAMES)
+                writer.writeheader()
+                rows = (
+                    {"service_name": key, "count": value}
+                    for key, value in counts.items()
+                )
+                writer.writerows(rows)
+        case "verify":
+            with connection_factory.read_snapshot(connection):
+                differences = verify(connection)
+            for service_id, (materialized, actual) in sorted(
+                differences.items()
+            ):
+                print(f"{service_id=} {materialized=} {actual=}")
+            print(f"{len(differences)} differences")
+            return 1 if differences else 0
+    return 0
+
+
+if __name__ == "__main__":
+    options = get_options()
+    sys.exit(
+        main(
+            options.db, options.command, options.output, options.profile
+        )
+    )
@@ -0,0 +1,336 @@
+"""
+R*Tree spatial index of activation locations.
+
+The ``activation_location`` virtual table is an R*Tree with one
+point-sized box for each ``customer_device_service`` row,
+keyed by its rowid.
+Triggers keep it in sync, so every loader maintains it:
+the SQL ``persist()``, and the ``sqlite3 .import`` of the Python
+loader's output.
+
+An R*Tree stores 32-bit floats, rounded outward, so it finds
+a slightly larger set of candidates. The exact ``latitude`` and
+``longitude`` of each candidate are checked, too.
+
+Boxes don't cross the antimeridian: ``west <= east``.
+A radius search that crosses it uses two boxes.
+
+..  code-block:: bash
+
+    python src/spatial_index.py create
+    python src/spatial_index.py box --south 0 --west -1 --north 1 --east 0
+    python src/spatial_index.py radius --lat 0.5 --lon -0.5 --km 25 -o data/near.csv
+
+"""
+
+import argparse
+import csv
+import math
+from pathlib import Path
+import sqlite3 as db
+import sys
+from textwrap import dedent
+
+import connection_factory
+
+
+KM_PER_DEGREE = connection_factory.EARTH_RADIUS_KM * math.pi / 180
+
+# Named, so a column added later, like geohash, doesn't shift the CSV.
+ROW_COLUMNS = [
+    "customer_device_id",
+    "service_id",
+    "start",
+    "latitude",
+    "longitude",
+]
+
+BOX_CONDITION = dedent("""
+    customer_device_service.latitude BETWEEN :south AND :north
+    AND customer_device_service.longitude BETWEEN :west AND :east
+    """)
+
+INDEXED_SOURCE = dedent("""
+    activation_location
+    JOIN customer_device_service
+        ON customer_device_service.rowid = activation_location.id
+    WHERE activation_location.max_lat >= :south
+    AND activation_location.min_lat <= :north
+    AND activation_location.max_lon >= :west
+    AND activation_location.min_lon <= :east
+    AND {condition}
+    """)
+
+SCAN_SOURCE = dedent("""
+    customer_device_service
+    WHERE {condition}
+    """)
+
+RADIUS_CONDITION = dedent("""
+    haversine_km(
+        customer_device_service.latitude,
+        customer_device_service.longitude,
+        :lat, :lon
+    ) <= :km
+    """)
+
+
+def make_spatial_index(connection: db.Connection) -> None:
+    """Create the R*Tree and its triggers, then index the existing rows."""
+    create_rtree = dedent("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS activation_location
+            USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+        """)
+    create_insert_trigger = dedent("""
+        CREATE TRIGGER IF NOT EXISTS activation_location_insert
+            AFTER INSERT ON customer_device_service
+            WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT INTO activation_location
+                VALUES(
+                    NEW.rowid,
+                    NEW.latitude, NEW.latitude,
+                    NEW.longitude, NEW.longitude
+                );
+        END
+        """)
+    create_delete_trigger = dedent("""
+        CREATE TRIGGER IF NOT EXISTS activation_location_delete
+            AFTER DELETE ON customer_device_service
+        BEGIN
+            DELETE FROM activation_location WHERE id = OLD.rowid;
+        END
+        """)
+    create_update_trigger = dedent("""
+        CREATE TRIGGER IF NOT EXISTS activation_location_update
+            AFTER UPDATE OF latitude, longitude ON customer_device_service
+        BEGIN
+            DELETE FROM activation_location WHERE id = OLD.rowid;
+            INSERT INTO activation_location
+                SELECT NEW.rowid,
+                    NEW.latitude, NEW.latitude,
+                    NEW.longitude, NEW.longitude
+                WHERE NEW.latitude IS NOT NULL
+                AND NEW.longitude IS NOT NULL;
+        END
+        """)
+    index_existing_rows = dedent("""
+        INSERT OR REPLACE INTO activation_location
+            SELECT rowid, latitude, latitude, longitude, longitude
+            FROM customer_device_service
+            WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        """)
+    cursor = connection.cursor()
+    for ddl in (
+        create_rtree,
+        create_insert_trigger,
+        create_delete_trigger,
+        create_update_trigger,
+    ):
+        cursor.execute(ddl)
+    cursor.execute(index_existing_rows)
+    print(f"indexed {cursor.rowcount} locations")
+    connection.commit()
+    cursor.close()
+
+
+def has_spatial_index(connection: db.Connection) -> bool:
+    cursor = connection.cursor()
+    cursor.execute(
+        dedent("""
+            SELECT count(*) FROM sqlite_schema
+            WHERE type = 'table' AND name = 'activation_location'
+        """)
+    )
+    (exists,) = cursor.fetchone()
+    cursor.close()
+    return bool(exists)
+
+
+def radius_boxes(
+    lat: float, lon: float, km: float
+) -> list[dict[str, float]]:
+    """
+    Boxes around the circle, for the index.
+    Near a pole, one box covers every longitude.
+    A circle that crosses the antimeridian needs two boxes,
+    one on each side.
+    """
+    d_lat = km / KM_PER_DEGREE
+    south, north = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+    widest = max(abs(south), abs(north))
+    if widest >= 90.0:
+        spans = [(-180.0, 180.0)]
+    else:
+        d_lon = d_lat / math.cos(math.radians(widest))
+        west, east = lon - d_lon, lon + d_lon
+        if d_lon >= 180.0:
+            spans = [(-180.0, 180.0)]
+        elif west < -180.0:
+            spans = [(west + 360.0, 180.0), (-180.0, east)]
+        elif east > 180.0:
+            spans = [(west, 180.0), (-180.0, east - 360.0)]
+        else:
+            spans = [(west, east)]
+    return [
+        {"south": south, "west": west, "north": north, "east": east}
+        for west, east in spans
+    ]
+
+
+def query(
+    connection: db.Connection,
+    params: dict[str, float],
+    condition: str,
+    rows: bool = False,
+    indexed: bool = True,
+) -> list[tuple] | int:
+    """
+    The rows, or the count of rows, meeting the ``condition``
+    inside the box of ``params``.
+    """
+    source = INDEXED_SOURCE if indexed else SCAN_SOURCE
+    columns = (
+        ", ".join(
+            f"customer_device_service.{name}" for name in ROW_COLUMNS
+        )
+        if rows
+        else "count(*)"
+    )
+    cursor = connection.cursor()
+    cursor.execute(
+        f"SELECT {columns} FROM {source.format(condition=condition)}",
+        params,
+    )
+    result = cursor.fetchall()
+    cursor.close()
+    if rows:
+        return result
+    [(count,)] = result
+    return count
+
+
+def in_box(
+    connection: db.Connection,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    rows: bool = False,
+    indexed: bool = True,
+) -> list[tuple] | int:
+    params = {
+        "south": south,
+        "west": west,
+        "north": north,
+        "east": east,
+    }
+    return query(connection, params, BOX_CONDITION, rows, indexed)
+
+
+def in_radius(
+    connection: db.Connection,
+    lat: float,
+    lon: float,
+    km: float,
+    rows: bool = False,
+    indexed: bool = True,
+) -> list[tuple] | int:
+    """
+    The boxes around the circle are checked first; only the rows in them
+    need the ``haversine_km()`` function from ``connection_factory``.
+    The boxes don't overlap, so their results are simply combined.
+    """
+    condition = f"{BOX_CONDITION} AND {RADIUS_CONDITION}"
+    found: list[tuple] = []
+    count = 0
+    for box in radius_boxes(lat, lon, km):
+        params = box | {"lat": lat, "lon": lon, "km": km}
+        result = query(connection, params, condition, rows, indexed)
+        if isinstance(result, list):
+            found.extend(result)
+        else:
+            count += result
+    return found if rows else count
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=None,
+        help="write the rows here; otherwise print the count",
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        default=False,
+        help="don't use the spatial index",
+    )
+    connection_factory.add_profile_option(parser, "default")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="build the spatial index")
+    box = commands.add_parser("box", help="activations in a box")
+    for name in ("south", "west", "north", "east"):
+        box.add_argument(f"--{name}", type=float, required=True)
+    radius = commands.add_parser(
+        "radius", help="activations within a radius of a point"
+    )
+    radius.add_argument("--lat", type=float, required=True)
+    radius.add_argument("--lon", type=float, required=True)
+    radius.add_argument("--km", type=float, required=True)
+    return parser.parse_args(argv)
+
+
+def main(options: argparse.Namespace) -> None:
+    connection = connection_factory.connect(options.db, options.profile)
+    rows = options.output is not None
+    indexed = not options.scan
+    match options.command:
+        case "create":
+            make_spatial_index(connection)
+            connection.close()
+            return
+        case "box":
+            with connection_factory.read_snapshot(connection):
+                result = in_box(
+                    connection,
+                    options.south,
+                    options.west,
+                    options.north,
+                    options.east,
+                    rows,
+                    indexed,
+                )
+        case "radius":
+            with connection_factory.read_snapshot(connection):
+                result = in_radius(
+                    connection,
+                    options.lat,
+                    options.lon,
+                    options.km,
+                    rows,
+                    indexed,
+                )
+        case _:
+            connection.close()
+            raise ValueError(f"unknown command {options.command!r}")
+    connection.close()
+    if isinstance(result, list):
+        with options.output.open("w", newline="") as target_file:
+            writer = csv.writer(target_file)
+            writer.writerow(ROW_COLUMNS)
+            writer.writerows(result)
+        print(f"wrote {len(result)} activations")
+    else:
+        print(f"{result} activations")
+
+
+if __name__ == "__main__":
+    main(get_options())
@@ -14,6 +14,8 @@ from pathlib import Path
 from textwrap import dedent
 from typing import DefaultDict, Any, cast
 
+import connection_factory
+
 
 def make_tables(connection: db.Connection) -> None:
     create_customer_table = dedent("""
@@ -64,6 +66,163 @@ def make_tables(connection: db.Connection) -> None:
     cursor.close()
 
 
+STRICT_TABLES = {
+    "customer": dedent("""
+        CREATE TABLE IF NOT EXISTS customer(
+            customer_id INTEGER PRIMARY KEY,
+            customer_name TEXT NOT NULL UNIQUE
+        ) STRICT
+        """),
+    "device_type": dedent("""
+        CREATE TABLE IF NOT EXISTS device_type(
+            type_id INTEGER PRIMARY KEY,
+            device_type_name TEXT NOT NULL UNIQUE
+        ) STRICT
+        """),
+    "customer_device": dedent("""
+        CREATE TABLE IF NOT EXISTS customer_device(
+            customer_device_id INTEGER PRIMARY KEY,
+            customer_id INTEGER NOT NULL
+                REFERENCES customer(customer_id),
+            type_id INTEGER
+                REFERENCES device_type(type_id),
+            device_name TEXT NOT NULL,
+            UNIQUE(customer_id, device_name)
+        ) STRICT
+        """),
+    "service": dedent("""
+        CREATE TABLE IF NOT EXISTS service(
+            service_id INTEGER PRIMARY KEY,
+            service_name TEXT NOT NULL UNIQUE
+        ) STRICT
+        """),
+    "customer_device_service": dedent("""
+        CREATE TABLE IF NOT EXISTS customer_device_service(
+            customer_device_id INTEGER NOT NULL
+                REFERENCES customer_device(customer_device_id),
+            service_id INTEGER NOT NULL
+                REFERENCES service(service_id),
+            start ANY,
+            latitude REAL,
+            longitude REAL
+        ) STRICT
+        """),
+}
+
+
+def make_strict_tables(connection: db.Connection) -> None:
+    """
+    The optimised physical layout.
+
+    Each dimension has an ``INTEGER PRIMARY KEY`` alias for the rowid,
+    so ``customer.rowid`` and ``customer.customer_id`` are the same value.
+    Natural keys are ``NOT NULL UNIQUE``.
+    Tables are ``STRICT``, so a value of the wrong type is an error,
+    not a silent affinity conversion.
+
+    None of these tables is declared ``WITHOUT ROWID``:
+    every dimension is referenced by its integer key,
+    and the fact table has no natural key.
+
+    Foreign keys are only enforced on connections that
+    execute ``PRAGMA foreign_keys = ON``.
+    """
+    cursor = connection.cursor()
+    for table_sql in STRICT_TABLES.values():
+        print(table_sql)
+        cursor.execute(table_sql)
+        print("completed")
+        connection.commit()
+    cursor.close()
+
+
+LAYOUTS = {
+    "legacy": make_tables,
+    "strict": make_strict_tables,
+}
+
+
+def migrate_to_strict(connection: db.Connection) -> None:
+    """
+    Rebuild legacy tables in the strict layout.
+
+    This follows the SQLite "make other kinds of table schema changes"
+    procedure: create new tables, copy, drop the old, rename the new.
+    The legacy rowids are copied into the ``INTEGER PRIMARY KEY``
+    columns, so the fact table's references remain valid.
+
+    Duplicate natural keys or dangling references are an
+    :py:class:`sqlite3.IntegrityError` and nothing is changed.
+    """
+    copy_sql = {
+        "customer": dedent("""
+            INSERT INTO new_customer(customer_id, customer_name)
+                SELECT rowid, customer_name FROM customer
+            """),
+        "device_type": dedent("""
+            INSERT INTO new_device_type(type_id, device_type_name)
+                SELECT rowid, device_type_name FROM device_type
+            """),
+        "customer_device": dedent("""
+            INSERT INTO new_customer_device(
+                    customer_device_id, customer_id, type_id, device_name)
+                SELECT rowid, customer_id, type_id, device_name
+                FROM customer_device
+            """),
+        "service": dedent("""
+            INSERT INTO new_service(service_id, service_name)
+                SELECT rowid, service_name FROM service
+            """),
+        "customer_device_service": dedent("""
+            INSERT INTO new_customer_device_service(
+                    customer_device_id, service_id, start,
+                    latitude, longitude)
+                SELECT customer_device_id, service_id, start,
+                    latitude, longitude
+                FROM customer_device_service
+            """),
+    }
+    cursor = connection.cursor()
+    cursor.execute("PRAGMA foreign_keys = OFF")
+    cursor.execute("BEGIN")
+    try:
+        cursor.execute(
+            "SELECT name FROM sqlite_schema WHERE type = 'table'"
+        )
+        legacy_tables = {name for (name,) in cursor.fetchall()}
+        for name in copy_sql:
+            # Create the strict table under a temporary name.
+            cursor.execute(
+                re.sub(
+                    rf"EXISTS {name}\(",
+                    f"EXISTS new_{name}(",
+                    STRICT_TABLES[name],
+                )
+            )
+        for name, insert_sql in copy_sql.items():
+            if name in legacy_tables:
+                cursor.execute(insert_sql)
+                print(f"copied {cursor.rowcount} {name} rows")
+        for name in copy_sql:
+            if name in legacy_tables:
+                cursor.execute(f"DROP TABLE {name}")
+            cursor.execute(f"ALTER TABLE new_{name} RENAME TO {name}")
+        cursor.execute("PRAGMA foreign_key_check")
+        problems = cursor.fetchall()
+        if problems:
+            raise db.IntegrityError(
+                f"foreign key violations {problems[:8]!r}"
+            )
+    except db.Error:
+        connection.rollback()
+        raise
+    else:
+        connection.commit()
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+        cursor.close()
+
+
 def survey(source, schema) -> DefaultDict[Any, Counter]:
     """Only valid values collected.
 
@@ -116,7 +275,7 @@ def load_customer(connection: db.Connection, names: list[str]) -> None:
         DELETE FROM customer
     """)
     insert_customer_row = dedent("""
-        INSERT INTO customer
+        INSERT INTO customer(customer_name)
             VALUES(:customer_name)
     """)
     cursor = connection.cursor()
@@ -143,7 +302,7 @@ def load_device_type(
         DELETE FROM device_type
     """)
     insert_device_type_row = dedent("""
-        INSERT INTO device_type
+        INSERT INTO device_type(device_type_name)
             VALUES(:device_type_name)
     """)
     cursor = connection.cursor()
@@ -179,7 +338,7 @@ def load_customer_device(
         WHERE device_type_name = :device_type_name
     """)
     insert_customer_device_row = dedent("""
-        INSERT INTO customer_device
+        INSERT INTO customer_device(customer_id, type_id, device_name)
             VALUES(:customer_id, :device_type_id, :device_name)
     """)
 
@@ -218,7 +377,7 @@ def load_service(connection: db.Connection, names: list[str]) -> None:
         DELETE FROM service
     """)
     insert_service_row = dedent("""
-        INSERT INTO service
+        INSERT INTO service(service_name)
             VALUES(:service_name)
     """)
     cursor = connection.cursor()
@@ -237,6 +396,167 @@ def load_service(connection: db.Connection, names: list[str]) -> None:
     cursor.close()
 
 
+def make_unique_indexes(connection: db.Connection) -> None:
+    """
+    Unique indexes on the natural keys of the dimension tables.
+    These are the conflict targets for the incremental ``merge_*()``
+    functions.
+    """
+    create_index_sql = [
+        dedent("""
+            CREATE UNIQUE INDEX IF NOT EXISTS customer_name_ix
+                ON customer(customer_name)
+            """),
+        dedent("""
+            CREATE UNIQUE INDEX IF NOT EXISTS device_type_name_ix
+                ON device_type(device_type_name)
+            """),
+        dedent("""
+            CREATE UNIQUE INDEX IF NOT EXISTS customer_device_ix
+                ON customer_device(customer_id, device_name)
+            """),
+        dedent("""
+            CREATE UNIQUE INDEX IF NOT EXISTS service_name_ix
+                ON service(service_name)
+            """),
+    ]
+    cursor = connection.cursor()
+    for index_sql in create_index_sql:
+        cursor.execute(index_sql)
+    connection.commit()
+    cursor.close()
+
+
+def merge_customer(
+    connection: db.Connection, names: list[str]
+) -> tuple[int, int]:
+    """Insert only new customers. Existing rowids are unchanged."""
+    insert_customer_row = dedent("""
+        INSERT INTO customer(customer_name)
+            VALUES(:customer_name)
+            ON CONFLICT DO NOTHING
+    """)
+    cursor = connection.cursor()
+    inserts = existing = 0
+    for customer_name in names:
+        cursor.execute(
+            insert_customer_row, {"customer_name": customer_name}
+        )
+        inserts += cursor.rowcount
+        existing += 1 - cursor.rowcount
+    connection.commit()
+    print(
+        f"inserted {inserts} new customer rows, "
+        f"{existing} already present"
+    )
+    cursor.close()
+    return inserts, existing
+
+
+def merge_device_type(
+    connection: db.Connection, names: list[str]
+) -> tuple[int, int]:
+    """Insert only new device types. Existing rowids are unchanged."""
+    insert_device_type_row = dedent("""
+        INSERT INTO device_type(device_type_name)
+            VALUES(:device_type_name)
+            ON CONFLICT DO NOTHING
+    """)
+    cursor = connection.cursor()
+    inserts = existing = 0
+    for device_type_name in names:
+        cursor.execute(
+            insert_device_type_row,
+            {"device_type_name": device_type_name},
+        )
+        inserts += cursor.rowcount
+        existing += 1 - cursor.rowcount
+    connection.commit()
+    print(
+        f"inserted {inserts} new device type rows, "
+        f"{existing} already present"
+    )
+    cursor.close()
+    return inserts, existing
+
+
+def merge_customer_device(
+    connection: db.Connection, customer_device: list[str]
+) -> tuple[int, int]:
+    """
+    Insert only new customer_device rows.
+    The natural key is the customer and the device name.
+    """
+    get_customer_id = dedent("""
+        SELECT rowid FROM customer
+        WHERE customer_name = :customer_name
+    """)
+    get_device_type_id = dedent("""
+        SELECT rowid FROM device_type
+        WHERE device_type_name = :device_type_name
+    """)
+    insert_customer_device_row = dedent("""
+        INSERT INTO customer_device(customer_id, type_id, device_name)
+            VALUES(:customer_id, :device_type_id, :device_name)
+            ON CONFLICT DO NOTHING
+    """)
+
+    cursor = connection.cursor()
+    inserts = existing = 0
+    for customer_name, device_name, device_type_name in customer_device:
+        cursor.execute(
+            get_customer_id, {"customer_name": customer_name}
+        )
+        (customer_id,) = cursor.fetchone()
+        cursor.execute(
+            get_device_type_id, {"device_type_name": device_type_name}
+        )
+        (device_type_id,) = cursor.fetchone()
+        cursor.execute(
+            insert_customer_device_row,
+            {
+                "device_name": device_name,
+                "customer_id": customer_id,
+                "device_type_id": device_type_id,
+            },
+        )
+        inserts += cursor.rowcount
+        existing += 1 - cursor.rowcount
+    connection.commit()
+    print(
+        f"inserted {inserts} new customer_device rows, "
+        f"{existing} already present"
+    )
+    cursor.close()
+    return inserts, existing
+
+
+def merge_service(
+    connection: db.Connection, names: list[str]
+) -> tuple[int, int]:
+    """Insert only new services. Existing rowids are unchanged."""
+    insert_service_row = dedent("""
+        INSERT INTO service(service_name)
+            VALUES(:service_name)
+            ON CONFLICT DO NOTHING
+    """)
+    cursor = connection.cursor()
+    inserts = existing = 0
+    for service_name in names:
+        cursor.execute(
+            insert_service_row, {"service_name": service_name}
+        )
+        inserts += cursor.rowcount
+        existing += 1 - cursor.rowcount
+    connection.commit()
+    print(
+        f"inserted {inserts} new service rows, "
+        f"{existing} already present"
+    )
+    cursor.close()
+    return inserts, existing
+
+
 def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -259,18 +579,65 @@ def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
         type=Path,
         default=[Path("data/activation_source.csv")],
     )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        action="store",
+        choices=list(LAYOUTS),
+        default="legacy",
+        help="physical schema; strict migrates an existing legacy database",
+    )
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        default=False,
+        help="insert only new dimension values; keep existing rowids",
+    )
+    connection_factory.add_profile_option(parser, "bulk-load")
     options = parser.parse_args(argv)
     return options
 
 
-def main(schema_path: Path, database_connect: str, sources: list[Path]):
-    """Uses the JSONSchema to validate CSV rows."""
+def main(
+    schema_path: Path,
+    database_connect: str,
+    sources: list[Path],
+    incremental: bool = False,
+    layout: str = "legacy",
+    profile: str = "bulk-load",
+):
+    """
+    Uses the JSONSchema to validate CSV rows.
+
+    By default, each dimension table is deleted and reloaded.
+    With ``incremental``, only values not already present are inserted.
+
+    The strict layout enforces foreign keys, which rules out
+    delete-and-reload. It's always incremental.
+    A database that already has the strict layout keeps it,
+    whatever ``layout`` asks for.
+    """
     with schema_path.open() as schema_file:
         schema = json.load(schema_file)
     Draft202012Validator.check_schema(schema)
 
-    connection = db.connect(database_connect)
-    make_tables(connection)
+    connection = connection_factory.connect(database_connect, profile)
+    existing_layout = connection_factory.schema_layout(connection)
+    if existing_layout == "strict" and layout == "legacy":
+        # Foreign keys are on; a delete-and-reload would break them.
+        print(
+            "the database has the strict layout; loading incrementally"
+        )
+        layout = "strict"
+    if layout == "strict":
+        incremental = True
+        if existing_layout == "legacy":
+            migrate_to_strict(connection)
+        connection.execute("PRAGMA foreign_keys = ON")
+    LAYOUTS[layout](connection)
+    if incremental and layout == "legacy":
+        make_unique_indexes(connection)
 
     for source_path in sources:
         with source_path.open() as source_file:
@@ -289,12 +656,26 @@ def main(schema_path: Path, database_connect: str, sources: list[Path]):
         )
         service_names = list(domains["service_name"].keys())
 
-        load_customer(connection, customer_names)
-        load_device_type(connection, device_type_names)
-        load_customer_device(connection, customer_device)
-        load_service(connection, service_names)
+        if incremental:
+            merge_customer(connection, customer_names)
+            merge_device_type(connection, device_type_names)
+            merge_customer_device(connection, customer_device)
+            merge_service(connection, service_names)
+        else:
+            load_customer(connection, customer_names)
+            load_device_type(connection, device_type_names)
+            load_customer_device(connection, customer_device)
+            load_service(connection, service_names)
+    connection.close()
 
 
 if __name__ == "__main__":
     options = get_options(sys.argv[1:])
-    main(options.schema, options.db, options.source)
+    main(
+        options.schema,
+        options.db,
+        options.source,
+        options.incremental,
+        options.layout,
+        options.profile,
+    )
@@ -1,42 +1,65 @@
 """
 Exampple SQL Extracts
+
+The queries are registered with :py:mod:`query_runner`, as extracts.
+By default, each row is printed. With ``--format csv`` or ``--format jsonl``,
+each extract is written to a file in the ``--output`` directory,
+and its rows/sec and time to first row are reported.
+
+Each query can be given a :py:class:`result_cache.ResultCache`.
+With ``--cache-file``, results are reused across runs
+until a load changes the database.
 """
 
+import argparse
+from pathlib import Path
 import sqlite3 as db
-from textwrap import dedent
+import sys
 
+import connection_factory
+import instrumentation
+import query_runner
+import result_cache
 
-def query_1(connection):
-    query = dedent("""
+
+query_runner.register(
+    "query_1",
+    """
         SELECT customer.customer_name, customer_device.device_name 
             FROM customer_device 
             JOIN customer
                 ON customer_device.customer_id = customer.rowid
-    """)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    for row in cursor.fetchall():
-        print({k: row[k] for k in row.keys()})
-    cursor.close()
+    """,
+)
+
 
+def query_1(connection, cache=None):
+    return query_runner.run(
+        connection, "query_1", query_runner.print_sink, cache=cache
+    )
 
-def query_2(connection):
-    query = dedent("""
+
+query_runner.register(
+    "query_2",
+    """
         SELECT customer_name 
         FROM customer
         UNION ALL
         SELECT service_name 
         FROM service
-    """)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    for row in cursor.fetchall():
-        print({k: row[k] for k in row.keys()})
-    cursor.close()
+    """,
+)
+
+
+def query_2(connection, cache=None):
+    return query_runner.run(
+        connection, "query_2", query_runner.print_sink, cache=cache
+    )
 
 
-def query_3(connection):
-    query = dedent("""
+query_runner.register(
+    "query_3",
+    """
         SELECT customer_name, 'no device' as device_name
         FROM customer
         WHERE NOT EXISTS (
@@ -48,56 +71,153 @@ def query_3(connection):
         FROM customer_device
         JOIN customer 
             ON customer_device.customer_id = customer.rowid
-    """)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    for row in cursor.fetchall():
-        print({k: row[k] for k in row.keys()})
-    cursor.close()
+    """,
+)
 
 
-def query_group_by(connection):
-    query = dedent("""
+def query_3(connection, cache=None):
+    return query_runner.run(
+        connection, "query_3", query_runner.print_sink, cache=cache
+    )
+
+
+query_runner.register(
+    "query_group_by",
+    """
         SELECT device_type.device_type_name, count(*)
         FROM customer_device
         JOIN device_type
            ON device_type.rowid = customer_device.type_id
         GROUP BY device_type.device_type_name
-    """)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    for row in cursor.fetchall():
-        print({k: row[k] for k in row.keys()})
-    cursor.close()
+    """,
+)
+
+
+def query_group_by(connection, cache=None):
+    return query_runner.run(
+        connection,
+        "query_group_by",
+        query_runner.print_sink,
+        cache=cache,
+    )
 
 
-def query_group_by_having(connection):
-    query = dedent("""
+query_runner.register(
+    "query_group_by_having",
+    """
         SELECT device_type.device_type_name, count(*)
         FROM customer_device
         JOIN device_type
            ON device_type.rowid = customer_device.type_id
         GROUP BY device_type.device_type_name
         HAVING count(*) > 1
-    """)
-    cursor = connection.cursor()
-    cursor.execute(query)
-    for row in cursor.fetchall():
-        print({k: row[k] for k in row.keys()})
-    cursor.close()
-
-
-def main(database_connect="unlearning_sql.db"):
-    connection = db.connect(database_connect)
+    """,
+)
+
+
+def query_group_by_having(connection, cache=None):
+    return query_runner.run(
+        connection,
+        "query_group_by_having",
+        query_runner.print_sink,
+        cache=cache,
+    )
+
+
+EXTRACT_NAMES = [
+    "query_1",
+    "query_2",
+    "query_3",
+    "query_group_by",
+    "query_group_by_having",
+]
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="unlearning_sql.db"
+    )
+    connection_factory.add_profile_option(parser, "read-extract")
+    connection_factory.add_read_only_option(parser)
+    parser.add_argument(
+        "--cache-file",
+        action="store",
+        type=Path,
+        default=None,
+        help="reuse query results saved here",
+    )
+    parser.add_argument(
+        "--format",
+        action="store",
+        choices=["print", *query_runner.FORMATS],
+        default="print",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=Path,
+        default=Path("data"),
+        help="directory for the csv or jsonl files",
+    )
+    instrumentation.add_instrument_options(parser)
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect="unlearning_sql.db",
+    profile="read-extract",
+    read_only=False,
+    cache_path=None,
+    output_format="print",
+    output_dir=Path("data"),
+    instrument=None,
+):
+    connection = connection_factory.connect(
+        database_connect, profile, read_only, instrument
+    )
     connection.row_factory = db.Row
-
-    with connection:
-        query_1(connection)
-        query_2(connection)
-        query_3(connection)
-        query_group_by(connection)
-        query_group_by_having(connection)
+    cache = None
+    snapshot = connection_factory.read_snapshot(connection)
+    if cache_path:
+        cache = result_cache.ResultCache(connection, path=cache_path)
+        snapshot = cache.snapshot()
+
+    with snapshot:
+        if output_format == "print":
+            query_1(connection, cache)
+            query_2(connection, cache)
+            query_3(connection, cache)
+            query_group_by(connection, cache)
+            query_group_by_having(connection, cache)
+        else:
+            sink_factory = query_runner.FORMATS[output_format]
+            for name in EXTRACT_NAMES:
+                path = output_dir / f"{name}.{output_format}"
+                with path.open("w", newline="") as target:
+                    stats = query_runner.run(
+                        connection,
+                        name,
+                        sink_factory(target),
+                        cache=cache,
+                    )
+                print(stats)
+
+    if cache:
+        print(f"result cache: {cache.stats}")
+        cache.close()
+    instrumentation.write_report(connection)
 
 
 if __name__ == "__main__":
-    main()
+    options = get_options()
+    main(
+        options.db,
+        options.profile,
+        options.read_only,
+        options.cache_file,
+        options.format,
+        options.output,
+        instrumentation.settings_from(options),
+    )
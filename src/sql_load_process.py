@@ -5,13 +5,24 @@ Populates the activation table after validating inputs.
 """
 
 import argparse
+from collections.abc import Iterable
 import csv
-import re
+from functools import partial
 import sqlite3 as db
 from pathlib import Path
 import sys
 from textwrap import dedent
 
+import checkpoint
+import connection_factory
+import geohash
+import instrumentation
+import rollups
+import timestamps
+
+
+LOADER = "sql_load_process"
+
 
 def make_activation(connection: db.Connection) -> None:
     create_activation_table = dedent("""
@@ -46,8 +57,20 @@ def clear_activation(connection: db.Connection) -> None:
 
 
 def load_activation(
-    connection: db.Connection, activation_reader: csv.DictReader
+    connection: db.Connection,
+    activation_reader: Iterable[dict[str, str]],
+    batch_size: int | None = None,
+    state: checkpoint.Checkpoint | None = None,
 ) -> None:
+    """
+    Insert the raw rows.
+    With a ``batch_size``, commit after each batch so concurrent
+    readers and writers aren't locked out for the whole file.
+
+    With a checkpoint ``state``, the reader is an
+    :py:class:`checkpoint.OffsetReader`, and its position is saved in
+    each batch's transaction.
+    """
     insert_activation_row = dedent("""
         INSERT 
             INTO activation(customer_name, device_name, service_name, 
@@ -57,12 +80,44 @@ def load_activation(
                 :start_date, :latitude, :longitude
             )
         """)
+    position = (
+        activation_reader
+        if isinstance(activation_reader, checkpoint.OffsetReader)
+        else None
+    )
+    if state and position is None:
+        raise ValueError("a checkpoint needs an OffsetReader")
     cursor = connection.cursor()
+
+    def insert_batch(batch: list[dict[str, str]]) -> int:
+        cursor.executemany(insert_activation_row, batch)
+        count = cursor.rowcount
+        if state and position:
+            checkpoint.advance(connection, state, position)
+        connection.commit()
+        return count
+
     inserts = 0
-    for row in activation_reader:
-        cursor.execute(insert_activation_row, row)
-        inserts += cursor.rowcount
-    connection.commit()
+    if batch_size:
+        batch = []
+        for row in activation_reader:
+            batch.append(row)
+            if len(batch) == batch_size:
+                inserts += connection_factory.retry_busy(
+                    connection, partial(insert_batch, batch)
+                )
+                batch = []
+        if batch:
+            inserts += connection_factory.retry_busy(
+                connection, partial(insert_batch, batch)
+            )
+    else:
+        for row in activation_reader:
+            cursor.execute(insert_activation_row, row)
+            inserts += cursor.rowcount
+        if state and position:
+            checkpoint.advance(connection, state, position)
+        connection.commit()
     print(f"inserted {inserts} new rows")
     cursor.close()
 
@@ -161,15 +216,21 @@ def activation_locate_disconnected_data(
     cursor.close()
 
 
-def activation_transformation(connection: db.Connection) -> None:
+def activation_transformation(
+    connection: db.Connection, timestamps_mode: str = "raw"
+) -> None:
     """
-    Incomplete -- doesn't convert the date.
-
-    Does convert latitude and longitude.
+    Converts latitude and longitude.
     latitude = "01°28.0000′N"
     longitude = "001°28.0000′W"
+
+    Sets ``start_timestamp`` from ``start_date`` in the given
+    :py:mod:`timestamps` storage mode. The ``raw`` mode copies the text.
     """
-    update_lat_lon_1 = dedent("""
+    start_timestamp = timestamps.storage_sql(
+        "start_date", timestamps_mode
+    )
+    update_lat_lon_1 = dedent(f"""
         UPDATE activation
             SET 
                 lat_real = (
@@ -183,7 +244,8 @@ def activation_transformation(connection: db.Connection) -> None:
                     + CAST(substr(longitude, 5, 7) as REAL)/60
                 ) * (
                     CASE substr(longitude, 13, 1) WHEN 'E' THEN +1 ELSE -1 END
-                )
+                ),
+                start_timestamp = {start_timestamp}
             WHERE 1 = 1
         """)
     # Alternative design, assuming two functions have been defined:
@@ -203,7 +265,10 @@ def activation_transformation(connection: db.Connection) -> None:
     cursor.close()
 
 
-def persist(connection: db.Connection) -> None:
+def persist(
+    connection: db.Connection,
+    state: checkpoint.Checkpoint | None = None,
+) -> None:
     """
     Persists valid row dat into the customer_device_service table.
 
@@ -215,12 +280,14 @@ def persist(connection: db.Connection) -> None:
             latitude REAL,
             longitude REAL
 
+    With a checkpoint ``state``, the last activation rowid is saved
+    in the same transaction; a resumed load doesn't persist it again.
     """
     load_query = dedent("""
         INSERT INTO customer_device_service(customer_device_id, service_id, start, latitude, longitude)
             SELECT customer_device.rowid, 
                 service.rowid, 
-                start_date, 
+                start_timestamp, 
                 lat_real, 
                 lon_real
             FROM activation
@@ -232,9 +299,16 @@ def persist(connection: db.Connection) -> None:
             JOIN customer
                 ON customer.customer_name = activation.customer_name
     """)
+    if state and state.persisted is not None:
+        print("already persisted")
+        return
     cursor = connection.cursor()
     cursor.execute(load_query)
     inserts = cursor.rowcount
+    if state:
+        cursor.execute("SELECT coalesce(max(rowid), 0) FROM activation")
+        (state.persisted,) = cursor.fetchone()
+        checkpoint.save(connection, state)
     connection.commit()
     print(f"loaded {inserts} final rows")
 
@@ -245,13 +319,71 @@ def persist(connection: db.Connection) -> None:
     cursor.close()
 
 
-def setup(connection: db.Connection) -> None:
-    """Adds regexp() to SQLite"""
+def persist_batched(
+    connection: db.Connection,
+    batch_size: int,
+    state: checkpoint.Checkpoint | None = None,
+) -> None:
+    """
+    Persists valid rows in bounded transactions of ``batch_size``
+    activation rows each.
 
-    def regexp(pattern, data):
-        return re.match(pattern, data) is not None
+    Each batch is retried if the database is busy.
+    Readers in WAL mode see only whole, committed batches.
+
+    With a checkpoint ``state``, each batch's last activation rowid
+    is saved in its transaction, and a resumed load starts after it.
+    """
+    activation_range = dedent("""
+        SELECT min(rowid), max(rowid)
+            FROM activation
+    """)
+    load_query = dedent("""
+        INSERT INTO customer_device_service(customer_device_id, service_id, start, latitude, longitude)
+            SELECT customer_device.rowid,
+                service.rowid,
+                start_timestamp,
+                lat_real,
+                lon_real
+            FROM activation
+            JOIN service
+                ON service.service_name = activation.service_name
+            JOIN customer_device
+                ON customer_device.device_name = activation.device_name
+                AND customer_device.customer_id = customer.rowid
+            JOIN customer
+                ON customer.customer_name = activation.customer_name
+            WHERE activation.rowid BETWEEN :low AND :high
+    """)
+    cursor = connection.cursor()
+    cursor.execute(activation_range)
+    first, last = cursor.fetchone()
+    inserts = 0
+
+    def persist_batch(low: int, high: int) -> int:
+        cursor.execute(load_query, {"low": low, "high": high})
+        count = cursor.rowcount
+        if state:
+            state.persisted = min(high, last)
+            checkpoint.save(connection, state)
+        connection.commit()
+        return count
+
+    if first is not None:
+        if state and state.persisted is not None:
+            first = max(first, state.persisted + 1)
+        for low in range(first, last + 1, batch_size):
+            high = low + batch_size - 1
+            inserts += connection_factory.retry_busy(
+                connection, partial(persist_batch, low, high)
+            )
+    print(f"loaded {inserts} final rows")
+    cursor.close()
 
-    connection.create_function("regexp", 2, regexp)
+
+def setup(connection: db.Connection) -> None:
+    """Adds regexp() to SQLite"""
+    connection_factory.register_functions(connection)
 
 
 def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
@@ -269,33 +401,140 @@ def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
         type=Path,
         default=[Path("data/activation_source.csv")],
     )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        action="store",
+        type=int,
+        default=None,
+        help="commit every N rows, so extracts can run during the load",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        default=False,
+        help="save each source's progress, so the load can be resumed",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="continue from the last committed checkpoint",
+    )
+    timestamps.add_timestamps_option(parser)
+    parser.add_argument(
+        "--geohash",
+        action="store",
+        type=int,
+        default=None,
+        metavar="PRECISION",
+        help="add, index, and fill a geohash column",
+    )
+    connection_factory.add_profile_option(parser, "bulk-load")
+    instrumentation.add_instrument_options(parser)
     options = parser.parse_args(argv)
     return options
 
 
-def main(database_connect: str, sources: list[Path]) -> None:
-    connection = db.connect(database_connect)
-    setup(connection)
+def main(
+    database_connect: str,
+    sources: list[Path],
+    profile: str = "bulk-load",
+    batch_size: int | None = None,
+    timestamps_mode: str = "raw",
+    geohash_precision: int | None = None,
+    instrument: instrumentation.Settings | None = None,
+    resume: bool = False,
+    checkpoints: bool = False,
+) -> None:
+    """
+    Without a ``batch_size``, each step is one transaction.
+    With a ``batch_size``, the load and persist steps commit in
+    bounded batches. With the WAL journaling of the ``bulk-load``
+    profile, extracts can run concurrently with this load.
+
+    If the database has rollups, they're refreshed after each source.
+
+    With an ``epoch`` or ``utc-text`` ``timestamps_mode``,
+    the ``start`` column is normalized and indexed.
+
+    With a ``geohash_precision``, the new rows get a geohash.
+
+    With ``instrument`` settings, each statement's time and rows
+    are reported at the end.
+
+    With ``checkpoints``, or ``resume``, each source's progress is
+    saved in :py:mod:`checkpoint`'s control table, with each committed
+    batch, and removed when the whole load is complete. With
+    ``resume``, the rows already loaded are kept, and each source
+    continues from its checkpoint. With nothing to resume, or without
+    ``resume``, the load starts over.
+    """
+    connection = connection_factory.connect(
+        database_connect, profile, instrument=instrument
+    )
 
     # Schema Definition.
     make_activation(connection)
-    clear_activation(connection)
+    checkpoints = checkpoints or resume
+    if checkpoints:
+        checkpoint.make_checkpoint_table(connection)
+        if resume and not checkpoint.has_checkpoints(
+            connection, LOADER
+        ):
+            print("nothing to resume; starting over")
+            resume = False
+    if not resume:
+        clear_activation(connection)
 
     # Load raw activation records into database.
     # From these, create and persist activation
     # rows by resolving FK references.
     for source in sources:
-        with source.open() as source_file:
-            reader = csv.DictReader(source_file)
-            load_activation(connection, reader)
+        state = None
+        if checkpoints:
+            state = checkpoint.start(connection, LOADER, source, resume)
+        if state is None:
+            with source.open() as source_file:
+                reader = csv.DictReader(source_file)
+                load_activation(connection, reader, batch_size)
+        elif not state.loaded:
+            with source.open("rb") as source_file:
+                reader = checkpoint.OffsetReader(source_file, state)
+                load_activation(connection, reader, batch_size, state)
+            state.loaded = True
+            checkpoint.save(connection, state)
+            connection.commit()
         activation_reject_bad_data_2(connection)
         activation_locate_disconnected_data(connection)
-        activation_transformation(connection)
+        activation_transformation(connection, timestamps_mode)
         rows = activation_count(connection)
         print(f"Activations table has {rows} rows")
-        persist(connection)
+        if batch_size:
+            persist_batched(connection, batch_size, state)
+        else:
+            persist(connection, state)
+        if rollups.has_rollups(connection):
+            rollups.refresh_rollups(connection)
+    if checkpoints:
+        checkpoint.finish(connection, LOADER, sources)
+    if geohash_precision:
+        geohash.add_geohash_column(connection, geohash_precision)
+    if timestamps_mode != "raw":
+        timestamps.make_start_index(connection)
+    instrumentation.write_report(connection)
 
 
 if __name__ == "__main__":
     options = get_options(sys.argv[1:])
-    main(options.db, options.source)
+    main(
+        options.db,
+        options.source,
+        options.profile,
+        options.batch_size,
+        options.timestamps,
+        options.geohash,
+        instrumentation.settings_from(options),
+        options.resume,
+        options.checkpoint,
+    )
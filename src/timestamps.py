@@ -0,0 +1,156 @@
+"""
+Storage modes for ``customer_device_service.start``.
+
+-   ``raw``: whatever text the loader had. The SQL loader copies the
+    source ISO text; the Python loader writes ``str(datetime)``.
+    These compare as text, and don't agree with each other.
+
+-   ``epoch``: an INTEGER count of seconds since 1970-01-01T00:00:00Z.
+    Smaller, and ordered, so a time range can use an index.
+
+-   ``utc-text``: fixed-format UTC text, ``YYYY-MM-DDTHH:MM:SSZ``.
+    Readable, and ordered, so a time range can use an index.
+
+Values without a UTC offset are taken to be UTC, as SQLite does.
+
+To convert the existing rows of a database:
+
+..  code-block:: bash
+
+    python src/timestamps.py --db data/unlearning_sql.db --to epoch
+
+"""
+
+import argparse
+import datetime
+import sqlite3 as db
+import sys
+from textwrap import dedent
+from typing import Any
+
+import connection_factory
+
+
+MODES = ("raw", "epoch", "utc-text")
+
+UTC_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def to_storage(value: datetime.datetime, mode: str) -> Any:
+    """The Python loader's value for the ``start`` column."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.UTC)
+    match mode:
+        case "raw":
+            return value
+        case "epoch":
+            return int(value.timestamp())
+        case "utc-text":
+            return value.astimezone(datetime.UTC).strftime(UTC_FORMAT)
+        case _:
+            raise ValueError(f"unknown timestamp mode {mode!r}")
+
+
+def text_sql(column: str) -> str:
+    """
+    An SQL expression for ``column`` as ISO text SQLite's date
+    functions understand, for any storage mode.
+    Without the ``'unixepoch'`` modifier, SQLite would take an
+    integer to be a Julian day number.
+    """
+    return (
+        f"CASE typeof({column}) "
+        f"WHEN 'integer' THEN datetime({column}, 'unixepoch') "
+        f"ELSE {column} END"
+    )
+
+
+def storage_sql(column: str, mode: str) -> str:
+    """The SQL loader's expression for the ``start`` column."""
+    match mode:
+        case "raw":
+            return column
+        case "epoch":
+            return (
+                f"CASE typeof({column}) WHEN 'integer' THEN {column} "
+                f"ELSE CAST(strftime('%s', {column}) AS INTEGER) END"
+            )
+        case "utc-text":
+            return f"strftime('{UTC_FORMAT}', {text_sql(column)})"
+        case _:
+            raise ValueError(f"unknown timestamp mode {mode!r}")
+
+
+def make_start_index(connection: db.Connection) -> None:
+    create_start_index = dedent("""
+        CREATE INDEX IF NOT EXISTS customer_device_service_start_ix
+            ON customer_device_service(start)
+        """)
+    cursor = connection.cursor()
+    cursor.execute(create_start_index)
+    connection.commit()
+    cursor.close()
+
+
+def migrate(connection: db.Connection, mode: str) -> int:
+    """
+    Convert the existing ``start`` values, in one transaction,
+    then index them.
+    Values SQLite can't parse become NULL.
+    """
+    if mode == "raw":
+        raise ValueError("can't convert back to raw timestamps")
+    start = storage_sql("start", mode)
+    convert_start = dedent(f"""
+        UPDATE customer_device_service
+            SET start = {start}
+            WHERE start IS NOT {start}
+        """)
+    cursor = connection.cursor()
+    cursor.execute(convert_start)
+    updates = cursor.rowcount
+    connection.commit()
+    print(f"converted {updates} start values to {mode}")
+    cursor.close()
+    make_start_index(connection)
+    return updates
+
+
+def add_timestamps_option(parser: argparse.ArgumentParser) -> None:
+    """The ``--timestamps`` option shared by the loaders."""
+    parser.add_argument(
+        "--timestamps",
+        action="store",
+        choices=MODES,
+        default="raw",
+        help="storage for customer_device_service.start",
+    )
+
+
+def get_options(argv: list[str] = sys.argv[1:]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--db", action="store", default="data/unlearning_sql.db"
+    )
+    parser.add_argument(
+        "--to",
+        dest="mode",
+        action="store",
+        choices=[mode for mode in MODES if mode != "raw"],
+        default="epoch",
+    )
+    connection_factory.add_profile_option(parser, "bulk-load")
+    return parser.parse_args(argv)
+
+
+def main(
+    database_connect: str, mode: str, profile: str = "bulk-load"
+) -> None:
+    connection = connection_factory.connect(database_connect, profile)
+    migrate(connection, mode)
+    connection.close()
+
+
+if __name__ == "__main__":
+    options = get_options()
+    main(options.db, options.mode, options.profile)
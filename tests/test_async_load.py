@@ -0,0 +1,90 @@
+"""
+Pytest unit tests of async_load_process
+"""
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import sqlite3 as db
+import time
+from unittest.mock import Mock
+
+import pytest
+
+import async_load_process
+import connection_factory
+import pipeline
+import sql_db_preparation
+
+
+def test_source_paths(tmp_path):
+    for name in ("b.csv", "a.csv", "c.txt"):
+        (tmp_path / name).write_text("")
+    assert async_load_process.source_paths([tmp_path]) == [
+        tmp_path / "a.csv", tmp_path / "b.csv"
+    ]
+    assert async_load_process.source_paths(
+        [tmp_path / "b.csv", str(tmp_path / "*.csv")]
+    ) == [tmp_path / "b.csv", tmp_path / "a.csv"]
+    assert async_load_process.source_paths([tmp_path / "missing.csv"]) == [
+        tmp_path / "missing.csv"
+    ]
+
+
+def mock_load(path):
+    """The first files are slowest; a file named "bad" fails."""
+    number = int(path.stem) if path.stem != "bad" else None
+    if number is None:
+        raise ValueError("bad file")
+    time.sleep(0.01 * (5 - number) if number < 5 else 0)
+    rows = [{"file": number, "row": row} for row in range(3)]
+    stats = [pipeline.StageStats("validate", 3, 3, 0.1)]
+    return async_load_process.FileResult(
+        path, rows, Counter(raw=3, saved=3), stats
+    )
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_ingest(tmp_path, ordered, capsys):
+    paths = [tmp_path / f"{n}.csv" for n in range(8)] + [tmp_path / "bad.csv"]
+    writer = Mock()
+    with ThreadPoolExecutor(4) as executor:
+        counts, stats = asyncio.run(
+            async_load_process.ingest(
+                paths, mock_load, writer, executor, max_files=3, ordered=ordered
+            )
+        )
+    assert counts == Counter(raw=24, saved=24, files=8, **{"failed files": 1})
+    assert [(s.name, s.rows_in, s.rows_out) for s in stats] == [
+        ("validate", 24, 24), ("write", 24, 24)
+    ]
+    written = [c.args[0]["file"] for c in writer.writerow.mock_calls]
+    assert sorted(written) == [n for n in range(8) for _ in range(3)]
+    if ordered:
+        assert written == sorted(written)
+    assert "bad.csv: ValueError('bad file')" in capsys.readouterr().out
+
+
+def test_load_file_closes_connection(tmp_path, monkeypatch):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(
+        here / "activation_source.schema", db_path, [data_path]
+    )
+    opened = []
+    original = connection_factory.connect
+
+    def connect(*args):
+        connection = original(*args)
+        opened.append(connection)
+        return connection
+
+    monkeypatch.setattr(connection_factory, "connect", connect)
+    result = async_load_process.load_file(
+        str(db_path), "default", "raw", None, data_path
+    )
+    assert result.counts["raw"] == 100
+    [connection] = opened
+    with pytest.raises(db.ProgrammingError):
+        connection.execute("SELECT 1")
@@ -0,0 +1,168 @@
+"""
+Pytest tests of checkpoint, and of resuming the loaders.
+
+A crash is simulated in a subprocess, with ``os._exit()`` partway
+through a batch: nothing is cleaned up, and nothing more is committed.
+"""
+import io
+from pathlib import Path
+import sqlite3 as db
+import subprocess
+import sys
+from textwrap import dedent
+
+import pytest
+
+import checkpoint
+import python_load_process
+import sql_db_preparation
+import sql_load_process
+
+
+def test_offset_reader():
+    data = 'a,b\r\n1,"x\r\ny"\r\n2,z\r\n3,°\r\n'.encode()
+    reader = checkpoint.OffsetReader(io.BytesIO(data))
+    assert reader.fieldnames == ["a", "b"]
+    offsets = [(row["a"], reader.offset, reader.row_number) for row in reader]
+    assert offsets == [
+        ("1", 15, 1), ("2", 20, 2), ("3", len(data), 3)
+    ]
+    state = checkpoint.Checkpoint("test", "source", byte_offset=15, row_number=1)
+    resumed = checkpoint.OffsetReader(io.BytesIO(data), state)
+    assert [row["a"] for row in resumed] == ["2", "3"]
+    assert resumed.row_number == 3
+    assert list(checkpoint.OffsetReader(io.BytesIO(b""))) == []
+
+
+def test_start_and_save(tmp_path):
+    source = tmp_path / "source.csv"
+    source.write_text("a\n1\n")
+    connection = db.connect(tmp_path / "control.db")
+    checkpoint.make_checkpoint_table(connection)
+    state = checkpoint.start(connection, "test", source, resume=True)
+    assert (state.byte_offset, state.loaded) == (0, False)
+    state.byte_offset, state.row_number, state.loaded = 4, 1, True
+    state.counts = {"raw": 1}
+    checkpoint.save(connection, state)
+    connection.commit()
+    assert checkpoint.start(connection, "test", source, resume=True) == state
+    fresh = checkpoint.start(connection, "test", source, resume=False)
+    assert (fresh.byte_offset, fresh.counts) == (0, {})
+    assert checkpoint.start(connection, "test", source, resume=True) == fresh
+    state.byte_offset = 100
+    checkpoint.save(connection, state)
+    connection.commit()
+    with pytest.raises(ValueError):
+        checkpoint.start(connection, "test", source, resume=True)
+    connection.close()
+
+
+def crash(patch: str, call: str) -> None:
+    """Run ``call`` with ``checkpoint.advance`` crashing on its third use."""
+    script = dedent(f"""
+        import os
+        import checkpoint, python_load_process, sql_load_process
+        from pathlib import Path
+        original = checkpoint.advance
+        calls = 0
+        def advance(*args):
+            global calls
+            calls += 1
+            if calls == 3:
+                os._exit(3)
+            original(*args)
+        {patch} = advance
+        {call}
+    """)
+    result = subprocess.run([sys.executable, "-c", script], check=False)
+    assert result.returncode == 3
+
+
+@pytest.fixture
+def prepared_db(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    return db_path
+
+
+def activations(db_path):
+    connection = db.connect(db_path)
+    rows = connection.execute(
+        "SELECT * FROM customer_device_service ORDER BY 1, 2, 3"
+    ).fetchall()
+    connection.close()
+    return rows
+
+
+def test_sql_load_resume(prepared_db, tmp_path, capsys):
+    data_path = Path.cwd() / "tests" / "activation_source.csv"
+    crash(
+        "checkpoint.advance",
+        f"sql_load_process.main({str(prepared_db)!r}, [Path({str(data_path)!r})], batch_size=7, checkpoints=True)",
+    )
+    connection = db.connect(prepared_db)
+    (loaded,) = connection.execute("SELECT count(*) FROM activation").fetchone()
+    (byte_offset, row_number) = connection.execute(
+        "SELECT byte_offset, row_number FROM load_checkpoint"
+    ).fetchone()
+    connection.close()
+    assert loaded == row_number == 14
+
+    sql_load_process.main(prepared_db, [data_path], batch_size=7, resume=True)
+    out, err = capsys.readouterr()
+    assert f"resuming {data_path} after row 14, byte {byte_offset}" in out
+    assert "inserted 86 new rows" in out
+    resumed = activations(prepared_db)
+    connection = db.connect(prepared_db)
+    assert connection.execute("SELECT * FROM load_checkpoint").fetchall() == []
+    connection.close()
+
+    sql_load_process.main(prepared_db, [data_path], batch_size=7, resume=True)
+    out, err = capsys.readouterr()
+    assert "nothing to resume; starting over" in out
+    assert "inserted 100 new rows" in out
+
+    connection = db.connect(prepared_db)
+    connection.execute("DELETE FROM customer_device_service")
+    connection.commit()
+    connection.close()
+    sql_load_process.main(prepared_db, [data_path], batch_size=7)
+    assert activations(prepared_db) == resumed
+    assert len(resumed) == 55
+
+
+def test_python_load_resume(prepared_db, tmp_path, capsys):
+    data_path = Path.cwd() / "tests" / "activation_source.csv"
+    target = tmp_path / "load.csv"
+    crash(
+        "checkpoint.advance",
+        f"python_load_process.main({str(prepared_db)!r}, Path({str(target)!r}), "
+        f"[Path({str(data_path)!r})], checkpoint_every=10)",
+    )
+    python_load_process.main(
+        prepared_db, target, [data_path], checkpoint_every=10, resume=True
+    )
+    out, err = capsys.readouterr()
+    assert "resuming" in out
+    assert "Saved 55 rows" in out
+    resumed = target.read_text()
+    assert list(tmp_path.glob("*.checkpoint.db*")) == []
+
+    expected = tmp_path / "expected.csv"
+    python_load_process.main(prepared_db, expected, [data_path])
+    assert resumed == expected.read_text()
+    assert list(tmp_path.glob("*.checkpoint.db*")) == []
+
+
+def test_sql_load_without_checkpoints(prepared_db):
+    data_path = Path.cwd() / "tests" / "activation_source.csv"
+    sql_load_process.main(prepared_db, [data_path], batch_size=7)
+    connection = db.connect(prepared_db)
+    (tables,) = connection.execute(
+        "SELECT count(*) FROM sqlite_schema WHERE name = 'load_checkpoint'"
+    ).fetchone()
+    connection.close()
+    assert tables == 0
@@ -0,0 +1,114 @@
+"""
+Pytest tests of connection_factory
+"""
+import argparse
+from unittest.mock import Mock, sentinel
+import sqlite3 as db
+
+import pytest
+
+import connection_factory
+
+
+def test_regexp():
+    connection = connection_factory.connect(":memory:", "test-memory")
+    (match,) = connection.execute(
+        r"SELECT '2024-07-30' REGEXP '\d{4}-\d\d-\d\d'"
+    ).fetchone()
+    assert match == 1
+    connection.close()
+
+
+def test_bulk_load_profile(tmp_path):
+    connection = connection_factory.connect(tmp_path / "test.db", "bulk-load")
+    (journal_mode,) = connection.execute("PRAGMA journal_mode").fetchone()
+    assert journal_mode == "wal"
+    (busy_timeout,) = connection.execute("PRAGMA busy_timeout").fetchone()
+    assert busy_timeout == 30_000
+    connection.close()
+
+
+def test_read_extract_profile(tmp_path):
+    connection = connection_factory.connect(tmp_path / "test.db", "read-extract")
+    (cache_size,) = connection.execute("PRAGMA cache_size").fetchone()
+    assert cache_size == -131_072
+    with pytest.raises(db.OperationalError):
+        connection.execute("CREATE TABLE t(x)")
+    connection.close()
+
+
+def test_strict_layout_foreign_keys(tmp_path):
+    setup = db.connect(tmp_path / "test.db")
+    setup.execute(
+        "CREATE TABLE customer(customer_id INTEGER PRIMARY KEY, customer_name TEXT) STRICT"
+    )
+    setup.close()
+    connection = connection_factory.connect(tmp_path / "test.db")
+    (foreign_keys,) = connection.execute("PRAGMA foreign_keys").fetchone()
+    assert foreign_keys == 1
+    connection.close()
+
+
+def test_add_profile_option():
+    parser = argparse.ArgumentParser()
+    connection_factory.add_profile_option(parser, "read-extract")
+    assert parser.parse_args([]).profile == "read-extract"
+    assert parser.parse_args(["--profile", "bulk-load"]).profile == "bulk-load"
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--profile", "nope"])
+
+
+def test_retry_busy(capsys):
+    connection = Mock(rollback=Mock())
+    operation = Mock(
+        side_effect=[
+            db.OperationalError("database is locked"),
+            db.OperationalError("database is busy"),
+            sentinel.RESULT,
+        ]
+    )
+    result = connection_factory.retry_busy(connection, operation, delay=0.001)
+    assert result is sentinel.RESULT
+    assert operation.call_count == 3
+    assert connection.rollback.call_count == 2
+
+
+def test_retry_busy_other_error():
+    connection = Mock(rollback=Mock())
+    operation = Mock(side_effect=db.OperationalError("no such table: x"))
+    with pytest.raises(db.OperationalError):
+        connection_factory.retry_busy(connection, operation, delay=0.001)
+    assert operation.call_count == 1
+    connection.rollback.assert_not_called()
+
+
+def test_read_snapshot(tmp_path):
+    writer = connection_factory.connect(tmp_path / "test.db", "bulk-load")
+    writer.execute("CREATE TABLE t(x)")
+    writer.execute("INSERT INTO t VALUES(1)")
+    writer.commit()
+
+    reader = connection_factory.connect(tmp_path / "test.db", "read-extract")
+    with connection_factory.read_snapshot(reader):
+        writer.execute("INSERT INTO t VALUES(2)")
+        writer.commit()
+        (count,) = reader.execute("SELECT count(*) FROM t").fetchone()
+        assert count == 1
+    (count,) = reader.execute("SELECT count(*) FROM t").fetchone()
+    assert count == 2
+    reader.close()
+    writer.close()
+
+
+def test_read_only(tmp_path):
+    writer = connection_factory.connect(tmp_path / "test.db", "bulk-load")
+    writer.execute("CREATE TABLE t(x)")
+    writer.commit()
+    reader = connection_factory.connect(tmp_path / "test.db", read_only=True)
+    with pytest.raises(db.OperationalError, match="readonly"):
+        reader.execute("INSERT INTO t VALUES(1)")
+    reader.close()
+    writer.close()
+    assert connection_factory.read_only_uri("file:x.db?cache=shared") == (
+        "file:x.db?cache=shared&mode=ro"
+    )
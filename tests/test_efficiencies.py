@@ -57,3 +57,176 @@ def test_full_process(db_connection2):
         {'key': sentinel.KEY1, 'this': 2, 'that': 3, 'something': sentinel.VALUE1, 'computed': 7},
         {'key': sentinel.KEY2, 'this': 5, 'that': 7, 'something': sentinel.VALUE2, 'computed': 17}
     ]
+
+def test_ServiceNameMapping_per_instance(db_connection):
+    mapping_1 = efficiencies.ServiceNameMapping(db_connection)
+    mapping_2 = efficiencies.ServiceNameMapping(db_connection)
+    mapping_1[sentinel.THE_KEY]
+    mapping_1[sentinel.THE_KEY]
+    mapping_2[sentinel.THE_KEY]
+    assert db_connection.cursor.return_value.execute.call_count == 2
+    assert mapping_1.cache.stats.hits == 1
+    mapping_1.close()
+    assert len(mapping_1.cache) == 0
+
+SERVICES = [
+    {"service_id": 1, "service_name": "one"},
+    {"service_id": 2, "service_name": "two"},
+    {"service_id": 2, "service_name": "deux"},
+    {"service_id": None, "service_name": "none"},
+]
+
+def activations():
+    return [
+        {"id": 10, "service_id": 1},
+        {"id": 11, "service_id": 2},
+        {"id": 12, "service_id": 3},
+        {"id": 13, "service_id": None},
+    ]
+
+def test_hash_join_inner():
+    stats = efficiencies.JoinStats()
+    rows = list(efficiencies.hash_join(SERVICES, activations(), "service_id", stats=stats))
+    assert rows == [
+        {"id": 10, "service_id": 1, "service_name": "one"},
+        {"id": 11, "service_id": 2, "service_name": "two"},
+        {"id": 11, "service_id": 2, "service_name": "deux"},
+    ]
+    assert (stats.build_rows, stats.build_keys, stats.probe_rows, stats.output_rows) == (4, 2, 4, 3)
+    assert str(stats) == "built 4 rows (2 keys), probed 4 rows, joined 3 rows"
+
+def test_hash_join_left_and_anti():
+    left = list(efficiencies.hash_join(SERVICES, activations(), "service_id", how="left"))
+    assert left[-2:] == [
+        {"id": 12, "service_id": 3, "service_name": None},
+        {"id": 13, "service_id": None, "service_name": None},
+    ]
+    anti = efficiencies.hash_join(SERVICES, activations(), ["service_id"], how="anti")
+    assert [row["id"] for row in anti] == [12, 13]
+    with pytest.raises(ValueError):
+        list(efficiencies.hash_join(SERVICES, activations(), "service_id", how="outer"))
+
+def test_hash_join_multi_column_keys():
+    build = [{"a": 1, "b": "x", "v": "1x"}, {"a": 1, "b": None, "v": "1?"}]
+    probe = [{"k": 1, "l": "x"}, {"k": 1, "l": None}, {"k": 2, "l": "x"}]
+    rows = efficiencies.hash_join(build, probe, ["k", "l"], build_keys=["a", "b"], how="left")
+    assert [row["v"] for row in rows] == ["1x", None, None]
+
+def test_query_rows():
+    connection = efficiencies.db.connect(":memory:")
+    connection.execute("CREATE TABLE service(service_name)")
+    connection.executemany("INSERT INTO service VALUES(?)", [("one",), ("two",)])
+    build = efficiencies.query_rows(connection, "SELECT rowid AS service_id, service_name FROM service")
+    rows = efficiencies.hash_join(build, activations(), "service_id")
+    assert [row["service_name"] for row in rows] == ["one", "two"]
+
+@pytest.mark.parametrize("how", efficiencies.JOINS)
+@pytest.mark.parametrize("memory_rows", [2, 1_000])
+def test_sort_merge_join_matches_hash_join(tmp_path, how, memory_rows):
+    build = [{"service_id": n % 7 or None, "name": f"s{n}"} for n in range(20)]
+    probe = [{"id": n, "service_id": n % 11 or None} for n in range(50)]
+    expected = list(efficiencies.hash_join(build, [dict(row) for row in probe], "service_id", how=how))
+    stats = efficiencies.JoinStats()
+    joined = efficiencies.sort_merge_join(
+        build, probe, "service_id", how=how,
+        memory_rows=memory_rows, directory=tmp_path, stats=stats,
+    )
+    rows = list(joined)
+    order = lambda row: (row["id"], row.get("name") or "")
+    assert sorted(rows, key=order) == sorted(expected, key=order)
+    assert stats.output_rows == len(rows)
+    assert (stats.build_rows, stats.probe_rows) == (20, 50)
+    assert stats.runs == (0 if memory_rows > 50 else 10 + 25)
+    assert list(tmp_path.iterdir()) == []
+
+def test_sort_merge_join_pipeline():
+    build = ({"key": n, "something": -n} for n in range(100))
+    base = ({"key": n // 2, "this": n, "that": 1} for n in range(100))
+    joined = efficiencies.sort_merge_join(build, base, "key", memory_rows=16)
+    computed = efficiencies.compute_something(None, joined)
+    rows = list(computed)
+    assert [row["key"] for row in rows] == sorted(n // 2 for n in range(100))
+    assert rows[-1] == {"key": 49, "this": 99, "that": 1, "something": -49, "computed": 199}
+
+GROUP_ROWS = [
+    {"a": n % 3, "b": n % 2 or None, "x": n if n % 5 else None}
+    for n in range(30)
+]
+AGGREGATES = {
+    "count(*)": ("count", None),
+    "count(x)": ("count", "x"),
+    "sum": ("sum", "x"),
+    "min": ("min", "x"),
+    "max": ("max", "x"),
+    "mean": ("mean", "x"),
+    "distinct": ("count_distinct", "b"),
+}
+
+def expected_groups(keys):
+    connection = efficiencies.db.connect(":memory:")
+    connection.execute("CREATE TABLE t(a, b, x)")
+    connection.executemany("INSERT INTO t VALUES(:a, :b, :x)", GROUP_ROWS)
+    columns = ", ".join(keys)
+    query = (
+        f"SELECT {columns}, count(*), count(x), sum(x), min(x), max(x), "
+        f"avg(x), count(DISTINCT b) FROM t GROUP BY {columns} ORDER BY {columns}"
+    )
+    names = [*keys, *AGGREGATES]
+    return [dict(zip(names, row)) for row in connection.execute(query)]
+
+@pytest.mark.parametrize("keys", [["a"], ["a", "b"]])
+@pytest.mark.parametrize("max_groups", [1, 2, 100])
+def test_group_by_aggregates(tmp_path, keys, max_groups):
+    engine = efficiencies.GroupBy(keys, AGGREGATES, max_groups, tmp_path)
+    engine.add_all(GROUP_ROWS)
+    assert bool(engine.runs) == (max_groups < 3)
+    rows = list(engine.results())
+    order = lambda row: efficiencies.group_order(tuple(row[k] for k in keys))
+    assert sorted(rows, key=order) == expected_groups(keys)
+    assert list(tmp_path.iterdir()) == []
+
+def test_group_by_merge_partials():
+    workers = [efficiencies.GroupBy(["a", "b"], AGGREGATES) for _ in range(3)]
+    for n, row in enumerate(GROUP_ROWS):
+        workers[n % 3].add(row)
+    parent = efficiencies.GroupBy(["a", "b"], AGGREGATES, max_groups=2)
+    for worker in workers:
+        parent.merge(list(worker.partials()))
+    assert list(parent.results()) == expected_groups(["a", "b"])
+
+def test_accumulators():
+    with pytest.raises(TypeError):
+        efficiencies.Accumulator()
+    left, right = efficiencies.Mean(), efficiencies.Mean()
+    for value in (1, None, 2):
+        left.add(value)
+    right.add(6)
+    left.merge(right)
+    assert left.result() == 3
+
+def test_group_by_pipeline():
+    rows = efficiencies.group_by_aggregates(
+        ({"group_id": n % 4} for n in range(10)), "group_id", {"count(*)": ("count", None)}
+    )
+    assert list(rows) == list(efficiencies.group_by(None, ({"group_id": n % 4} for n in range(10))))
+
+def test_batched_lookup():
+    connection = efficiencies.db.connect(":memory:")
+    connection.execute("CREATE TABLE service(service_name)")
+    connection.executemany("INSERT INTO service VALUES(?)", [(f"s{n}",) for n in range(1, 11)])
+    connection.setlimit(efficiencies.db.SQLITE_LIMIT_VARIABLE_NUMBER, 3)
+    lookup = efficiencies.BatchLookup(
+        connection,
+        "SELECT service_name, rowid AS service_id FROM service WHERE rowid IN ({keys})",
+        "service_id",
+    )
+    source = [{"id": n, "service_id": n % 12} for n in range(24)]
+    rows = list(efficiencies.batched_lookup(lookup, source, "service_id", "service", batch_size=12))
+    assert [row["id"] for row in rows] == list(range(24))
+    assert rows[1]["service"] == ("s1", 1)
+    assert rows[0]["service"] is None and rows[11]["service"] is None
+    # 12 distinct keys in the first batch, 3 to a query; the second batch is all hits.
+    assert lookup.queries == 4
+    assert lookup.cache.stats.hits == 12
+    assert lookup[5] == ("s5", 5)
+    lookup.close()
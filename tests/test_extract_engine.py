@@ -0,0 +1,89 @@
+"""
+Pytest integration tests of extract_engine
+"""
+import csv
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import extract_engine
+import python_extract_1
+from test_python_extract_1 import sqlite_import
+import sql_db_preparation
+
+
+@pytest.fixture(scope="module")
+def loaded_db(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("tests") / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    activation_path = here / "tests" / "activation_load.csv"
+    sqlite_import(activation_path, db_path)
+    return db_path
+
+
+@pytest.fixture
+def orphan_db(loaded_db, tmp_path):
+    """A fact row whose service_id has no service row."""
+    db_path = tmp_path / "orphan.db"
+    connection = db.connect(loaded_db)
+    connection.execute("VACUUM INTO ?", (str(db_path),))
+    connection.close()
+    connection = db.connect(db_path)
+    connection.execute(
+        "INSERT INTO customer_device_service(customer_device_id, service_id) "
+        "VALUES(1, 999)"
+    )
+    connection.commit()
+    connection.close()
+    return db_path
+
+
+@pytest.mark.parametrize("strategy", ["sql", "python", "hybrid"])
+def test_strategies_agree(loaded_db, strategy):
+    connection = db.connect(loaded_db)
+    connection.row_factory = db.Row
+    expected = python_extract_1.cst_dev_svc_counts(connection)
+    connection.row_factory = None
+    assert extract_engine.STRATEGIES[strategy](connection) == expected
+    connection.close()
+
+
+@pytest.mark.parametrize("strategy", ["python", "hybrid"])
+def test_orphans_skipped(orphan_db, strategy):
+    connection = db.connect(orphan_db)
+    expected = extract_engine.counts_sql(connection)
+    assert extract_engine.STRATEGIES[strategy](connection) == expected
+    connection.close()
+
+
+def test_choose_strategy():
+    assert extract_engine.choose_strategy(
+        {"service": 100, "customer_device_service": 1_000_000}
+    ) == "hybrid"
+    assert extract_engine.choose_strategy(
+        {"service": 200_000, "customer_device_service": 100_000}
+    ) == "sql"
+    assert extract_engine.choose_strategy(
+        {
+            "service": 100,
+            "customer_device_service": 1_000_000,
+            "service_activation_count": 100,
+        }
+    ) == "materialized"
+
+
+def test_main(loaded_db, tmp_path, capsys):
+    target = tmp_path / "counts.csv"
+    extract_engine.main(str(loaded_db), target)
+    out, err = capsys.readouterr()
+    assert out == (
+        "table sizes {'service': 58, 'customer_device_service': 55}: "
+        "sql strategy\n"
+    )
+    with target.open() as target_file:
+        rows = list(csv.DictReader(target_file))
+    assert len(rows) == 55
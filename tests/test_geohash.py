@@ -0,0 +1,117 @@
+"""
+Pytest tests of geohash
+"""
+import csv
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import connection_factory
+import geohash
+import python_load_process
+import sql_db_preparation
+import sql_load_process
+from test_python_extract_1 import sqlite_import
+
+
+def test_encode_decode():
+    assert geohash.encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    south, west, north, east = geohash.decode("u4pruydqqvj")
+    assert south <= 57.64911 <= north
+    assert west <= 10.40744 <= east
+    assert geohash.encode(57.64911, 10.40744, 5) == "u4pru"
+
+
+def test_neighbours():
+    assert sorted(geohash.neighbours("u4pruyd")) == sorted(
+        ["u4pruy3", "u4pruy6", "u4pruy7", "u4pruy9",
+         "u4pruye", "u4pruyc", "u4pruyf", "u4pruyg"]
+    )
+    # Longitude wraps around at the antimeridian.
+    assert "2" in geohash.neighbours("r")
+    # Nothing beyond the pole.
+    assert len(geohash.neighbours("b")) == 5
+
+
+def test_geohash_sql():
+    connection = connection_factory.connect(":memory:")
+    (value, missing) = connection.execute(
+        "SELECT geohash(57.64911, 10.40744, 5), geohash(NULL, 1, 5)"
+    ).fetchone()
+    assert (value, missing) == ("u4pru", None)
+    connection.close()
+
+
+@pytest.fixture
+def loaded_db(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    sqlite_import(here / "tests" / "activation_load.csv", db_path)
+    return db_path
+
+
+def test_add_geohash_column(loaded_db, capsys):
+    connection = connection_factory.connect(loaded_db)
+    geohash.add_geohash_column(connection, 7)
+    geohash.add_geohash_column(connection, 7)
+    out, err = capsys.readouterr()
+    assert out.endswith("computed 55 geohash values\ncomputed 0 geohash values\n")
+
+    counts = geohash.cell_counts(connection, 3)
+    assert sum(count for cell, count in counts) == 55
+    assert all(len(cell) == 3 for cell, count in counts)
+
+    near = geohash.near_counts(connection, 0.5, -0.5, 3)
+    assert len(near) == 9
+    assert sum(near.values()) == sum(
+        count for cell, count in counts if cell in near
+    )
+    plan = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT count(*) FROM customer_device_service "
+        "WHERE geohash >= 'ebz' AND geohash < 'ebz' || '~'"
+    ).fetchall()
+    assert "customer_device_service_geohash_ix" in plan[0][-1]
+    connection.close()
+
+
+def test_sql_load_geohash(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    sql_load_process.main(db_path, [data_path], geohash_precision=6)
+    connection = db.connect(db_path)
+    rows = connection.execute(
+        "SELECT latitude, longitude, geohash FROM customer_device_service"
+    ).fetchall()
+    assert len(rows) == 55
+    assert all(
+        hash == geohash.encode(lat, lon, 6) for lat, lon, hash in rows
+    )
+    connection.close()
+
+
+def test_python_load_geohash(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    target = tmp_path / "activation_load.csv"
+    python_load_process.main(
+        str(db_path), target, [data_path], geohash_precision=6
+    )
+    with target.open() as target_file:
+        rows = list(csv.DictReader(target_file))
+    assert len(rows) == 55
+    assert list(rows[0]) == python_load_process.GEOHASH_FIELDNAMES
+    assert all(
+        row["geohash"]
+        == geohash.encode(float(row["latitude"]), float(row["longitude"]), 6)
+        for row in rows
+    )
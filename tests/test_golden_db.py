@@ -0,0 +1,81 @@
+"""
+Pytest integration tests of golden_db
+"""
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import golden_db
+
+
+@pytest.fixture()
+def paths():
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    return schema_path, data_path
+
+
+def test_golden_key(paths, tmp_path):
+    schema_path, data_path = paths
+    key_1 = golden_db.golden_key(schema_path, [data_path])
+    assert key_1 == golden_db.golden_key(schema_path, [data_path])
+    assert key_1 != golden_db.golden_key(schema_path, [data_path], "strict")
+    assert key_1 != golden_db.golden_key(schema_path, [])
+
+    changed = tmp_path / "changed.csv"
+    changed.write_bytes(data_path.read_bytes() + b"\n")
+    assert key_1 != golden_db.golden_key(schema_path, [changed])
+
+
+def test_golden_key_modules(paths, monkeypatch, tmp_path):
+    schema_path, data_path = paths
+    names = [path.name for path in golden_db.build_modules()]
+    assert "sql_db_preparation.py" in names
+    assert "connection_factory.py" in names
+
+    key_1 = golden_db.golden_key(schema_path, [data_path])
+    changed = tmp_path / "connection_factory.py"
+    changed.write_text("# changed profiles\n")
+    modules = golden_db.build_modules()
+    monkeypatch.setattr(
+        golden_db,
+        "build_modules",
+        lambda: [
+            changed if path.name == changed.name else path
+            for path in modules
+        ],
+    )
+    assert key_1 != golden_db.golden_key(schema_path, [data_path])
+
+
+def test_build_golden_once(paths, tmp_path, capsys):
+    schema_path, data_path = paths
+    golden_1 = golden_db.build_golden(tmp_path, schema_path, [data_path])
+    out, err = capsys.readouterr()
+    assert "inserted 58 customer rows" in out
+
+    golden_2 = golden_db.build_golden(tmp_path, schema_path, [data_path])
+    out, err = capsys.readouterr()
+    assert golden_2 == golden_1
+    assert out == ""
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_clone(paths, tmp_path):
+    schema_path, data_path = paths
+    golden = golden_db.build_golden(tmp_path, schema_path, [data_path])
+
+    memory = golden_db.clone(golden, ":memory:")
+    (count,) = memory.execute("SELECT count(*) FROM service").fetchone()
+    assert count == 58
+    memory.execute("DELETE FROM service")
+    memory.close()
+
+    target = tmp_path / "clone.db"
+    golden_db.copy(golden, target)
+    connection = db.connect(target)
+    (count,) = connection.execute("SELECT count(*) FROM service").fetchone()
+    assert count == 58
+    connection.close()
@@ -0,0 +1,140 @@
+"""
+Pytest integration tests of instrumentation
+"""
+import json
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import connection_factory
+import extract_engine
+import instrumentation
+import python_extract_1
+import sql_db_preparation
+from test_python_extract_1 import sqlite_import
+
+
+@pytest.fixture(scope="module")
+def loaded_db(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("tests") / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    activation_path = here / "tests" / "activation_load.csv"
+    sqlite_import(activation_path, db_path)
+    return db_path
+
+
+def test_plain_connection(loaded_db):
+    connection = connection_factory.connect(loaded_db)
+    assert type(connection) is db.Connection
+    instrumentation.write_report(connection)
+
+
+def test_statements(loaded_db):
+    settings = instrumentation.Settings(explain=True, big_table_rows=50)
+    connection = connection_factory.connect(
+        loaded_db, instrument=settings
+    )
+    connection.row_factory = db.Row
+    counts = python_extract_1.cst_dev_svc_counts(connection)
+    connection.execute("SELECT count(*) FROM service").fetchone()
+    connection.execute("SELECT count(*) FROM service").fetchone()
+
+    statements = list(connection.statements.values())
+    assert "PRAGMA" not in " ".join(s.sql for s in statements)
+    services, scan, count = statements
+    assert services.rows == 58 and services.full_scans == ["service (58 rows)"]
+    assert scan.calls == 1 and scan.rows == sum(counts.values()) == 55
+    assert scan.plan == ["SCAN customer_device_service"]
+    assert scan.full_scans == ["customer_device_service (55 rows)"]
+    assert count.calls == 2 and count.rows == 2
+    assert count.plan == ["SCAN service"]
+
+
+def test_executemany_explained():
+    settings = instrumentation.Settings(explain=True)
+    connection = connection_factory.connect(":memory:", instrument=settings)
+    connection.execute("CREATE TABLE t(a INTEGER PRIMARY KEY, b)")
+    connection.executemany(
+        "INSERT INTO t(a, b) VALUES(:a, :b)",
+        ({"a": n, "b": str(n)} for n in range(5)),
+    )
+    connection.executemany("UPDATE t SET b = :b WHERE a = :a", [])
+    connection.executemany(
+        "UPDATE t SET b = ? WHERE a = ?", [("x", 1), ("y", 2)]
+    )
+    insert, empty, update = list(connection.statements.values())[1:]
+    assert insert.calls == 1 and insert.rows == 5
+    assert insert.plan == []
+    assert empty.calls == 1 and empty.plan is None
+    assert update.rows == 2
+    assert update.plan == ["SEARCH t USING INTEGER PRIMARY KEY (rowid=?)"]
+    assert connection.execute("SELECT count(*) FROM t").fetchone() == (5,)
+
+
+def test_reports(loaded_db):
+    settings = instrumentation.Settings(
+        explain=True, slow_ms=0, big_table_rows=50, report_format="json"
+    )
+    connection = connection_factory.connect(
+        loaded_db, instrument=settings
+    )
+    extract_engine.counts_hybrid(connection)
+    statements = json.loads(instrumentation.report(connection))
+    [statement] = [s for s in statements if "GROUP BY" in s["sql"]]
+    assert statement["calls"] == 1
+    assert statement["flags"] == [
+        "slow", "full scan of customer_device_service (55 rows)"
+    ]
+    settings.report_format = "text"
+    text = instrumentation.report(connection)
+    assert "    ** slow\n" in text
+    assert "    ** full scan of customer_device_service (55 rows)\n" in text
+    assert "    USE TEMP B-TREE FOR GROUP BY\n" in text
+
+
+def test_not_explained(loaded_db):
+    settings = instrumentation.Settings(explain=True)
+    connection = connection_factory.connect(
+        loaded_db, instrument=settings
+    )
+    with pytest.raises(db.OperationalError):
+        connection.execute("SELECT * FROM no_such_table")
+    [statement] = connection.statements.values()
+    assert statement.plan[0].startswith("not explained:")
+    assert statement.calls == 1
+
+
+def test_main_options(loaded_db, tmp_path, capsys):
+    options = extract_engine.get_options(
+        ["--instrument", "json", "--explain", "--slow-ms", "5000",
+         "--instrument-output", str(tmp_path / "plans.json")]
+    )
+    settings = instrumentation.settings_from(options)
+    extract_engine.main(
+        str(loaded_db), tmp_path / "counts.csv", instrument=settings
+    )
+    out, err = capsys.readouterr()
+    assert out.endswith(f"wrote statement report to {tmp_path / 'plans.json'}\n")
+    report = json.loads((tmp_path / "plans.json").read_text())
+    assert any(s["plan"] for s in report)
+    assert instrumentation.settings_from(extract_engine.get_options([])) is None
+
+
+def test_merge(loaded_db):
+    settings = instrumentation.Settings()
+    connection = connection_factory.connect(loaded_db, instrument=settings)
+    worker = connection_factory.connect(loaded_db, instrument=settings)
+    connection.execute("SELECT count(*) FROM service").fetchone()
+    worker.execute("SELECT count(*) FROM service").fetchone()
+    worker.execute("SELECT * FROM customer").fetchall()
+    instrumentation.merge(connection, worker)
+    instrumentation.merge(connection, db.connect(":memory:"))
+    calls = {s.sql: (s.calls, s.rows) for s in connection.statements.values()}
+    assert calls["SELECT count(*) FROM service"] == (2, 2)
+    assert calls["SELECT * FROM customer"][0] == 1
+    worker.close()
+    connection.close()
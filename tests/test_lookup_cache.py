@@ -0,0 +1,146 @@
+"""
+Pytest unit tests of lookup_cache
+"""
+import sqlite3 as db
+from unittest.mock import Mock
+
+import pytest
+
+from lookup_cache import LookupCache
+import python_extract_2
+
+
+def test_lru():
+    loader = Mock(side_effect=lambda key: key * 2)
+    cache = LookupCache(loader, maxsize=2)
+    assert [cache[k] for k in (1, 2, 1, 3, 1, 2)] == [2, 4, 2, 6, 2, 4]
+    # 3 evicted 2 (least recently used); then 2 evicted 3.
+    assert [c.args[0] for c in loader.mock_calls] == [1, 2, 3, 2]
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 4, 2)
+    assert cache.stats.hit_ratio == pytest.approx(2 / 6)
+
+
+def test_lfu():
+    loader = Mock(side_effect=lambda key: key * 2)
+    cache = LookupCache(loader, maxsize=2, policy="lfu")
+    for k in (1, 1, 1, 2, 3, 2):
+        cache[k]
+    # 3 evicted 2 (used once, vs. 3 times); then 2 evicted 3.
+    assert [c.args[0] for c in loader.mock_calls] == [1, 2, 3, 2]
+    assert 1 in cache and 2 in cache and 3 not in cache
+
+
+def test_unbounded_and_prefetch():
+    loader = Mock(return_value=None)
+    cache = LookupCache(loader, maxsize=1, policy="unbounded")
+    cache.prefetch((k, str(k)) for k in range(10))
+    assert len(cache) == 10
+    assert cache[7] == "7"
+    assert cache[99] is None
+    assert cache[99] is None
+    loader.assert_called_once_with(99)
+    assert str(cache.stats) == "2 hits, 1 misses, 0 evictions, 66.7% hit ratio"
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_lfu_ties_and_clear():
+    loader = Mock(side_effect=lambda key: key * 2)
+    cache = LookupCache(loader, maxsize=3, policy="lfu")
+    for k in (1, 2, 3, 3, 2, 4):
+        cache[k]
+    # 1, 2, and 3 were tied until 3 and 2 were used again; 4 evicted 1.
+    assert 1 not in cache and {2, 3, 4} <= set(cache.values)
+    cache[5]  # 4 is the only key used once.
+    assert 4 not in cache
+    assert cache.uses == {2: 2, 3: 2, 5: 1}
+    cache.clear()
+    assert (cache.uses, cache.by_uses) == ({}, {})
+    cache[6]
+    assert len(cache) == 1
+
+
+@pytest.mark.parametrize("policy", ["lru", "lfu"])
+def test_maxsize_zero(policy):
+    loader = Mock(side_effect=lambda key: key * 2)
+    cache = LookupCache(loader, maxsize=0, policy=policy)
+    assert [cache[k] for k in (1, 1)] == [2, 2]
+    assert loader.call_count == 2
+    assert len(cache) == 0
+    assert str(cache.stats) == "0 hits, 2 misses, 0 evictions, 0.0% hit ratio"
+
+
+def test_bounded_prefetch():
+    loader = Mock(return_value=None)
+    cache = LookupCache(loader, maxsize=2)
+    cache.prefetch((k, str(k)) for k in range(10))
+    assert (len(cache), cache.maxsize, cache.stats.evictions) == (10, 10, 0)
+    assert cache[0] == "0"
+    loader.assert_not_called()
+
+
+def test_bad_policy():
+    with pytest.raises(ValueError):
+        LookupCache(Mock(), policy="random")
+
+
+def test_service_name_mapping_instances():
+    connection = db.connect(":memory:")
+    connection.execute("CREATE TABLE service(service_name)")
+    connection.executemany(
+        "INSERT INTO service VALUES(?)", [("a",), ("b",)]
+    )
+    mapping_1 = python_extract_2.ServiceNameMapping(connection)
+    mapping_2 = python_extract_2.ServiceNameMapping(connection, prefetch=True)
+    assert mapping_1[1] == (1, "a")
+    assert mapping_2[2] == (2, "b")
+    assert mapping_2[1] == mapping_1.fetch(1)
+    assert mapping_1.cache.stats.misses == 1
+    assert mapping_2.cache.stats.misses == 0
+    with pytest.raises(ValueError):
+        mapping_1[3]
+    assert mapping_1.get(3, "unknown") == "unknown"
+    mapping_1.close()
+    assert len(mapping_1.cache) == 0
+    assert len(mapping_2.cache) == 2
+    connection.close()
+
+
+def test_get_many():
+    cache = LookupCache(Mock(), maxsize=2)
+    loader = Mock(side_effect=lambda keys: {k: k * 10 for k in keys if k != 3})
+    assert cache.get_many([1, 2, 1, 3], loader) == {1: 10, 2: 20, 3: None}
+    loader.assert_called_once_with([1, 2, 3])
+    assert cache.get_many([3, 4], loader) == {3: None, 4: 40}
+    loader.assert_called_with([4])
+    assert str(cache.stats) == "1 hits, 4 misses, 2 evictions, 20.0% hit ratio"
+    cache.loader.assert_not_called()
+
+
+def test_cst_dev_svc_counts_options(capsys):
+    connection = db.connect(":memory:")
+    connection.row_factory = db.Row
+    connection.execute("CREATE TABLE service(service_name)")
+    connection.execute("CREATE TABLE customer_device_service(service_id)")
+    connection.executemany(
+        "INSERT INTO service VALUES(?)", [("a",), ("b",), ("c",)]
+    )
+    connection.executemany(
+        "INSERT INTO customer_device_service VALUES(?)",
+        [(1,), (2,), (1,), (3,), (1,)],
+    )
+    counts = python_extract_2.cst_dev_svc_counts(
+        connection, maxsize=2, policy="lfu"
+    )
+    assert counts == {"a": 3, "b": 1, "c": 1}
+    out, err = capsys.readouterr()
+    assert "2 hits, 3 misses, 1 evictions" in out
+    counts = python_extract_2.cst_dev_svc_counts(connection, prefetch=True)
+    assert counts == {"a": 3, "b": 1, "c": 1}
+    out, err = capsys.readouterr()
+    assert "5 hits, 0 misses" in out
+    counts = python_extract_2.cst_dev_svc_counts(connection, maxsize=0)
+    assert counts == {"a": 3, "b": 1, "c": 1}
+    out, err = capsys.readouterr()
+    assert "0 hits, 5 misses, 0 evictions" in out
+    connection.close()
@@ -0,0 +1,75 @@
+"""
+Pytest integration tests of parallel_extract
+"""
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import extract_engine
+import parallel_extract
+import python_extract_1
+import sql_db_preparation
+from test_python_extract_1 import sqlite_import
+
+
+@pytest.fixture(scope="module")
+def loaded_db(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("tests") / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    activation_path = here / "tests" / "activation_load.csv"
+    sqlite_import(activation_path, db_path)
+    return db_path
+
+
+@pytest.fixture
+def orphan_db(loaded_db, tmp_path):
+    """A fact row whose service_id has no service row."""
+    db_path = tmp_path / "orphan.db"
+    connection = db.connect(loaded_db)
+    connection.execute("VACUUM INTO ?", (str(db_path),))
+    connection.close()
+    connection = db.connect(db_path)
+    connection.execute(
+        "INSERT INTO customer_device_service(customer_device_id, service_id) "
+        "VALUES(1, 999)"
+    )
+    connection.commit()
+    connection.close()
+    return db_path
+
+
+def test_rowid_ranges(loaded_db):
+    connection = db.connect(loaded_db)
+    assert parallel_extract.rowid_ranges(connection, 4) == [
+        (1, 14), (15, 28), (29, 42), (43, 55)
+    ]
+    assert parallel_extract.rowid_ranges(connection, 100)[-1] == (55, 55)
+    connection.close()
+
+
+def test_count_range(loaded_db):
+    counts = parallel_extract.count_range(loaded_db, 0, (1, 10))
+    assert sum(counts.values()) == 10
+
+
+@pytest.mark.parametrize("workers, partitions", [(1, None), (2, None), (2, 7)])
+def test_parallel_counts(loaded_db, workers, partitions, capsys):
+    connection = db.connect(loaded_db)
+    connection.row_factory = db.Row
+    expected = python_extract_1.cst_dev_svc_counts(connection)
+    connection.close()
+    counts = parallel_extract.parallel_counts(loaded_db, workers, partitions)
+    assert counts == expected
+    out, err = capsys.readouterr()
+    assert f"ranges from {workers} workers" in out
+
+
+def test_parallel_counts_orphans(orphan_db):
+    connection = db.connect(orphan_db)
+    expected = extract_engine.counts_sql(connection)
+    connection.close()
+    assert parallel_extract.parallel_counts(orphan_db, 2) == expected
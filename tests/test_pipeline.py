@@ -0,0 +1,159 @@
+"""
+Tests for the stage-composable pipeline.
+"""
+from itertools import islice
+import threading
+
+import pytest
+
+import pipeline
+
+
+def doubled(rows):
+    for row in rows:
+        yield row * 2
+
+
+def odd(rows):
+    for row in rows:
+        if row % 2:
+            yield row
+
+
+def negative_or_none(row):
+    return -row if row % 3 else None
+
+
+def test_pipeline_stats():
+    p = pipeline.Pipeline(
+        pipeline.Stage("source", lambda rows: iter(range(100))),
+        pipeline.Stage("odd", odd),
+        pipeline.Stage("doubled", doubled),
+    )
+    assert list(p.run()) == [n * 2 for n in range(1, 100, 2)]
+    assert [(s.name, s.rows_in, s.rows_out) for s in p.stats] == [
+        ("source", 0, 100),
+        ("odd", 100, 50),
+        ("doubled", 50, 50),
+    ]
+    assert all(s.seconds >= 0 for s in p.stats)
+    assert p.report().splitlines()[1].startswith(
+        "odd: 100 rows in, 50 rows out, "
+    )
+
+
+def test_pipeline_stats_accumulate():
+    first = pipeline.Pipeline(pipeline.Stage("odd", odd))
+    stats = first.drain(range(10))
+    second = pipeline.Pipeline(pipeline.Stage("odd", odd), stats=stats)
+    second.drain(range(10))
+    assert (stats[0].rows_in, stats[0].rows_out) == (20, 10)
+    with pytest.raises(ValueError):
+        pipeline.Pipeline(pipeline.Stage("even", odd), stats=stats)
+
+
+def test_threaded_stage():
+    names = []
+
+    def thread_names(rows):
+        for row in rows:
+            names.append(threading.current_thread().name)
+            yield row
+
+    p = pipeline.Pipeline(
+        pipeline.Stage("odd", odd),
+        pipeline.Stage(
+            "named", thread_names, threaded=True,
+            queue_batches=2, batch_size=10,
+        ),
+        pipeline.Stage("doubled", doubled),
+    )
+    assert list(p.run(range(1000))) == [n * 2 for n in range(1, 1000, 2)]
+    assert p.stats[1].rows_in == 500
+    assert threading.current_thread().name not in set(names)
+
+
+def test_threaded_stage_stops_early():
+    p = pipeline.Pipeline(
+        pipeline.Stage("doubled", doubled, threaded=True, batch_size=10)
+    )
+    rows = p.run(range(1_000_000))
+    assert list(islice(rows, 5)) == [0, 2, 4, 6, 8]
+    rows.close()
+    assert p.stats[0].rows_in < 1_000_000
+
+
+def test_threaded_stage_error():
+    def failing(rows):
+        yield from rows
+        raise RuntimeError("failed")
+
+    p = pipeline.Pipeline(pipeline.Stage("failing", failing, threaded=True))
+    with pytest.raises(RuntimeError):
+        list(p.run(range(10)))
+
+
+def test_map_stage():
+    p = pipeline.Pipeline(
+        pipeline.map_stage("negative", negative_or_none, workers=2, chunksize=7)
+    )
+    expected = [-n for n in range(100) if n % 3]
+    assert list(p.run(range(100))) == expected
+    assert (p.stats[0].rows_in, p.stats[0].rows_out) == (100, 66)
+
+
+def squares(batches):
+    for batch in batches:
+        yield [n * n for n in batch]
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_parallel(ordered):
+    batches = list(
+        pipeline.parallel(
+            squares, range(1000), workers=3, ordered=ordered,
+            batch_size=10, max_batches=4,
+        )
+    )
+    assert all(len(batch) == 10 for batch in batches)
+    rows = [n for batch in batches for n in batch]
+    if ordered:
+        assert rows == [n * n for n in range(1000)]
+    else:
+        assert sorted(rows) == [n * n for n in range(1000)]
+
+
+def test_parallel_setup_and_cleanup():
+    cleaned = []
+
+    def work(batches):
+        seen = 0
+        try:
+            for batch in batches:
+                seen += len(batch)
+                yield batch
+        finally:
+            cleaned.append(seen)
+
+    rows = list(pipeline.parallel(work, range(95), workers=2, batch_size=10))
+    assert len(rows) == 10
+    assert len(cleaned) == 2 and sum(cleaned) == 95
+
+
+def test_parallel_error():
+    def failing(batches):
+        for batch in batches:
+            if 50 in batch:
+                raise RuntimeError("failed")
+            yield batch
+
+    with pytest.raises(RuntimeError):
+        list(pipeline.parallel(failing, range(100), workers=2, batch_size=10))
+
+
+def test_parallel_stops_early():
+    batches = pipeline.parallel(
+        squares, range(1_000_000), workers=2, batch_size=10
+    )
+    assert next(batches) == [n * n for n in range(10)]
+    batches.close()
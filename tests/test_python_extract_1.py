@@ -64,3 +64,12 @@ def test_cst_dev_svc_counts(loaded_db):
     assert len(counts) == 55
     assert counts['Oxkxwnqrsrpemok'] == 1
     assert counts['Woddwpjsiyg'] == 1
+
+
+def test_cst_dev_svc_counts_arraysize(loaded_db):
+    connection = db.connect(loaded_db)
+    connection.row_factory = db.Row
+    counts_1 = python_extract_1.cst_dev_svc_counts(connection, arraysize=1)
+    counts_1000 = python_extract_1.cst_dev_svc_counts(connection)
+    assert counts_1 == counts_1000
+    assert sum(counts_1.values()) == 55
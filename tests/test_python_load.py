@@ -53,9 +53,8 @@ bad_refererences_expected = [
     # etc.
 ]
 
-@pytest.fixture()
-def mock_connection():
-    """Stateful fixture. The cursor execute() bind variables defines the result value."""
+def make_mock_connection():
+    """Stateful mock. The cursor execute() bind variables defines the result value."""
     query_result = None
 
     def make_result(query, bind_vars):
@@ -80,12 +79,17 @@ def mock_connection():
         cursor=Mock(return_value=mock_no_data_cursor),
     )
 
+@pytest.fixture()
+def mock_connection():
+    return make_mock_connection()
+
 @pytest.mark.parametrize(
     "row_value, return_value, count_key",
     bad_refererences_expected)
 def test_bad_references(row_value, return_value, count_key, mock_connection):
     counts = Counter()
-    assert python_load_process.bad_references(counts, mock_connection, row_value) == return_value
+    references = python_load_process.References(mock_connection)
+    assert python_load_process.bad_references(counts, references, row_value) == return_value
     assert dict(counts) == {count_key: 1}
 
 
@@ -140,7 +144,8 @@ def test_transform_data_dcp():
 def test_persist_data_dict(mock_connection):
     counts = Counter()
     t = python_load_process.transform_data_dict(counts, mock_row())
-    p = python_load_process.persist_data_dict(counts, mock_connection, t)
+    references = python_load_process.References(mock_connection)
+    p = python_load_process.persist_data_dict(counts, references, t)
     assert p['customer_device_id'] == 'mock_row'
     assert p['service_id'] == 'mock_row'
     assert p['start_date'] == datetime.datetime(2022, 7, 10, 11, 12, 13, tzinfo=datetime.timezone.utc)
@@ -176,9 +181,11 @@ def test_fetch_customer_good(mock_good_rowid_cursor):
     mock_conn.cursor.commit.assert_not_called()
 
     # Cache Behavior: no second cursor operation.
-    row = python_load_process.fetch_customer_id(mock_conn, 'mock_name')
-    assert row == "mock_row_id"
-    mock_conn.cursor.assert_called_once()
+    references = python_load_process.References(mock_conn)
+    assert references.customer_id('mock_name') == "mock_row_id"
+    assert references.customer_id('mock_name') == "mock_row_id"
+    assert mock_conn.cursor.call_count == 2
+    assert references.customers.stats.hits == 1
 
 
 def test_fetch_service_good(mock_good_rowid_cursor):
@@ -198,9 +205,11 @@ def test_fetch_service_good(mock_good_rowid_cursor):
     mock_conn.cursor.commit.assert_not_called()
 
     # Cache Behavior: no second cursor operation.
-    row = python_load_process.fetch_service_id(mock_conn, 'mock_name')
-    assert row == "mock_row_id"
-    mock_conn.cursor.assert_called_once()
+    references = python_load_process.References(mock_conn)
+    assert references.service_id('mock_name') == "mock_row_id"
+    assert references.service_id('mock_name') == "mock_row_id"
+    assert mock_conn.cursor.call_count == 2
+    assert references.services.stats.hits == 1
 
 
 def test_fetch_customer_device_good(mock_good_rowid_cursor):
@@ -220,9 +229,13 @@ def test_fetch_customer_device_good(mock_good_rowid_cursor):
     mock_conn.cursor.commit.assert_not_called()
 
     # Cache Behavior: no second cursor operation.
-    row = python_load_process.fetch_customer_device_id(mock_conn, 'mock_name', 'mock_device')
-    assert row == "mock_row_id"
-    mock_conn.cursor.assert_called_once()
+    references = python_load_process.References(mock_conn)
+    assert references.customer_device_id('mock_name', 'mock_device') == "mock_row_id"
+    assert references.customer_device_id('mock_name', 'mock_device') == "mock_row_id"
+    assert mock_conn.cursor.call_count == 2
+    assert references.customer_devices.stats.hits == 1
+    references.close()
+    assert len(references.customer_devices) == 0
 
 
 ### Integration Test -- using database.
@@ -263,3 +276,48 @@ def test_fetch_service_id(test_db_conn_schema):
     assert row_id == 42
     failure = python_load_process.fetch_service_id(test_db_conn_schema, 'not a mock_service')
     assert failure is None
+
+def test_transform_data_dict_geohash():
+    counts = Counter()
+    t = python_load_process.transform_data_dict(counts, mock_row(), geohash_precision=7)
+    assert t['geohash'] == 'dnm34h1'
+    assert python_load_process.Activation(**mock_row(), geohash_precision=7).geohash == 'dnm34h1'
+    assert python_load_process.Activation(**mock_row()).geohash is None
+
+def lookups(out):
+    """Total hits and misses of each lookup report in the output."""
+    return [
+        sum(int(n) for n in line.split(": ")[1].split()[:4:2])
+        for line in out.splitlines()
+        if line.startswith("customer lookups:")
+    ]
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_threaded_activation_loader(mock_connection, ordered, capsys):
+    source = [
+        mock_row(customer_name=f"mock customer {n}") if n % 7 else mock_row(customer_name="")
+        for n in range(250)
+    ]
+    sequential = Mock()
+    counts = Counter()
+    python_load_process.activation_loader(
+        counts, mock_connection, [dict(row) for row in source], sequential
+    )
+    threaded = Mock()
+    threaded_counts = Counter()
+    stats = python_load_process.threaded_activation_loader(
+        threaded_counts, mock_connection, [dict(row) for row in source], threaded,
+        connect=make_mock_connection, workers=3, ordered=ordered, batch_size=20,
+    )
+    assert threaded_counts == counts
+    sequential_lookups, threaded_lookups = lookups(capsys.readouterr().out)
+    assert sequential_lookups == threaded_lookups == counts["valid"]
+    assert [s.name for s in stats] == ["validate", "references", "transform", "persist", "write"]
+    assert stats[0].rows_in == 250
+    assert stats[-1].rows_out == counts["saved"]
+    expected = sequential.writerow.mock_calls
+    actual = threaded.writerow.mock_calls
+    if ordered:
+        assert actual == expected
+    else:
+        assert len(actual) == len(expected)
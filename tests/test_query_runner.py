@@ -0,0 +1,92 @@
+"""
+Pytest integration tests of query_runner
+"""
+import csv
+import io
+import json
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import query_runner
+import result_cache
+import sql_db_preparation
+import sql_extract_process
+
+
+@pytest.fixture(scope="module")
+def loaded_db(tmp_path_factory):
+    db_path = tmp_path_factory.mktemp("tests") / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    return db_path
+
+
+def test_register():
+    sql = query_runner.register("test_register", "  SELECT 1\n")
+    assert sql == "SELECT 1\n"
+    query_runner.register("test_register", "SELECT 1\n")
+    with pytest.raises(ValueError):
+        query_runner.register("test_register", "SELECT 2")
+
+
+def test_callable_sink(loaded_db):
+    connection = db.connect(loaded_db)
+    seen = []
+
+    def sink(columns, rows):
+        seen.append(columns)
+        seen.extend(rows)
+
+    stats = query_runner.run(connection, "query_2", sink, batch_size=7)
+    assert seen[0] == ["customer_name"]
+    assert len(seen) == 117
+    assert all(type(row) is tuple for row in seen[1:])
+    assert stats.rows == 116
+    assert 0 <= stats.first_row_seconds <= stats.seconds
+    assert "query_2: 116 rows" in str(stats)
+
+
+def test_csv_and_jsonl_sinks(loaded_db):
+    connection = db.connect(loaded_db)
+    target = io.StringIO()
+    query_runner.run(
+        connection, "query_group_by_having", query_runner.csv_sink(target)
+    )
+    assert list(csv.reader(io.StringIO(target.getvalue()))) == [
+        ["device_type_name", "count(*)"], ["F", "2"]
+    ]
+    target = io.StringIO()
+    query_runner.run(
+        connection, "query_group_by_having", query_runner.jsonl_sink(target)
+    )
+    assert [json.loads(line) for line in target.getvalue().splitlines()] == [
+        {"device_type_name": "F", "count(*)": 2}
+    ]
+
+
+def test_cached_run(loaded_db):
+    connection = db.connect(loaded_db)
+    cache = result_cache.ResultCache(connection)
+    rows = []
+    for _ in range(2):
+        stats = query_runner.run(
+            connection, "query_group_by", lambda c, r: rows.extend(r), cache=cache
+        )
+        assert stats.rows == 57
+    assert cache.stats.hits == 1
+    assert rows[:57] == rows[57:]
+
+
+def test_extract_main_files(loaded_db, tmp_path, capsys):
+    sql_extract_process.main(
+        loaded_db, output_format="jsonl", output_dir=tmp_path
+    )
+    out, err = capsys.readouterr()
+    assert len(out.splitlines()) == 5
+    assert "query_group_by_having: 1 rows" in out
+    lines = (tmp_path / "query_1.jsonl").read_text().splitlines()
+    assert len(lines) == 58
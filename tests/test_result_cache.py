@@ -0,0 +1,104 @@
+"""
+Pytest integration tests of result_cache
+"""
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import result_cache
+import sql_db_preparation
+import sql_extract_process
+
+
+@pytest.fixture
+def loaded_db(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    return db_path
+
+
+COUNT = "SELECT count(*) AS n FROM customer WHERE 1 = ?"
+
+
+def test_normalize_and_params():
+    assert result_cache.normalize_sql("SELECT\n    1\n") == "SELECT 1"
+    assert result_cache.freeze([1]) != result_cache.freeze({"1": 1})
+    assert result_cache.thaw(result_cache.freeze({"a": 1})) == {"a": 1}
+
+
+def test_memory_hits(loaded_db):
+    connection = db.connect(loaded_db)
+    cache = result_cache.ResultCache(connection)
+    first = cache.fetchall(COUNT, [1])
+    assert cache.fetchall("SELECT count(*) AS n\nFROM customer\nWHERE 1 = ?", [1]) == first
+    assert cache.stats.hits == 1 and cache.stats.misses == 1
+    cache.fetchall(COUNT, [2])
+    assert cache.stats.misses == 2
+
+
+def test_commits_invalidate(loaded_db):
+    connection = db.connect(loaded_db)
+    cache = result_cache.ResultCache(connection)
+    [(before,)] = [tuple(row.values()) for row in cache.fetchall(COUNT, [1])]
+
+    other = db.connect(loaded_db)
+    other.execute("DELETE FROM customer WHERE rowid = 1")
+    other.commit()
+    other.close()
+    assert cache.fetchall(COUNT, [1]) == [{"n": before - 1}]
+
+    connection.execute("DELETE FROM customer WHERE rowid = 2")
+    connection.commit()
+    assert cache.fetchall(COUNT, [1]) == [{"n": before - 2}]
+    assert cache.stats.hits == 0
+
+
+def test_cache_file(loaded_db, tmp_path):
+    cache_path = tmp_path / "cache.db"
+    connection = db.connect(loaded_db)
+    cache = result_cache.ResultCache(connection, path=cache_path)
+    with cache.snapshot():
+        expected = cache.fetchall(COUNT, [1])
+    cache.close()
+    connection.close()
+
+    # A new connection finds it in the cache file, not the database.
+    connection = db.connect(loaded_db)
+    cache = result_cache.ResultCache(connection, path=cache_path)
+    cache.query = None
+    with cache.snapshot():
+        assert cache.fetchall(COUNT, [1]) == expected
+    cache.close()
+
+    connection.execute("DELETE FROM customer WHERE rowid = 1")
+    connection.commit()
+    cache = result_cache.ResultCache(connection, path=cache_path)
+    with cache.snapshot():
+        assert cache.fetchall(COUNT, [1]) == [{"n": expected[0]["n"] - 1}]
+    cache.close()
+
+
+def test_unpinned_transaction_skips_file(loaded_db, tmp_path):
+    connection = db.connect(loaded_db)
+    cache = result_cache.ResultCache(connection, path=tmp_path / "c.db")
+    connection.execute("DELETE FROM customer WHERE rowid = 1")
+    assert connection.in_transaction
+    cache.fetchall(COUNT, [1])
+    (saved,) = cache.disk.execute("SELECT count(*) FROM result").fetchone()
+    assert saved == 0
+
+
+def test_extract_main(loaded_db, tmp_path, capsys):
+    sql_extract_process.main(loaded_db)
+    plain, _ = capsys.readouterr()
+    cache_path = tmp_path / "cache.db"
+    sql_extract_process.main(loaded_db, cache_path=cache_path)
+    sql_extract_process.main(loaded_db, cache_path=cache_path)
+    out, _ = capsys.readouterr()
+    reports = out.split("result cache: ")
+    assert reports[0] == plain
+    assert reports[1].split("\n", 1)[1] == plain
@@ -0,0 +1,86 @@
+"""
+Pytest integration tests of rollups
+"""
+import csv
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import rollups
+import sql_db_preparation
+from test_python_extract_1 import sqlite_import
+
+
+@pytest.fixture
+def loaded_db(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    activation_path = here / "tests" / "activation_load.csv"
+    sqlite_import(activation_path, db_path)
+    return db_path
+
+
+@pytest.mark.parametrize("period", list(rollups.PERIODS))
+def test_make_rollups(loaded_db, period):
+    connection = db.connect(loaded_db)
+    rollups.make_rollups(connection)
+    rows = rollups.rollup_range(connection, period, "0000-01-01", "9999-12-31")
+    assert sum(row[2] for row in rows) == 55
+    connection.close()
+
+
+def test_buckets(loaded_db):
+    connection = db.connect(loaded_db)
+    rollups.make_rollups(connection)
+    # 2001-10-28 20:49:15+00:00 is a Sunday.
+    [day] = rollups.rollup_range(connection, "day", "2001-10-28", "2001-10-28")
+    [week] = rollups.rollup_range(connection, "week", "2001-10-22", "2001-10-22")
+    [month] = rollups.rollup_range(connection, "month", "2001-10-01", "2001-10-01")
+    assert day == week[:1] + ("2001-10-28",) + week[2:]
+    assert month[1] == "2001-10-01"
+    assert day[2:] == (1, 1/60, 1/60, -1/60, -1/60)
+    connection.close()
+
+
+def test_refresh(loaded_db, capsys):
+    connection = db.connect(loaded_db)
+    rollups.make_rollups(connection)
+    connection.execute(
+        "INSERT INTO customer_device_service(customer_device_id, service_id, start, latitude, longitude) "
+        "VALUES(1, 1, '2001-10-27T01:02:03+00:00', 2.0, -2.0)"
+    )
+    connection.commit()
+    assert rollups.refresh_rollups(connection) == 1
+    assert rollups.refresh_rollups(connection) == 0
+    [week] = rollups.rollup_range(connection, "week", "2001-10-22", "2001-10-28")
+    assert week[2:] == (2, 1/60, 2.0, -2.0, -1/60)
+    out, err = capsys.readouterr()
+    assert out.splitlines() [-3:] == [
+        "rolled up 55 new rows", "rolled up 1 new rows", "rolled up 0 new rows"
+    ]
+    connection.execute("DELETE FROM customer_device_service WHERE rowid = 1")
+    connection.commit()
+    assert rollups.refresh_rollups(connection, rebuild=True) == 55
+    [week] = rollups.rollup_range(connection, "week", "2001-10-22", "2001-10-28")
+    assert week[2:] == (1, 2.0, 2.0, -2.0, -2.0)
+    connection.close()
+
+
+def test_main(loaded_db, tmp_path, capsys):
+    target = tmp_path / "rollup.csv"
+    rollups.main(str(loaded_db), "create", target)
+    rollups.main(
+        str(loaded_db), "extract", target,
+        period="month", start="2000-01-01", end="2009-12-31",
+        service_name="Oxkxwnqrsrpemok",
+    )
+    out, err = capsys.readouterr()
+    assert out.endswith("wrote 1 month buckets\n")
+    with target.open() as target_file:
+        rows = list(csv.DictReader(target_file))
+    assert rows[0]["service_name"] == "Oxkxwnqrsrpemok"
+    assert rows[0]["bucket"] == "2001-10-01"
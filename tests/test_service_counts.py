@@ -0,0 +1,83 @@
+"""
+Pytest integration tests of service_counts
+"""
+import csv
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import extract_engine
+import python_extract_1
+import service_counts
+import sql_db_preparation
+from test_python_extract_1 import sqlite_import
+
+
+@pytest.fixture
+def counted_db(tmp_path):
+    """Counts created before the load, so the triggers do the work."""
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    connection = db.connect(db_path)
+    service_counts.make_service_counts(connection)
+    connection.close()
+    activation_path = here / "tests" / "activation_load.csv"
+    sqlite_import(activation_path, db_path)
+    return db_path
+
+
+def test_triggers_on_load(counted_db):
+    connection = db.connect(counted_db)
+    assert service_counts.verify(connection) == {}
+    connection.row_factory = db.Row
+    expected = python_extract_1.cst_dev_svc_counts(connection)
+    connection.row_factory = None
+    assert service_counts.service_name_counts(connection) == expected
+    assert extract_engine.counts_materialized(connection) == expected
+    connection.close()
+
+
+def test_triggers_on_update_and_delete(counted_db):
+    connection = db.connect(counted_db)
+    connection.execute(
+        "UPDATE customer_device_service SET service_id = 1 WHERE rowid <= 5"
+    )
+    connection.execute("DELETE FROM customer_device_service WHERE rowid > 50")
+    connection.commit()
+    assert service_counts.verify(connection) == {}
+    (total,) = connection.execute(
+        "SELECT sum(activations) FROM service_activation_count"
+    ).fetchone()
+    assert total == 50
+    connection.close()
+
+
+def test_verify_and_rebuild(counted_db, capsys):
+    connection = db.connect(counted_db)
+    connection.execute(
+        "UPDATE service_activation_count SET activations = 99 WHERE service_id = 1"
+    )
+    connection.commit()
+    assert service_counts.main(str(counted_db), "verify", Path()) == 1
+    assert service_counts.main(str(counted_db), "rebuild", Path()) == 0
+    assert service_counts.main(str(counted_db), "verify", Path()) == 0
+    out, err = capsys.readouterr()
+    assert "rebuilt 55 service counts" in out
+    assert out.endswith("0 differences\n")
+    connection.close()
+
+
+def test_extract(counted_db, tmp_path, capsys):
+    target = tmp_path / "counts.csv"
+    service_counts.main(str(counted_db), "extract", target)
+    with target.open() as target_file:
+        rows = list(csv.DictReader(target_file))
+    assert len(rows) == 55
+
+    extract_engine.main(str(counted_db), tmp_path / "auto.csv")
+    out, err = capsys.readouterr()
+    assert out.endswith("materialized strategy\n")
@@ -0,0 +1,143 @@
+"""
+Pytest integration tests of spatial_index
+"""
+import csv
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import connection_factory
+import geohash
+import spatial_index
+import sql_db_preparation
+from test_python_extract_1 import sqlite_import
+
+
+@pytest.fixture
+def indexed_db(tmp_path):
+    """Index created before the load, so the triggers do the work."""
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    connection = db.connect(db_path)
+    spatial_index.make_spatial_index(connection)
+    connection.close()
+    activation_path = here / "tests" / "activation_load.csv"
+    sqlite_import(activation_path, db_path)
+    return db_path
+
+
+def test_triggers(indexed_db):
+    connection = db.connect(indexed_db)
+    (count,) = connection.execute(
+        "SELECT count(*) FROM activation_location"
+    ).fetchone()
+    assert count == 55
+    connection.execute(
+        "UPDATE customer_device_service SET latitude = 45.0 WHERE rowid = 1"
+    )
+    connection.execute("DELETE FROM customer_device_service WHERE rowid = 2")
+    connection.commit()
+    assert spatial_index.in_box(connection, 44, -1, 46, 0) == 1
+    (count,) = connection.execute(
+        "SELECT count(*) FROM activation_location"
+    ).fetchone()
+    assert count == 54
+    connection.close()
+
+
+@pytest.mark.parametrize(
+    "box", [(0, -1, 1, 0), (0.1, -0.5, 0.5, -0.1), (-90, -180, 90, 180)]
+)
+def test_box_agrees_with_scan(indexed_db, box):
+    connection = db.connect(indexed_db)
+    indexed = spatial_index.in_box(connection, *box, rows=True)
+    scanned = spatial_index.in_box(connection, *box, rows=True, indexed=False)
+    assert sorted(indexed) == sorted(scanned)
+    assert spatial_index.in_box(connection, *box) == len(scanned)
+    connection.close()
+
+
+@pytest.mark.parametrize("km", [1, 10, 50, 20_000])
+def test_radius_agrees_with_scan(indexed_db, km):
+    connection = connection_factory.connect(indexed_db)
+    indexed = spatial_index.in_radius(connection, 0.5, -0.5, km)
+    scanned = spatial_index.in_radius(connection, 0.5, -0.5, km, indexed=False)
+    assert indexed == scanned
+    connection.close()
+
+
+def test_radius_boxes():
+    [box] = spatial_index.radius_boxes(0, 0, spatial_index.KM_PER_DEGREE)
+    assert box == pytest.approx(
+        {"south": -1, "west": -1, "north": 1, "east": 1}, rel=1e-3
+    )
+    [polar] = spatial_index.radius_boxes(89.5, 10, 100)
+    assert (polar["west"], polar["east"]) == (-180, 180)
+    east, west = spatial_index.radius_boxes(0, 179.9, spatial_index.KM_PER_DEGREE)
+    assert (east["west"], east["east"]) == pytest.approx((178.9, 180))
+    assert (west["west"], west["east"]) == pytest.approx((-180, -179.1))
+
+
+def test_radius_across_antimeridian(indexed_db):
+    connection = connection_factory.connect(indexed_db)
+    connection.executemany(
+        "INSERT INTO customer_device_service(latitude, longitude) VALUES(?, ?)",
+        [(0, 179.95), (0, -179.95), (0, 179.0)],
+    )
+    connection.commit()
+    for indexed in (True, False):
+        rows = spatial_index.in_radius(
+            connection, 0, 179.9, 25, rows=True, indexed=indexed
+        )
+        assert sorted(row[4] for row in rows) == [-179.95, 179.95]
+        assert spatial_index.in_radius(connection, 0, -179.9, 25, indexed=indexed) == 2
+    connection.close()
+
+
+def test_haversine_km():
+    assert connection_factory.haversine_km(0, 0, 0, 1) == pytest.approx(
+        spatial_index.KM_PER_DEGREE
+    )
+    assert connection_factory.haversine_km(None, 0, 0, 1) is None
+
+
+def test_main(indexed_db, tmp_path, capsys):
+    options = spatial_index.get_options(
+        ["--db", str(indexed_db), "box", "--south", "0", "--west", "-1",
+         "--north", "1", "--east", "0"]
+    )
+    spatial_index.main(options)
+    target = tmp_path / "near.csv"
+    options = spatial_index.get_options(
+        ["--db", str(indexed_db), "-o", str(target),
+         "radius", "--lat", "0", "--lon", "0", "--km", "5"]
+    )
+    spatial_index.main(options)
+    out, err = capsys.readouterr()
+    lines = out.splitlines()
+    count = int(lines[-2].split()[0])
+    assert count > 0
+    with target.open() as target_file:
+        rows = list(csv.DictReader(target_file))
+    assert lines[-1] == f"wrote {len(rows)} activations"
+    assert list(rows[0]) == spatial_index.ROW_COLUMNS
+
+
+def test_main_rows_with_geohash(indexed_db, tmp_path):
+    connection = connection_factory.connect(indexed_db)
+    geohash.add_geohash_column(connection, 5)
+    connection.close()
+    target = tmp_path / "near.csv"
+    options = spatial_index.get_options(
+        ["--db", str(indexed_db), "-o", str(target),
+         "radius", "--lat", "0", "--lon", "0", "--km", "5"]
+    )
+    spatial_index.main(options)
+    with target.open() as target_file:
+        rows = list(csv.reader(target_file))
+    assert rows[0] == spatial_index.ROW_COLUMNS
+    assert all(len(row) == len(rows[0]) for row in rows[1:])
@@ -0,0 +1,146 @@
+"""
+Pytest integration tests of sql_db_preparation
+"""
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import connection_factory
+import sql_db_preparation
+
+
+@pytest.fixture()
+def db_fixture():
+    connection = db.connect(":memory:")
+    sql_db_preparation.make_tables(connection)
+    sql_db_preparation.make_unique_indexes(connection)
+    yield connection
+    connection.close()
+
+
+def test_merge_customer(db_fixture, capsys):
+    new, existing = sql_db_preparation.merge_customer(db_fixture, ["a", "b"])
+    assert (new, existing) == (2, 0)
+    before = dict(db_fixture.execute("SELECT customer_name, rowid FROM customer"))
+
+    new, existing = sql_db_preparation.merge_customer(db_fixture, ["b", "c", "a"])
+    assert (new, existing) == (1, 2)
+    after = dict(db_fixture.execute("SELECT customer_name, rowid FROM customer"))
+    assert after == before | {"c": 3}
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [
+        "inserted 2 new customer rows, 0 already present",
+        "inserted 1 new customer rows, 2 already present",
+    ]
+
+
+def test_merge_customer_device(db_fixture, capsys):
+    sql_db_preparation.merge_customer(db_fixture, ["a", "b"])
+    sql_db_preparation.merge_device_type(db_fixture, ["t"])
+    new, existing = sql_db_preparation.merge_customer_device(
+        db_fixture, [("a", "d1", "t"), ("b", "d1", "t")]
+    )
+    assert (new, existing) == (2, 0)
+    new, existing = sql_db_preparation.merge_customer_device(
+        db_fixture, [("b", "d1", "t"), ("a", "d2", "t")]
+    )
+    assert (new, existing) == (1, 1)
+    rows = db_fixture.execute(
+        "SELECT rowid, customer_id, device_name FROM customer_device ORDER BY rowid"
+    ).fetchall()
+    assert rows == [(1, 1, "d1"), (2, 2, "d1"), (3, 1, "d2")]
+
+
+def test_main_incremental(tmp_path, capsys):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    connection = db.connect(db_path)
+    before = connection.execute("SELECT rowid, * FROM service").fetchall()
+    connection.close()
+
+    capsys.readouterr()
+    sql_db_preparation.main(schema_path, db_path, [data_path], incremental=True)
+    out, err = capsys.readouterr()
+    assert "inserted 0 new service rows, 58 already present" in out
+
+    connection = db.connect(db_path)
+    after = connection.execute("SELECT rowid, * FROM service").fetchall()
+    connection.close()
+    assert after == before
+
+
+def test_strict_layout_foreign_keys():
+    connection = db.connect(":memory:")
+    connection.execute("PRAGMA foreign_keys = ON")
+    sql_db_preparation.make_strict_tables(connection)
+    assert connection_factory.schema_layout(connection) == "strict"
+    sql_db_preparation.merge_service(connection, ["s"])
+    with pytest.raises(db.IntegrityError):
+        connection.execute(
+            "INSERT INTO customer_device_service(customer_device_id, service_id) "
+            "VALUES(99, 1)"
+        )
+    with pytest.raises(db.IntegrityError):
+        connection.execute(
+            "INSERT INTO service(service_id, service_name) VALUES('one', 'x')"
+        )
+    connection.close()
+
+
+def test_migrate_to_strict(tmp_path, capsys):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    connection = db.connect(db_path)
+    assert connection_factory.schema_layout(connection) == "legacy"
+    before = connection.execute(
+        "SELECT rowid, customer_id, device_name FROM customer_device"
+    ).fetchall()
+    connection.close()
+
+    sql_db_preparation.main(schema_path, db_path, [data_path], layout="strict")
+    out, err = capsys.readouterr()
+    assert "copied 58 customer_device rows" in out
+    assert "inserted 0 new customer_device rows, 58 already present" in out
+
+    connection = db.connect(db_path)
+    assert connection_factory.schema_layout(connection) == "strict"
+    after = connection.execute(
+        "SELECT customer_device_id, customer_id, device_name FROM customer_device"
+    ).fetchall()
+    connection.close()
+    assert after == before
+
+
+def test_legacy_run_keeps_strict_layout(tmp_path, capsys):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path], layout="strict")
+    connection = db.connect(db_path)
+    connection.execute(
+        "INSERT INTO customer_device_service(customer_device_id, service_id) "
+        "VALUES(1, 1)"
+    )
+    connection.commit()
+    connection.close()
+    capsys.readouterr()
+
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    out, err = capsys.readouterr()
+    assert "the database has the strict layout; loading incrementally" in out
+    assert "inserted 0 new service rows" in out
+    connection = db.connect(db_path)
+    assert connection_factory.schema_layout(connection) == "strict"
+    (facts,) = connection.execute(
+        "SELECT count(*) FROM customer_device_service"
+    ).fetchone()
+    connection.close()
+    assert facts == 1
@@ -6,11 +6,13 @@ Low-level isolated tests with mock DB.
 High-level integration tests with temp DB.
 """
 from collections.abc import Iterator
+from pathlib import Path
 from unittest.mock import Mock, sentinel, call
 import sqlite3 as db
 
 import pytest
 
+import sql_db_preparation
 import sql_load_process
 
 ### Unit Tests -- In Isolation
@@ -201,3 +203,40 @@ def test_i_load_activation(db_fixture, integration_source, capsys):
 
 # Option 1:  Test **all** the functions in isolation.
 # Option 2:  Rely on the acceptance test data to touch all the various options and combinations.
+
+
+def test_load_activation_batched(mock_db: Mock) -> None:
+    source = [sentinel.ROW_1, sentinel.ROW_2, sentinel.ROW_3]
+    sql_load_process.load_activation(mock_db, source, batch_size=2)
+    executemany = mock_db.cursor.return_value.executemany
+    assert [c.args[1] for c in executemany.mock_calls] == [
+        [sentinel.ROW_1, sentinel.ROW_2],
+        [sentinel.ROW_3],
+    ]
+    assert mock_db.commit.call_count == 2
+
+
+def test_i_persist_batched(tmp_path, capsys):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    sql_load_process.main(db_path, [data_path], batch_size=7)
+    out, err = capsys.readouterr()
+    assert "inserted 100 new rows" in out
+    assert "loaded 55 final rows" in out
+
+    # Same rows as the single-transaction persist.
+    connection = db.connect(db_path)
+    batched = connection.execute(
+        "SELECT * FROM customer_device_service ORDER BY 1, 2"
+    ).fetchall()
+    connection.execute("DELETE FROM customer_device_service")
+    connection.commit()
+    sql_load_process.persist(connection)
+    single = connection.execute(
+        "SELECT * FROM customer_device_service ORDER BY 1, 2"
+    ).fetchall()
+    connection.close()
+    assert batched == single
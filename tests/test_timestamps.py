@@ -0,0 +1,114 @@
+"""
+Pytest tests of timestamps
+"""
+from collections import Counter
+import datetime
+from pathlib import Path
+import sqlite3 as db
+
+import pytest
+
+import python_load_process
+import rollups
+import sql_db_preparation
+import sql_load_process
+import timestamps
+from test_python_extract_1 import sqlite_import
+
+
+START = datetime.datetime(2001, 10, 28, 20, 49, 15, tzinfo=datetime.timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [
+        ("raw", START),
+        ("epoch", 1004302155),
+        ("utc-text", "2001-10-28T20:49:15Z"),
+    ],
+)
+def test_to_storage(mode, expected):
+    assert timestamps.to_storage(START, mode) == expected
+    eastern = START.astimezone(datetime.timezone(datetime.timedelta(hours=-5)))
+    assert timestamps.to_storage(eastern, mode) == expected
+
+
+@pytest.mark.parametrize(
+    "source",
+    ["2001-10-28T20:49:15+00:00", "2001-10-28 15:49:15-05:00", 1004302155],
+)
+def test_storage_sql(source):
+    connection = db.connect(":memory:")
+    epoch_sql = timestamps.storage_sql(":start", "epoch")
+    utc_sql = timestamps.storage_sql(":start", "utc-text")
+    row = connection.execute(
+        f"SELECT {epoch_sql}, {utc_sql}", {"start": source}
+    ).fetchone()
+    assert row == (1004302155, "2001-10-28T20:49:15Z")
+    connection.close()
+
+
+def test_persist_data_dict_epoch():
+    row = {
+        "customer_name": "Customer",
+        "device_name": "Device",
+        "service_name": "Service",
+        "start_date_datetime": START,
+        "lat_real": 1.0,
+        "lon_real": -1.0,
+    }
+    connection = db.connect(":memory:")
+    connection.execute("CREATE TABLE service(service_name)")
+    connection.execute("CREATE TABLE customer(customer_name)")
+    connection.execute("CREATE TABLE customer_device(customer_id, device_name)")
+    final = python_load_process.persist_data_dict(
+        Counter(), python_load_process.References(connection), row, "epoch"
+    )
+    assert final["start_date"] == 1004302155
+    connection.close()
+
+
+@pytest.fixture
+def prepared_db(tmp_path):
+    db_path = tmp_path / "test.db"
+    here = Path.cwd()
+    schema_path = here / "activation_source.schema"
+    data_path = here / "tests" / "activation_source.csv"
+    sql_db_preparation.main(schema_path, db_path, [data_path])
+    return db_path
+
+
+def test_sql_load_epoch(prepared_db):
+    data_path = Path.cwd() / "tests" / "activation_source.csv"
+    sql_load_process.main(prepared_db, [data_path], timestamps_mode="epoch")
+    connection = db.connect(prepared_db)
+    types = connection.execute(
+        "SELECT DISTINCT typeof(start) FROM customer_device_service"
+    ).fetchall()
+    assert types == [("integer",)]
+    (plan,) = connection.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM customer_device_service "
+        "WHERE start BETWEEN 0 AND 1000000000"
+    ).fetchall()
+    assert "customer_device_service_start_ix" in plan[-1]
+    connection.close()
+
+
+@pytest.mark.parametrize("mode", ["epoch", "utc-text"])
+def test_migrate(prepared_db, mode, capsys):
+    sqlite_import(Path.cwd() / "tests" / "activation_load.csv", prepared_db)
+    connection = db.connect(prepared_db)
+    rollups.make_rollups(connection)
+    before = rollups.rollup_range(connection, "week", "0000-01-01", "9999-12-31")
+    assert timestamps.migrate(connection, mode) == 55
+    assert timestamps.migrate(connection, mode) == 0
+    rows = connection.execute(
+        "SELECT start FROM customer_device_service WHERE rowid = 1"
+    ).fetchall()
+    assert rows == [(timestamps.to_storage(START, mode),)]
+    rollups.refresh_rollups(connection, rebuild=True)
+    after = rollups.rollup_range(connection, "week", "0000-01-01", "9999-12-31")
+    assert after == before
+    connection.close()
+    out, err = capsys.readouterr()
+    assert f"converted 55 start values to {mode}" in out